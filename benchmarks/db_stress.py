@@ -0,0 +1,106 @@
+"""
+Multi-threaded stress test for the SQLite access layer.
+
+Every worker registers its own user, stores a challenge list and then accepts,
+completes and rewards challenges one write at a time while reader threads keep
+calling ``load_state``. Every reward is sent twice, like a double click, and must
+be paid once. At the end each user's stored state must contain every write its
+worker made; any lost update or "database is locked" error fails the run.
+
+    python benchmarks/db_stress.py --workers 16 --writes 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=50, help="status writes per worker")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--db", default=None, help="database file (default: a temp file)")
+    args = parser.parse_args(argv)
+
+    os.environ["GREENMATCH_DB"] = args.db or os.path.join(tempfile.mkdtemp(), "stress.db")
+    from greenmatch import db, rewards
+
+    db.init_db()
+    errors = []
+    expected = {}
+    done = threading.Event()
+
+    def writer(n: int):
+        try:
+            user_id = db.create_user(f"stress{n}@example.com", f"Stress {n}", "pw")
+            challenges = [
+                {"id": f"c{i}", "title": f"Challenge {i}", "description": "", "difficulty": "Easy",
+                 "estimated_monthly_co2_saving_kg": i, "why_it_fits": ""}
+                for i in range(args.writes)
+            ]
+            db.save_state_fields(user_id, {"profile": {"name": f"Stress {n}"}, "challenges": challenges})
+            accepted, completed = set(), set()
+            for i in range(args.writes):
+                accepted.add(f"c{i}")
+                fields = {"accepted_ids": set(accepted)}
+                if i % 2:
+                    completed.add(f"c{i - 1}")
+                    fields["completed_ids"] = set(completed)
+                db.save_state_fields(user_id, fields)
+                for _ in range(2):
+                    rewards.award(user_id, f"c{i}", "accept", 3)
+            expected[user_id] = (accepted, completed, len(accepted) * 3)
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(f"writer {n}: {e!r}")
+
+    def reader():
+        reads = 0
+        while not done.is_set():
+            try:
+                for user_id in list(expected) or [1]:
+                    db.load_state(user_id)
+                    reads += 1
+            except Exception as e:
+                errors.append(f"reader: {e!r}")
+                return
+
+    readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+    writers = [threading.Thread(target=writer, args=(n,)) for n in range(args.workers)]
+    start = time.perf_counter()
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    done.set()
+    for t in readers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    lost = 0
+    for user_id, (accepted, completed, tokens) in expected.items():
+        state = db.load_state(user_id)
+        if (state["accepted_ids"], state["completed_ids"], state["tokens"]) != (accepted, completed, tokens):
+            lost += 1
+    # the incrementally maintained aggregates must match a full recomputation
+    with db.connection() as conn:
+        incremental = sorted(map(tuple, conn.execute("SELECT * FROM impact_stats").fetchall()))
+    with db.transaction() as conn:
+        db.rebuild_impact_stats(conn)
+        rebuilt = sorted(map(tuple, conn.execute("SELECT * FROM impact_stats").fetchall()))
+    if incremental != rebuilt:
+        errors.append("impact_stats drifted from challenge_events")
+    total_writes = args.workers * (3 * args.writes + 1)
+    print(f"{total_writes} transactions from {args.workers} threads in {elapsed:.2f}s "
+          f"({total_writes / elapsed:.0f}/s), {len(errors)} errors, {lost} users with lost writes")
+    for e in errors[:10]:
+        print(" ", e)
+    return 1 if errors or lost or len(expected) != args.workers else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
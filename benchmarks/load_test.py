@@ -0,0 +1,261 @@
+"""
+Headless load test for the GreenMatch app (main.py).
+
+Simulates N interleaved users with Streamlit's AppTest harness against a fresh
+temporary database and the local stub LLM backend. Each user registers, logs
+in, submits a profile, waits for the AI challenges, accepts and completes
+challenges, clicks around a few idle reruns, submits a proof photo and logs
+out. Every rerun is timed and attributed to its step; database write
+transactions are counted through the connection pool.
+
+Results are printed and, with --out, written as JSON so runs can be compared:
+
+    python benchmarks/load_test.py --users 20 --out bench.json
+    python benchmarks/load_test.py --users 20 --compare bench.json
+
+Proof uploads go through ProofStore/enqueue_proof directly, because AppTest
+cannot drive st.file_uploader; the card then polls the job like in the app.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 2),
+        "p50": round(pct(50), 2),
+        "p90": round(pct(90), 2),
+        "p95": round(pct(95), 2),
+        "p99": round(pct(99), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+# AppTest drives a process-global Streamlit runtime, so only one rerun can execute
+# per process at a time. Sessions in a process interleave rerun by rerun (background
+# workers keep running meanwhile); --processes adds real parallelism.
+_rerun_lock = threading.Lock()
+
+
+class SimulatedUser:
+    def __init__(self, n: int, args, timings: Dict[str, List[float]], lock: threading.Lock):
+        self.n = n
+        self.args = args
+        self.timings = timings
+        self.lock = lock
+        self.at = self._app()
+
+    def _app(self):
+        from streamlit.testing.v1 import AppTest
+
+        return AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=self.args.timeout)
+
+    def _run(self, step: str, action=None):
+        with _rerun_lock:
+            start = time.perf_counter()
+            (action or self.at).run()
+            elapsed = (time.perf_counter() - start) * 1000
+        if self.at.exception:
+            raise RuntimeError(f"{step}: {self.at.exception[0].message}")
+        with self.lock:
+            self.timings[step].append(elapsed)
+
+    def _button(self, label: str):
+        for b in self.at.button:
+            if str(b.label) == label or label in str(b.label):
+                return b
+        return None
+
+    def session(self):
+        at = self.at
+        email, pw = f"load{self.n}@example.com", "pw"
+        self._run("open")
+        at.text_input(key="r_email").input(email)
+        at.text_input(key="r_name").input(f"Load {self.n}")
+        at.text_input(key="r_pw1").input(pw)
+        at.text_input(key="r_pw2").input(pw)
+        self._run("register", self._button("Register").click())
+        at.text_input(key="l_email").input(email)
+        at.text_input(key="l_pw").input(pw)
+        self._run("login", self._button("Login").click())
+        self._resume_logged_in()
+        at = self.at
+
+        at.slider[0].set_value(20 + self.n % 60)
+        at.selectbox[0].set_value(["apartment", "house", "other"][self.n % 3])
+        self._run("submit_profile", self._button("Generate").click())
+        deadline = time.monotonic() + self.args.generation_wait
+        while any("Personalising" in str(i.value) for i in at.info) and time.monotonic() < deadline:
+            time.sleep(0.05)
+            self._run("await_generation")
+
+        for _ in range(self.args.accepts):
+            button = self._button("Accept")
+            if button is None:
+                break
+            self._run("accept", button.click())
+        self._run("idle")
+        button = self._button("Mark completed")
+        if button is not None:
+            self._run("complete", button.click())
+        for _ in range(self.args.idle):
+            self._run("idle")
+
+        self._submit_proof()
+        self._run("logout", self._button("Logout").click())
+
+    def _resume_logged_in(self):
+        # AppTest keeps the login form's widgets in its element tree after the
+        # st.rerun() that follows a login, and the next run fails looking up their
+        # state. Carry the logged-in user over to a fresh AppTest instead; its
+        # first run loads the user's state like a reconnecting browser tab.
+        user = self.at.session_state["user"] if "user" in self.at.session_state else None
+        if user is None:
+            raise RuntimeError("login: not logged in")
+        self.at = self._app()
+        self.at.session_state["user"] = user
+        self._run("home")
+
+    def _submit_proof(self):
+        from PIL import Image
+
+        from greenmatch import db, proofs
+
+        user = db.get_user_by_email(f"load{self.n}@example.com")
+        state = db.load_state(user["id"])
+        if not state or not state["challenges"]:
+            return
+        challenge = state["challenges"][0]
+        buf = io.BytesIO()
+        Image.effect_noise((1600, 1200), 40 + self.n).convert("RGB").save(buf, "JPEG")
+        start = time.perf_counter()
+        with _rerun_lock:
+            proofs.enqueue_proof(user["id"], challenge, proofs.ProofStore().save(buf.getvalue()))
+        with self.lock:
+            self.timings["proof_upload"].append((time.perf_counter() - start) * 1000)
+        self._run("idle")
+
+
+def run_shard(args, user_ids: List[int]) -> Dict[str, Any]:
+    """Run the given simulated users in this process; returns raw timings, errors and DB commits."""
+    os.chdir(ROOT)  # main.py reads its JSON data relative to the working directory
+    from greenmatch import db
+
+    timings: Dict[str, List[float]] = defaultdict(list)
+    lock = threading.Lock()
+    errors: List[str] = []
+    slots = threading.Semaphore(args.concurrency or len(user_ids) or 1)
+
+    def run_user(n: int):
+        with slots:
+            try:
+                SimulatedUser(n, args, timings, lock).session()
+            except Exception as e:
+                errors.append(f"user {n}: {e!r}")
+
+    commits_before = db.get_pool().commits
+    threads = [threading.Thread(target=run_user, args=(n,)) for n in user_ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {"timings": dict(timings), "errors": errors, "commits": db.get_pool().commits - commits_before}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Headless load test for main.py")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=None, help="interleaved sessions per process (default: all)")
+    parser.add_argument("--processes", type=int, default=1, help="app processes sharing the database")
+    parser.add_argument("--accepts", type=int, default=2)
+    parser.add_argument("--idle", type=int, default=3, help="extra no-op reruns per session")
+    parser.add_argument("--stub-latency", type=float, default=0.3)
+    parser.add_argument("--stub-failure-rate", type=float, default=0.0)
+    parser.add_argument("--generation-wait", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-rerun AppTest timeout")
+    parser.add_argument("--out", help="write JSON results here")
+    parser.add_argument("--compare", help="earlier JSON results to diff p95 latencies against")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="greenmatch-bench-")
+    os.environ["GREENMATCH_DB"] = os.path.join(workdir, "bench.db")
+    os.environ["GREENMATCH_UPLOAD_DIR"] = os.path.join(workdir, "uploads")
+    os.environ["GREENMATCH_LLM_BACKEND"] = "stub"
+    os.environ["GREENMATCH_STUB_LATENCY"] = str(args.stub_latency)
+    os.environ["GREENMATCH_STUB_FAILURE_RATE"] = str(args.stub_failure_rate)
+
+    from greenmatch import db
+
+    db.init_db()
+    processes = max(1, min(args.processes, args.users))
+    start = time.perf_counter()
+    if processes == 1:
+        shards = [run_shard(args, list(range(args.users)))]
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(processes) as pool:
+            shards = pool.starmap(run_shard, [(args, list(range(p, args.users, processes))) for p in range(processes)])
+    wall = time.perf_counter() - start
+
+    timings: Dict[str, List[float]] = defaultdict(list)
+    errors: List[str] = []
+    commits = 0
+    for shard in shards:
+        for step, values in shard["timings"].items():
+            timings[step].extend(values)
+        errors.extend(shard["errors"])
+        commits += shard["commits"]
+
+    all_reruns = [ms for step, values in timings.items() if step != "proof_upload" for ms in values]
+    results: Dict[str, Any] = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "wall_seconds": round(wall, 2),
+        "reruns": len(all_reruns),
+        "throughput_reruns_per_s": round(len(all_reruns) / wall, 2) if wall else 0.0,
+        "latency_ms": percentiles(all_reruns),
+        "latency_ms_by_step": {step: percentiles(v) for step, v in sorted(timings.items())},
+        "db_write_transactions": commits,
+        "db_writes_per_rerun": round(commits / len(all_reruns), 3) if all_reruns else 0.0,
+        "errors": errors,
+    }
+
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            before = json.load(f)
+        print("\np95 latency vs. baseline (ms):")
+        for step, now in results["latency_ms_by_step"].items():
+            old = before.get("latency_ms_by_step", {}).get(step, {}).get("p95")
+            if old:
+                print(f"  {step:18s} {old:9.1f} -> {now['p95']:9.1f} ({(now['p95'] - old) / old:+.0%})")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
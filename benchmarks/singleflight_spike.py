@@ -0,0 +1,93 @@
+"""
+Spike test for the single-flight layer in front of model calls.
+
+Several processes, each with many threads, request challenges for a small set
+of distinct profiles at the same moment against the local stub backend with a
+fixed latency. Without single-flight every request is a backend call; with it
+there should be about one call per distinct profile in total, across all
+processes, while every request still gets an answer.
+
+    python benchmarks/singleflight_spike.py --processes 4 --threads 25 --distinct 5
+    python benchmarks/singleflight_spike.py --no-singleflight
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def run_process(args, start_at: float) -> Dict[str, Any]:
+    from greenmatch.llm import ResilientLLM, StubBackend
+    from greenmatch.singleflight import SingleFlight
+
+    backend = StubBackend(latency=args.latency)
+    llm = ResilientLLM(backend)
+    flight = SingleFlight()
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def request(n: int):
+        prompt = f"profile {n % args.distinct}"
+        time.sleep(max(0.0, start_at - time.time()))
+        started = time.perf_counter()
+        try:
+            if args.no_singleflight:
+                llm.generate(prompt)
+            else:
+                flight.do(f"bench:{prompt}", llm.generate, prompt)
+        except Exception as e:
+            errors.append(repr(e))
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=request, args=(n,)) for n in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {"calls": backend.calls, "latencies": latencies, "errors": errors}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrent identical model requests with and without single-flight")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=25, help="requests per process")
+    parser.add_argument("--distinct", type=int, default=5, help="distinct profiles among the requests")
+    parser.add_argument("--latency", type=float, default=1.0, help="stub backend latency in seconds")
+    parser.add_argument("--no-singleflight", action="store_true")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="greenmatch-spike-")
+    os.environ["GREENMATCH_DB"] = os.path.join(workdir, "spike.db")
+    from greenmatch import db
+
+    db.init_db()
+    start_at = time.time() + 2.0  # let every process finish importing before the spike
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(args.processes) as pool:
+        results = pool.starmap(run_process, [(args, start_at)] * args.processes)
+
+    latencies = sorted(x * 1000 for r in results for x in r["latencies"])
+    errors = [e for r in results for e in r["errors"]]
+    requests = args.processes * args.threads
+    calls = sum(r["calls"] for r in results)
+    print(f"requests: {requests}  distinct: {args.distinct}  backend calls: {calls}  errors: {len(errors)}")
+    print(
+        f"latency ms: p50 {statistics.median(latencies):.0f}  "
+        f"p95 {latencies[int(0.95 * (len(latencies) - 1))]:.0f}  max {latencies[-1]:.0f}"
+    )
+    for e in errors[:5]:
+        print(f"  {e}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Spike test for the rewards wheel during a campaign.
+
+Several processes, each with many threads, spin the wheel at the same moment
+for funded users; every spin is sent twice with the same request id, as a
+retried request would be. Afterwards the run checks that no limited prize was
+handed out beyond its stock, that every draw was charged exactly once and that
+the materialized balances still match the reward ledger.
+
+    python benchmarks/wheel_spike.py --processes 4 --threads 50 --spins 10
+    python benchmarks/wheel_spike.py --free-months 3
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CAMPAIGN = "spike"
+
+
+def run_process(args, index: int, user_ids: List[int], start_at: float) -> Dict[str, Any]:
+    from greenmatch.wheel import DEFAULT_REWARDS, Wheel, WheelError
+
+    wheel = Wheel(CAMPAIGN, DEFAULT_REWARDS)
+    latencies, errors, refused = [], [], []
+    repeats = 0
+    lock = threading.Lock()
+
+    def spins(user_id: int):
+        nonlocal repeats
+        time.sleep(max(0.0, start_at - time.time()))
+        for n in range(args.spins):
+            request_id = f"{index}-{user_id}-{n}"
+            started = time.perf_counter()
+            try:
+                first = wheel.spin(user_id, request_id)
+                again = wheel.spin(user_id, request_id)
+            except WheelError as e:
+                refused.append(repr(e))
+                continue
+            except Exception as e:
+                errors.append(repr(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                repeats += again["repeat"]
+            if again["id"] != first["id"]:
+                errors.append(f"request {request_id} drew twice: {first['id']} and {again['id']}")
+
+    threads = [threading.Thread(target=spins, args=(u,)) for u in user_ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {"latencies": latencies, "errors": errors, "refused": refused, "repeats": repeats}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrent wheel spins; checks stock and the points ledger")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=50, help="users spinning per process")
+    parser.add_argument("--spins", type=int, default=10, help="spins per user")
+    parser.add_argument("--free-months", type=int, default=5, help="stock of the top prize")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="greenmatch-wheel-")
+    os.environ["GREENMATCH_DB"] = os.path.join(workdir, "wheel.db")
+    from greenmatch import db, rewards
+    from greenmatch.wheel import DEFAULT_REWARDS, SPIN_COST, load_campaign, set_stock
+
+    db.init_db()
+    load_campaign(CAMPAIGN, DEFAULT_REWARDS)
+    set_stock(CAMPAIGN, "free_month", args.free_months)
+    initial = {r["id"]: r["stock"] for r in DEFAULT_REWARDS}
+    initial["free_month"] = args.free_months
+
+    users = args.processes * args.threads
+    for n in range(users):
+        db.create_user(f"spin{n}@example.com", f"Spinner {n}", "pw")
+    with db.connection() as conn:
+        user_ids = [r["id"] for r in conn.execute("SELECT id FROM users ORDER BY id").fetchall()]
+    for u in user_ids:
+        rewards.award(u, "wheel-spike", "grant", SPIN_COST * args.spins)
+
+    start_at = time.time() + 2.0  # let every process finish importing before the spike
+    ctx = multiprocessing.get_context("spawn")
+    chunks = [(args, i, user_ids[i * args.threads:(i + 1) * args.threads], start_at) for i in range(args.processes)]
+    with ctx.Pool(args.processes) as pool:
+        results = pool.starmap(run_process, chunks)
+    elapsed = time.time() - start_at
+
+    errors = [e for r in results for e in r["errors"]]
+    with db.connection() as conn:
+        stock = {
+            r["reward_id"]: (r["stock"], r["awarded"])
+            for r in conn.execute("SELECT reward_id, stock, awarded FROM wheel_rewards WHERE campaign = ?", (CAMPAIGN,))
+        }
+        draws = conn.execute("SELECT COUNT(*) FROM wheel_draws").fetchone()[0]
+        charged = conn.execute("SELECT COUNT(*) FROM reward_events WHERE action = 'spin'").fetchone()[0]
+    for reward_id, (left, awarded) in stock.items():
+        if initial[reward_id] is not None and (left < 0 or left + awarded != initial[reward_id]):
+            errors.append(f"{reward_id}: {awarded} awarded, {left} left of {initial[reward_id]}")
+    if charged != draws or sum(a for _, a in stock.values()) != draws:
+        errors.append(f"{draws} draws, {charged} charges, {sum(a for _, a in stock.values())} awarded")
+    drift = rewards.rebuild_balances()
+    if drift:
+        errors.append(f"{drift} balances did not match the ledger")
+
+    latencies = sorted(x * 1000 for r in results for x in r["latencies"])
+    print(
+        f"spins: {draws} by {users} users in {elapsed:.1f}s ({draws / max(elapsed, 1e-9):.0f}/s)  "
+        f"repeats answered: {sum(r['repeats'] for r in results)}  refused: {sum(len(r['refused']) for r in results)}"
+    )
+    if latencies:
+        print(
+            f"latency ms (spin + repeat): p50 {statistics.median(latencies):.1f}  "
+            f"p95 {latencies[int(0.95 * (len(latencies) - 1))]:.1f}  max {latencies[-1]:.1f}"
+        )
+    for reward_id, (left, awarded) in stock.items():
+        print(f"  {reward_id:<20} awarded {awarded:>5}  left {'unlimited' if left is None else left}")
+    print(f"errors: {len(errors)}")
+    for e in errors[:5]:
+        print(f"  {e}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
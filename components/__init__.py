@@ -0,0 +1 @@
+"""Small HTML components for the Streamlit pages."""
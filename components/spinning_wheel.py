@@ -0,0 +1,95 @@
+"""
+Rewards wheel that only animates a result decided on the server.
+
+The wheel is drawn on a canvas in a ``components.html`` iframe and never picks
+an outcome itself: it spins to ``target_index`` when given one. The HTML only
+changes with ``spin_id``, so a rerun that shows the same draw does not replay
+the animation.
+"""
+import html
+import json
+from typing import List, Optional
+
+import streamlit.components.v1 as components
+
+COLORS = ("#08912a", "#2ddd68")
+SPIN_SECONDS = 4.5
+FULL_TURNS = 6
+
+_TEMPLATE = """
+<div style="display:flex;flex-direction:column;align-items:center;font-family:sans-serif">
+  <div style="position:relative;width:__SIZE__px;height:__SIZE__px">
+    <canvas id="wheel" width="__SIZE__" height="__SIZE__"
+      style="transition:transform __SECONDS__s cubic-bezier(0.15,0.85,0.25,1)"></canvas>
+    <div style="position:absolute;top:-4px;left:50%;transform:translateX(-50%);width:0;height:0;
+      border-left:12px solid transparent;border-right:12px solid transparent;border-top:24px solid #fdcf3b"></div>
+  </div>
+  <p id="result" style="min-height:1.5em;font-weight:600;color:#2ddd68">__IDLE__</p>
+</div>
+<script>
+const items = __ITEMS__;
+const target = __TARGET__;
+const canvas = document.getElementById("wheel");
+const ctx = canvas.getContext("2d");
+const r = canvas.width / 2;
+const slice = 2 * Math.PI / items.length;
+const colors = __COLORS__;
+items.forEach((label, i) => {
+  // slice i is centred on the pointer (12 o'clock) at rotation 0
+  const start = -Math.PI / 2 + (i - 0.5) * slice;
+  ctx.beginPath();
+  ctx.moveTo(r, r);
+  ctx.arc(r, r, r - 2, start, start + slice);
+  ctx.fillStyle = items.length % 2 && i === items.length - 1 ? "#1c6b35" : colors[i % 2];
+  ctx.fill();
+  ctx.save();
+  ctx.translate(r, r);
+  ctx.rotate(start + slice / 2);
+  ctx.fillStyle = "#fff";
+  ctx.font = "bold 12px sans-serif";
+  ctx.textAlign = "right";
+  ctx.textBaseline = "middle";
+  ctx.fillText(label.length > 22 ? label.slice(0, 21) + "…" : label, r - 12, 0);
+  ctx.restore();
+});
+if (target !== null) {
+  const degrees = __TURNS__ * 360 - target * 360 / items.length;
+  requestAnimationFrame(() => requestAnimationFrame(() => {
+    canvas.style.transform = `rotate(${degrees}deg)`;
+  }));
+  setTimeout(() => {
+    document.getElementById("result").textContent = __WON__;
+  }, __SECONDS__ * 1000);
+}
+</script>
+"""
+
+
+def _js(value) -> str:
+    # json.dumps is valid JS; escape "</" so a label cannot close the script tag
+    return json.dumps(value).replace("</", "<\\/")
+
+
+def spinning_wheel(
+    items: List[str],
+    target_index: Optional[int] = None,
+    spin_id: Optional[object] = None,
+    size: int = 340,
+    idle_text: str = "",
+):
+    """Draw the wheel; with ``target_index`` it spins to that slice and then names it."""
+    target = target_index if target_index is not None and 0 <= target_index < len(items) else None
+    won = f"🎉 You won: {items[target]}" if target is not None else ""
+    page = (
+        _TEMPLATE.replace("__SIZE__", str(int(size)))
+        .replace("__SECONDS__", str(SPIN_SECONDS))
+        .replace("__TURNS__", str(FULL_TURNS))
+        .replace("__IDLE__", html.escape(idle_text))
+        .replace("__ITEMS__", _js(list(items)))
+        .replace("__TARGET__", _js(target))
+        .replace("__COLORS__", _js(list(COLORS)))
+        .replace("__WON__", _js(won))
+    )
+    # spin_id makes every new draw a different document, which restarts the animation
+    page += f"<!-- spin {html.escape(str(spin_id))} -->"
+    components.html(page, height=int(size) + 60)
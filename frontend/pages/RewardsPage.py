@@ -1,25 +1,21 @@
+import os
+import sys
+
 import streamlit as st
-from components.spinning_wheel import spinning_wheel
 
-st.title("🎁 Yippie Rewards Wheel")
+# the wheel component and the draw engine live with the GreenMatch app in the repo root
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
 
-st.write("Spin the wheel to discover your exclusive reward!")
+from components.spinning_wheel import spinning_wheel  # noqa: E402
+from greenmatch.wheel import DEFAULT_REWARDS  # noqa: E402
 
-# Custom rewards wheel with controlled outcome
-reward_items = [
-    "Free Month of Energy",
-    "20% Bill Discount",
-    "$100 Gift Card",
-    "Priority Support",
-    "Solar Panel Consultation",
-    "Energy Efficiency Audit",
-    "Smart Home Device",
-    "VIP Customer Status"
-]
+st.title("🎁 Yippie Rewards Wheel")
 
-st.write("**Click SPIN to win your reward!**")
-result = spinning_wheel(items=reward_items, target_index=2)  # Always stops on "$100 Gift Card"
+st.write("Spin the wheel to discover your exclusive reward!")
 
-if result:
-    st.success(f"🎉 Congratulations! You won: **{result}**")
-    st.balloons()
+# Outcomes are drawn on the server against your reward points and the prize
+# stock, so this page only shows the wheel; spins happen in the GreenMatch app.
+reward_items = [r["label"] for r in DEFAULT_REWARDS]
+spinning_wheel(items=reward_items, idle_text="Log in to GreenMatch and open “Rewards wheel” to spin.")
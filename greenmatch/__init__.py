@@ -0,0 +1 @@
+"""Backend helpers for the GreenMatch Streamlit app (storage, persistence)."""
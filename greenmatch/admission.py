@@ -0,0 +1,203 @@
+"""
+Process-wide admission control for model calls.
+
+Every call has to be admitted before it reaches the provider. A call is
+admitted when it is at the head of the queue, fewer than ``max_concurrency``
+calls are running and the token bucket (``rate`` calls per second, up to
+``burst`` at once) has a token. The queue is ordered by priority, so a user
+waiting for challenges goes ahead of background proof checks, then by arrival.
+
+Nothing waits longer than its priority's ``max_wait``. When the wait expected
+from the queue length, the recent call duration and the rate limit is already
+longer than that, the call is rejected at once instead of queueing, and the
+caller takes its fallback path. ``user_quota`` caps admitted calls per user and
+``quota_window`` seconds. Queue times are recorded as ``admission.wait.<priority>``
+and rejections as ``admission.rejected.<reason>`` in ``greenmatch.metrics``.
+"""
+import contextlib
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from greenmatch import metrics
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+DEFAULT_MAX_WAIT = {
+    INTERACTIVE: float(os.getenv("GREENMATCH_LLM_MAX_WAIT_INTERACTIVE", "3")),
+    BACKGROUND: float(os.getenv("GREENMATCH_LLM_MAX_WAIT_BACKGROUND", "30")),
+}
+# Starting guess for the duration of one call, until real calls have been timed.
+INITIAL_SERVICE_SECONDS = 5.0
+SERVICE_SMOOTHING = 0.2
+
+
+class Rejected(Exception):
+    """
+    The call was not admitted; ``reason`` is "quota", "overload" or "timeout".
+    ``retry_after`` is the seconds until a quota frees up, 0 when unknown.
+    """
+
+    def __init__(self, reason: str, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        rate: float = 0.0,
+        burst: Optional[int] = None,
+        user_quota: int = 0,
+        quota_window: float = 3600.0,
+        max_wait: Optional[Dict[int, float]] = None,
+    ):
+        """``rate`` and ``user_quota`` of 0 mean unlimited."""
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, max_concurrency)
+        self.user_quota = user_quota
+        self.quota_window = quota_window
+        self.max_wait = {**DEFAULT_MAX_WAIT, **(max_wait or {})}
+        self.service_seconds = INITIAL_SERVICE_SECONDS
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._queue: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._user_calls: Dict[Hashable, Deque[float]] = {}
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+
+    def _refill(self, now: float):
+        if self.rate:
+            self._tokens = min(float(self.burst), self._tokens + (now - self._refilled) * self.rate)
+        else:
+            self._tokens = float(self.burst)
+        self._refilled = now
+
+    def _expected_wait(self, position: int) -> float:
+        """Seconds until the ``position``-th call in line (1 = next) would be admitted."""
+        free = self.max_concurrency - self._active
+        if position <= free and position <= self._tokens:
+            return 0.0
+        throughput = self.max_concurrency / max(self.service_seconds, 1e-3)
+        if self.rate:
+            throughput = min(throughput, self.rate)
+        return position / throughput
+
+    def _reject(self, reason: str, message: str, retry_after: float = 0.0):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        metrics.inc(f"admission.rejected.{reason}")
+        raise Rejected(reason, message, retry_after)
+
+    def _quota_used(self, user: Hashable, now: float) -> Deque[float]:
+        calls = self._user_calls.setdefault(user, deque())
+        while calls and calls[0] <= now - self.quota_window:
+            calls.popleft()
+        return calls
+
+    def acquire(
+        self, user: Optional[Hashable] = None, priority: int = INTERACTIVE, max_wait: Optional[float] = None
+    ) -> float:
+        """Block until admitted and return the seconds waited, or raise ``Rejected``."""
+        max_wait = self.max_wait.get(priority, 0.0) if max_wait is None else max_wait
+        started = time.monotonic()
+        with self._cond:
+            self._refill(started)
+            if user is not None and self.user_quota:
+                calls = self._quota_used(user, started)
+                if len(calls) >= self.user_quota:
+                    self._reject(
+                        "quota",
+                        f"user {user} used {self.user_quota} model calls in {self.quota_window:.0f}s",
+                        # the oldest call in the window has to age out first
+                        calls[0] + self.quota_window - started,
+                    )
+            position = 1 + sum(1 for p, _ in self._queue if p <= priority)
+            expected = self._expected_wait(position)
+            if expected > max_wait:
+                self._reject("overload", f"expected wait {expected:.1f}s exceeds {max_wait:.1f}s")
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._queue, entry)
+            deadline = started + max_wait
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._queue[0] == entry and self._active < self.max_concurrency and self._tokens >= 1:
+                    heapq.heappop(self._queue)
+                    break
+                if now >= deadline:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self._cond.notify_all()
+                    self._reject("timeout", f"not admitted within {max_wait:.1f}s")
+                timeout = deadline - now
+                if self._tokens < 1 and self.rate:
+                    timeout = min(timeout, (1 - self._tokens) / self.rate)
+                self._cond.wait(timeout)
+
+            self._active += 1
+            self._tokens -= 1
+            self.admitted += 1
+            if user is not None and self.user_quota:
+                self._quota_used(user, now).append(now)
+            self._cond.notify_all()  # the next in line may fit as well
+        waited = time.monotonic() - started
+        metrics.observe(f"admission.wait.{PRIORITY_NAMES.get(priority, priority)}", waited)
+        return waited
+
+    def release(self, service_seconds: Optional[float] = None):
+        with self._cond:
+            self._active -= 1
+            if service_seconds is not None:
+                self.service_seconds += SERVICE_SMOOTHING * (service_seconds - self.service_seconds)
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def admit(
+        self, user: Optional[Hashable] = None, priority: int = INTERACTIVE, max_wait: Optional[float] = None
+    ) -> Iterator[float]:
+        waited = self.acquire(user, priority, max_wait)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            queued = {name: sum(1 for p, _ in self._queue if p == prio) for prio, name in PRIORITY_NAMES.items()}
+            return {
+                "active": self._active,
+                "queued": queued,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "service_seconds": round(self.service_seconds, 2),
+            }
+
+
+def admission_from_env() -> AdmissionController:
+    """
+    ``GREENMATCH_LLM_CONCURRENCY`` (default 8), ``GREENMATCH_LLM_RATE`` (calls/s,
+    0 = unlimited), ``GREENMATCH_LLM_BURST`` and ``GREENMATCH_LLM_USER_QUOTA``
+    (calls per user and hour, 0 = unlimited).
+    """
+    burst = os.getenv("GREENMATCH_LLM_BURST")
+    return AdmissionController(
+        max_concurrency=int(os.getenv("GREENMATCH_LLM_CONCURRENCY", "8")),
+        rate=float(os.getenv("GREENMATCH_LLM_RATE", "0")),
+        burst=int(burst) if burst else None,
+        user_quota=int(os.getenv("GREENMATCH_LLM_USER_QUOTA", "0")),
+    )
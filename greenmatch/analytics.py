@@ -0,0 +1,101 @@
+"""
+Read side of the impact and engagement aggregates.
+
+``impact_stats`` is maintained by ``greenmatch.db`` in the same transaction as
+every accept/complete, one row per (dimension, value, day) plus an all-time
+row per (dimension, value). Everything here reads those rows or walks the
+``user_state(tokens)`` index, so cost depends on the number of companies,
+days and leaderboard entries shown, not on the number of users.
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+from greenmatch import db
+
+# Comma-separated emails that may see the admin dashboard and performance panel.
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("GREENMATCH_ADMINS", "").split(",") if e.strip()}
+
+
+def is_admin(email: Optional[str]) -> bool:
+    return bool(email) and email.lower() in ADMIN_EMAILS
+
+
+def _rows(sql: str, params=()) -> List[Dict[str, Any]]:
+    with db.connection() as conn:
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+
+def impact_totals() -> Dict[str, Any]:
+    rows = _rows(
+        """
+        SELECT accepted, completed, co2_accepted, co2_completed FROM impact_stats
+        WHERE dimension = 'all' AND value = '' AND day = ?
+        """,
+        (db.TOTAL_DAY,),
+    )
+    return rows[0] if rows else {"accepted": 0, "completed": 0, "co2_accepted": 0.0, "co2_completed": 0.0}
+
+
+def impact_by(dimension: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """All-time counts and CO2 per value of ``dimension`` (company, difficulty or housing)."""
+    if dimension not in db.IMPACT_DIMENSIONS:
+        raise ValueError(f"unknown dimension: {dimension}")
+    return _rows(
+        f"""
+        SELECT value AS {dimension}, accepted, completed, co2_accepted, co2_completed
+        FROM impact_stats WHERE dimension = ? AND day = ?
+        ORDER BY accepted DESC, value LIMIT ?
+        """,
+        (dimension, db.TOTAL_DAY, limit),
+    )
+
+
+def daily_impact(days: int = 30) -> List[Dict[str, Any]]:
+    """Per-day totals for the most recent ``days`` days that had any activity, oldest first."""
+    rows = _rows(
+        """
+        SELECT day, accepted, completed, co2_accepted, co2_completed FROM impact_stats
+        WHERE dimension = 'all' AND value = '' AND day != ?
+        ORDER BY day DESC LIMIT ?
+        """,
+        (db.TOTAL_DAY, days),
+    )
+    return rows[::-1]
+
+
+def leaderboard(limit: int = 10) -> List[Dict[str, Any]]:
+    """Top reward balances, ties by user id; names are shortened to a first name."""
+    rows = _rows(
+        """
+        SELECT s.user_id, u.name, s.tokens FROM user_state s JOIN users u ON u.id = s.user_id
+        WHERE s.tokens > 0 ORDER BY s.tokens DESC, s.user_id LIMIT ?
+        """,
+        (limit,),
+    )
+    return [
+        {
+            "rank": i + 1,
+            "user_id": r["user_id"],
+            "name": (r["name"] or "").split(" ")[0] or "Anonymous",
+            "points": r["tokens"],
+        }
+        for i, r in enumerate(rows)
+    ]
+
+
+def rank_for(user_id: int, points: int) -> Optional[int]:
+    """1-based ``leaderboard()`` position of a user with ``points``; None without points."""
+    if not points:
+        return None
+    with db.connection() as conn:
+        ahead = conn.execute(
+            "SELECT COUNT(*) FROM user_state WHERE tokens > ? OR (tokens = ? AND user_id < ?)",
+            (points, points, user_id),
+        ).fetchone()[0]
+    return ahead + 1
+
+
+def rebuild() -> None:
+    """Recompute ``impact_stats`` from scratch (after a bulk import or a manual fix)."""
+    with db.transaction() as conn:
+        db.rebuild_impact_stats(conn)
@@ -0,0 +1,90 @@
+"""
+Bounded background execution for slow model calls.
+
+The UI renders something useful straight away and hands the slow call to a
+small shared worker pool. Each submitted job carries a deadline; callers poll
+``BackgroundJob.done()`` / ``expired()`` on later reruns and swap in the
+result when it arrives. Jobs submitted with ``stream=True`` also get an
+``emit`` callback; whatever the job emits shows up in
+``BackgroundJob.partial`` before the job finishes, so callers can show results
+one by one. When the pool already has ``max_pending`` unfinished jobs new
+work is refused, so a spike degrades to the fast path instead of a long queue.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+DEFAULT_WORKERS = int(os.getenv("GREENMATCH_LLM_WORKERS", "4"))
+DEFAULT_DEADLINE_SECONDS = float(os.getenv("GREENMATCH_LLM_DEADLINE", "60"))
+
+
+class BackgroundJob:
+    def __init__(self, future: Future, deadline: float, partial: Optional[List[Any]] = None):
+        self.future = future
+        self.started = time.monotonic()
+        self.deadline = deadline
+        self.partial = partial if partial is not None else []  # appended to by the worker thread
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def expired(self) -> bool:
+        return not self.future.done() and time.monotonic() > self.deadline
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def result(self, default: Any = None) -> Any:
+        """The job's return value, or ``default`` if it failed or is not finished."""
+        if not self.future.done() or self.future.cancelled() or self.future.exception() is not None:
+            return default
+        return self.future.result()
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_WORKERS,
+        max_pending: Optional[int] = None,
+        deadline_seconds: float = DEFAULT_DEADLINE_SECONDS,
+        name: str = "greenmatch-llm",
+    ):
+        self.max_pending = max_pending if max_pending is not None else max_workers * 8
+        self.deadline_seconds = deadline_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        deadline_seconds: Optional[float] = None,
+        stream: bool = False,
+        **kwargs,
+    ) -> Optional[BackgroundJob]:
+        """
+        Queue ``fn(*args, **kwargs)``; returns ``None`` when the pool is saturated.
+        With ``stream=True``, ``fn`` is also passed ``emit=job.partial.append``.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+        partial: List[Any] = []
+        if stream:
+            kwargs["emit"] = partial.append
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._finished)
+        timeout = self.deadline_seconds if deadline_seconds is None else deadline_seconds
+        return BackgroundJob(future, time.monotonic() + timeout, partial)
+
+    def _finished(self, _future: Future):
+        with self._lock:
+            self._pending -= 1
@@ -0,0 +1,449 @@
+"""
+Streaming bulk import/export of users and their state.
+
+    python -m greenmatch.bulk export customers.ndjson
+    python -m greenmatch.bulk import crm_onboarding.csv --batch-size 5000
+
+One record per user: ``email``, ``name``, ``password`` (hashed on import, like
+``create_user``) or ``password_hash``, ``created_at``, ``profile``, ``tokens``
+and ``challenges`` (each with optional ``status`` / ``accepted_at`` /
+``completed_at``). NDJSON holds one JSON object per line; CSV has the same
+columns with ``profile`` and ``challenges`` as JSON text. ``.gz`` files are
+(de)compressed on the fly.
+
+Both directions stream in batches, so memory does not grow with the file.
+Each import batch is a single transaction of ``executemany`` inserts that also
+stores the read position in ``import_checkpoints``; an interrupted import
+picks up after the last committed batch when run again. Emails that already
+exist are skipped, which makes re-running an import harmless.
+"""
+import argparse
+import contextlib
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from greenmatch import db
+
+DEFAULT_BATCH_SIZE = 5000
+CSV_FIELDS = ("email", "name", "password", "password_hash", "created_at", "profile", "tokens", "challenges")
+STATUS_KEYS = ("status", "accepted_at", "completed_at")
+
+
+class Stats:
+    def __init__(self, records: int = 0):
+        self.records = records
+        self.imported = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.errors: List[str] = []
+        self.started = time.perf_counter()
+        self._initial = records
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return (self.records - self._initial) / elapsed if elapsed else 0.0
+
+    def line(self, fraction: Optional[float] = None) -> str:
+        done = f" ({fraction:.0%})" if fraction is not None else ""
+        return (
+            f"{self.records:,} records{done}: {self.imported:,} imported, {self.skipped:,} skipped, "
+            f"{self.invalid:,} invalid, {self.rate():,.0f} records/s"
+        )
+
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    return "csv" if name.endswith(".csv") else "ndjson"
+
+
+def _open(path: str, mode: str):
+    if path == "-":
+        return contextlib.nullcontext(sys.stdout.buffer if "w" in mode else sys.stdin.buffer)
+    return gzip.open(path, mode) if path.endswith(".gz") else open(path, mode)
+
+
+# -- reading ----------------------------------------------------------------------
+
+
+def read_ndjson(path: str, start: int = 0) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+    """Yield ``(byte offset after the line, record)``; ``record`` is None for a bad line."""
+    with _open(path, "rb") as f:
+        if start:
+            f.seek(start)
+        for line in iter(f.readline, b""):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield f.tell(), record if isinstance(record, dict) else None
+
+
+def read_csv(path: str, start: int = 0) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+    """Yield ``(records read so far, record)``; the first ``start`` records are skipped."""
+    with _open(path, "rb") as raw:
+        reader = csv.DictReader(io.TextIOWrapper(raw, encoding="utf-8", newline=""))
+        for n, row in enumerate(reader, 1):
+            if n <= start:
+                continue
+            try:
+                record: Optional[Dict[str, Any]] = {k: v for k, v in row.items() if k and v not in (None, "")}
+                for key in ("profile", "challenges"):
+                    if key in record:
+                        record[key] = json.loads(record[key])
+            except ValueError:
+                record = None
+            yield n, record
+
+
+# -- import -----------------------------------------------------------------------
+
+
+def _tokens(value: Any) -> Optional[int]:
+    """A non-negative whole number of points (``12``, ``"12"``, ``12.0``), else ``None``."""
+    if value in (None, ""):
+        return 0
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float):
+        tokens = int(value) if value.is_integer() else -1
+    else:
+        try:
+            tokens = int(str(value).strip())
+        except ValueError:
+            return None
+    return tokens if tokens >= 0 else None
+
+
+def _user_row(record: Dict[str, Any]) -> Optional[tuple]:
+    email = str(record.get("email") or "").lower().strip()
+    if "@" not in email:
+        return None
+    if _tokens(record.get("tokens")) is None:
+        return None
+    if record.get("password"):
+        password_hash = db.hash_pw(str(record["password"]))
+    elif record.get("password_hash"):
+        password_hash = str(record["password_hash"])
+    else:
+        return None
+    return (email, str(record.get("name") or "").strip(), password_hash, record.get("created_at"))
+
+
+def _status_columns(ch: Dict[str, Any], now: str) -> Tuple[Optional[str], Optional[str], str]:
+    """``accepted_at``, ``completed_at`` and ``status``; a bare status is dated ``now``."""
+    status = ch.get("status")
+    completed_at = ch.get("completed_at") or (now if status == "completed" else None)
+    accepted_at = ch.get("accepted_at") or completed_at or (now if status == "accepted" else None)
+    status = "completed" if completed_at else "accepted" if accepted_at else "offered"
+    return accepted_at, completed_at, status
+
+
+def _import_batch(conn: sqlite3.Connection, records: List[Dict[str, Any]], stats: Stats):
+    users: Dict[str, tuple] = {}
+    by_email: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        row = _user_row(record)
+        if row is None:
+            stats.invalid += 1
+            continue
+        if row[0] in users:
+            stats.skipped += 1
+            continue
+        users[row[0]] = row
+        by_email[row[0]] = record
+    if not users:
+        return
+
+    emails = json.dumps(list(users))
+    existing = {
+        r[0] for r in conn.execute("SELECT email FROM users WHERE email IN (SELECT value FROM json_each(?))", (emails,))
+    }
+    stats.skipped += len(existing)
+    new_rows = [row for email, row in users.items() if email not in existing]
+    if not new_rows:
+        return
+    conn.executemany(
+        """
+        INSERT INTO users (email, name, password_hash, created_at)
+        VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        """,
+        new_rows,
+    )
+    ids = dict(
+        conn.execute(
+            "SELECT email, id FROM users WHERE email IN (SELECT value FROM json_each(?))",
+            (json.dumps([row[0] for row in new_rows]),),
+        ).fetchall()
+    )
+
+    state_rows, reward_rows, challenge_rows, event_rows = [], [], [], []
+    impact: Dict[str, List[Dict[str, Any]]] = {"accepted": [], "completed": []}
+    seen = set()  # (user, challenge): a record listing a challenge twice counts it once
+    now = time.time()
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now))  # CURRENT_TIMESTAMP format
+    for email, user_id in ids.items():
+        record = by_email[email]
+        profile = record.get("profile") or None
+        tokens = _tokens(record.get("tokens"))
+        state_rows.append((user_id, json.dumps(profile) if profile else None, tokens))
+        if tokens > 0:
+            reward_rows.append((user_id, "", "opening_balance", tokens, now))
+        housing = profile.get("housing") if isinstance(profile, dict) else None
+        for position, ch in enumerate(record.get("challenges") or []):
+            if not isinstance(ch, dict) or "id" not in ch:
+                continue
+            accepted_at, completed_at, status = _status_columns(ch, timestamp)
+            row = db.challenge_row(user_id, position, ch, skip=STATUS_KEYS)
+            challenge_rows.append((*row, accepted_at, completed_at, status))
+            if (user_id, row[1]) in seen:
+                continue
+            seen.add((user_id, row[1]))
+            event = {
+                "company": ch.get("company"),
+                "difficulty": ch.get("difficulty"),
+                "co2_kg_month": ch.get("estimated_monthly_co2_saving_kg") or 0,
+                "housing": housing,
+            }
+            for kind, at in (("accepted", accepted_at), ("completed", completed_at)):
+                if at:
+                    impact[kind].append({**event, "day": str(at)[:10]})
+                    event_rows.append(
+                        (user_id, row[1], kind, str(at)[:10], event["company"], event["difficulty"],
+                         event["co2_kg_month"], housing)
+                    )
+
+    conn.executemany("INSERT INTO user_state (user_id, profile_json, tokens) VALUES (?, ?, ?)", state_rows)
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO reward_events (user_id, challenge_id, action, points, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        reward_rows,
+    )
+    columns = ", ".join(db.CHALLENGE_COLUMNS.values())
+    conn.executemany(
+        f"""
+        INSERT OR IGNORE INTO user_challenges (user_id, challenge_id, position, {columns}, extra_json,
+                                               accepted_at, completed_at, status)
+        VALUES (?, ?, ?{", ?" * len(db.CHALLENGE_COLUMNS)}, ?, ?, ?, ?)
+        """,
+        challenge_rows,
+    )
+    # the users are new, so every event is a first one
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO challenge_events
+            (user_id, challenge_id, action, day, company, difficulty, co2_kg_month, housing)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        event_rows,
+    )
+    for kind, rows in impact.items():
+        if rows:
+            db.bump_impact(conn, kind, rows)
+    stats.imported += len(ids)
+
+
+def _checkpoint(source: str) -> Optional[sqlite3.Row]:
+    with db.connection() as conn:
+        return conn.execute("SELECT * FROM import_checkpoints WHERE source = ?", (source,)).fetchone()
+
+
+def import_records(records: Iterable[Dict[str, Any]], batch_size: int = DEFAULT_BATCH_SIZE, progress=None) -> Stats:
+    """Bulk-insert already parsed records (e.g. generated ones), one transaction per batch."""
+    db.init_db()
+    stats = Stats()
+    batch: List[Dict[str, Any]] = []
+    for record in records:
+        stats.records += 1
+        batch.append(record)
+        if len(batch) >= batch_size:
+            with db.transaction() as conn:
+                _import_batch(conn, batch, stats)
+            batch.clear()
+            if progress:
+                progress(stats.line())
+    if batch:
+        with db.transaction() as conn:
+            _import_batch(conn, batch, stats)
+    return stats
+
+
+def import_file(
+    path: str,
+    fmt: Optional[str] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    restart: bool = False,
+    progress=None,
+) -> Stats:
+    """Import ``path``, resuming from its checkpoint unless ``restart``; returns counters."""
+    db.init_db()
+    fmt = fmt or detect_format(path)
+    source = f"{fmt}:{os.path.abspath(path)}"
+    checkpoint = None if restart else _checkpoint(source)
+    start = checkpoint["position"] if checkpoint else 0
+    stats = Stats(records=checkpoint["records"] if checkpoint else 0)
+    size = os.path.getsize(path) if fmt == "ndjson" and not path.endswith(".gz") and path != "-" else 0
+    reader = read_csv(path, start) if fmt == "csv" else read_ndjson(path, start)
+
+    batch: List[Dict[str, Any]] = []
+    position = start
+
+    def flush():
+        imported_before = stats.imported
+        with db.transaction() as conn:
+            _import_batch(conn, batch, stats)
+            conn.execute(
+                """
+                INSERT INTO import_checkpoints (source, position, records, imported, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(source) DO UPDATE SET position = excluded.position, records = excluded.records,
+                    imported = imported + excluded.imported, updated_at = excluded.updated_at
+                """,
+                (source, position, stats.records, stats.imported - imported_before, time.time()),
+            )
+        batch.clear()
+        if progress:
+            progress(stats.line(position / size if size else None))
+
+    for position, record in reader:
+        stats.records += 1
+        if record is None:
+            stats.invalid += 1
+            if len(stats.errors) < 10:
+                stats.errors.append(f"record {stats.records}: not a valid {fmt} record")
+        else:
+            batch.append(record)
+        if len(batch) >= batch_size:
+            flush()
+    if batch or position != start:
+        flush()
+    return stats
+
+
+# -- export -----------------------------------------------------------------------
+
+
+def iter_export(batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    """All users with their state, in id order, read in keyset-paginated batches."""
+    db.init_db()
+    last_id = 0
+    while True:
+        with db.connection() as conn:
+            users = conn.execute(
+                """
+                SELECT u.id, u.email, u.name, u.password_hash, u.created_at, s.profile_json, s.tokens
+                FROM users u LEFT JOIN user_state s ON s.user_id = u.id
+                WHERE u.id > ? ORDER BY u.id LIMIT ?
+                """,
+                (last_id, batch_size),
+            ).fetchall()
+            if not users:
+                return
+            challenges: Dict[int, List[Dict[str, Any]]] = {}
+            for row in conn.execute(
+                """
+                SELECT * FROM user_challenges WHERE user_id BETWEEN ? AND ?
+                ORDER BY user_id, position
+                """,
+                (users[0]["id"], users[-1]["id"]),
+            ):
+                ch = db.challenge_from_row(row)
+                ch["status"] = row["status"]
+                for key in ("accepted_at", "completed_at"):
+                    if row[key]:
+                        ch[key] = row[key]
+                challenges.setdefault(row["user_id"], []).append(ch)
+        for u in users:
+            yield {
+                "email": u["email"],
+                "name": u["name"],
+                "password_hash": u["password_hash"],
+                "created_at": u["created_at"],
+                "profile": json.loads(u["profile_json"]) if u["profile_json"] else None,
+                "tokens": u["tokens"] or 0,
+                "challenges": challenges.get(u["id"], []),
+            }
+        last_id = users[-1]["id"]
+
+
+def write_records(
+    path: str,
+    records: Iterable[Dict[str, Any]],
+    fmt: Optional[str] = None,
+    every: int = DEFAULT_BATCH_SIZE,
+    progress=None,
+) -> int:
+    """Stream ``records`` to ``path`` as NDJSON or CSV; returns how many were written."""
+    fmt = fmt or detect_format(path)
+    count = 0
+    started = time.perf_counter()
+    with _open(path, "wb") as raw:
+        out = io.TextIOWrapper(raw, encoding="utf-8", newline="" if fmt == "csv" else None, write_through=False)
+        writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, extrasaction="ignore") if fmt == "csv" else None
+        if writer:
+            writer.writeheader()
+        for record in records:
+            if writer:
+                writer.writerow(
+                    {
+                        **record,
+                        "profile": json.dumps(record["profile"], ensure_ascii=False) if record.get("profile") else "",
+                        "challenges": json.dumps(record.get("challenges") or [], ensure_ascii=False),
+                    }
+                )
+            else:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+            if progress and count % every == 0:
+                progress(f"{count:,} records written, {count / (time.perf_counter() - started):,.0f} records/s")
+        out.flush()
+        out.detach()
+    return count
+
+
+def export_file(path: str, fmt: Optional[str] = None, batch_size: int = DEFAULT_BATCH_SIZE, progress=None) -> int:
+    return write_records(path, iter_export(batch_size), fmt, batch_size, progress)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m greenmatch.bulk", description="Bulk import/export of users and state"
+    )
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("path", help="NDJSON or CSV file (.gz ok); '-' for stdout on export")
+    parser.add_argument("--format", choices=("ndjson", "csv"), help="default: from the file extension")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="records per transaction")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an earlier import")
+    parser.add_argument("--db", help="database file (default: GREENMATCH_DB or greenmatch.db)")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.DB_PATH = args.db
+    progress = None if args.quiet else (lambda line: print(line, file=sys.stderr, flush=True))
+
+    if args.command == "export":
+        count = export_file(args.path, args.format, args.batch_size, progress)
+        if progress:
+            progress(f"exported {count:,} users")
+        return 0
+
+    stats = import_file(args.path, args.format, args.batch_size, args.restart, progress)
+    for error in stats.errors:
+        print(f"  {error}", file=sys.stderr)
+    print(f"done: {stats.line()}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Persistent cache of generated challenges, keyed by a canonical profile hash.
+
+Two profiles that only differ in formatting (order of devices, stray spaces,
+an age one year apart within the same bucket) map to the same key, so a
+re-submitted form, or another user with the same profile, is answered from
+SQLite instead of a new LLM round trip. Entries expire after ``ttl_seconds``
+and the least recently used ones are evicted beyond ``max_entries``.
+
+A hit is a plain read. ``last_used_at`` only needs to be good enough for LRU
+eviction, so it is written when it is more than ``touch_interval`` old, together
+with the hits counted in memory since the last write.
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from greenmatch import db, metrics
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_TOUCH_INTERVAL_SECONDS = 3600
+
+AGE_BUCKETS = (25, 35, 45, 55, 65)
+
+
+def _clean_text(value: Any) -> str:
+    return " ".join(str(value or "").split()).lower()
+
+
+def age_bucket(age: Any) -> str:
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return "unknown"
+    lower = 0
+    for upper in AGE_BUCKETS:
+        if age < upper:
+            return f"{lower}-{upper - 1}" if lower else f"<{upper}"
+        lower = upper
+    return f"{lower}+"
+
+
+def normalize_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """The parts of a profile that shape the generated challenges, in canonical form."""
+    return {
+        "age": age_bucket(profile.get("age")),
+        "country": _clean_text(profile.get("country")),
+        "housing": _clean_text(profile.get("housing")),
+        "devices": sorted({_clean_text(d) for d in profile.get("devices", []) if _clean_text(d)}),
+        "motivations": sorted({_clean_text(m) for m in profile.get("motivations", []) if _clean_text(m)}),
+        "habits": _clean_text(profile.get("habits")),
+    }
+
+
+def fingerprint(*parts: Any) -> str:
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def profile_key(profile: Dict[str, Any], version: str) -> str:
+    """``version`` should change whenever the prompt or the static data it embeds changes."""
+    return fingerprint(version, normalize_profile(profile))
+
+
+class ChallengeCache:
+    def __init__(
+        self,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        touch_interval: float = DEFAULT_TOUCH_INTERVAL_SECONDS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._unwritten_hits: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        now = time.time()
+        with db.connection() as conn:
+            row = conn.execute(
+                "SELECT challenges_json, created_at, last_used_at FROM challenge_cache WHERE cache_key = ?",
+                (key,),
+            ).fetchone()
+        if row is None or now - row["created_at"] > self.ttl_seconds:
+            with self._lock:
+                self.misses += 1
+            metrics.inc("challenge_cache.miss")
+            return None
+        with self._lock:
+            self.hits += 1
+            hits = self._unwritten_hits.pop(key, 0) + 1
+            if now - row["last_used_at"] < self.touch_interval:
+                self._unwritten_hits[key] = hits
+                hits = 0
+        if hits:
+            with db.transaction() as conn:
+                conn.execute(
+                    "UPDATE challenge_cache SET last_used_at = ?, hits = hits + ? WHERE cache_key = ?",
+                    (now, hits, key),
+                )
+        metrics.inc("challenge_cache.hit")
+        return json.loads(row["challenges_json"])
+
+    def put(self, key: str, challenges: List[Dict[str, Any]]):
+        now = time.time()
+        with db.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO challenge_cache (cache_key, challenges_json, created_at, last_used_at, hits)
+                VALUES (?, ?, ?, ?, 0)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    challenges_json = excluded.challenges_json,
+                    created_at = excluded.created_at,
+                    last_used_at = excluded.last_used_at
+                """,
+                (key, json.dumps(challenges, ensure_ascii=False), now, now),
+            )
+            conn.execute("DELETE FROM challenge_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                """
+                DELETE FROM challenge_cache WHERE cache_key IN (
+                    SELECT cache_key FROM challenge_cache
+                    ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,796 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Deque, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+from greenmatch.metrics import timed
+
+
+DB_PATH = os.getenv("GREENMATCH_DB", "greenmatch.db")
+# UPDATE ... RETURNING needs SQLite 3.35; older libraries read the rows first.
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+# Company list used to tag challenges moved out of the legacy state blobs.
+COMPANIES_PATH = os.getenv("GREENMATCH_COMPANIES", "companies.json")
+
+# PRAGMA user_version: 1 = challenges live in ``user_challenges``,
+# 2 = reward points are backed by the ``reward_events`` ledger,
+# 3 = ``impact_stats`` aggregates are maintained on every status change,
+# 4 = ... from the first accept/complete per challenge in ``challenge_events``,
+# 5 = failed ``proof_jobs`` wait for ``not_before`` before they are retried.
+SCHEMA_VERSION = 5
+
+# Breakdowns kept in ``impact_stats``; ``all`` has a single value, "".
+IMPACT_DIMENSIONS = ("all", "company", "difficulty", "housing")
+# ``impact_stats.day`` of the all-time rows, next to one row per UTC day.
+TOTAL_DAY = "total"
+
+# Session-state fields that are still stored as columns of ``user_state``.
+# ``tokens`` is only ever changed through ``greenmatch.rewards``.
+STATE_COLUMNS = {
+    "profile": "profile_json",
+}
+
+# Challenge keys that have their own column in ``user_challenges``; anything else
+# the model returns is kept in ``extra_json``.
+CHALLENGE_COLUMNS = {
+    "title": "title",
+    "description": "description",
+    "difficulty": "difficulty",
+    "estimated_monthly_co2_saving_kg": "co2_kg_month",
+    "why_it_fits": "why_it_fits",
+    "company": "company",
+}
+
+POOL_SIZE = int(os.getenv("GREENMATCH_DB_POOL_SIZE", "8"))
+BUSY_TIMEOUT_MS = 5000
+
+
+class ConnectionPool:
+    """
+    A small pool of SQLite connections in WAL mode.
+
+    Each connection is used by one thread at a time, runs in autocommit mode and
+    only opens a transaction through :meth:`transaction`, so readers never queue
+    behind an idle open transaction and writers wait on ``busy_timeout`` instead
+    of failing with "database is locked".
+    """
+
+    def __init__(self, path: str, size: int = POOL_SIZE, busy_timeout_ms: int = BUSY_TIMEOUT_MS):
+        self.path = path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._idle: List[sqlite3.Connection] = []
+        self._created = 0
+        self._waiters: Deque[List[sqlite3.Connection]] = deque()
+        self._cond = threading.Condition()
+        self.commits = 0  # committed write transactions, for benchmarks
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        with self._cond:
+            if self._idle:
+                return self._idle.pop()
+            if self._created >= self.size:
+                # wait in line: released connections are handed to waiters in FIFO
+                # order, so a burst of short reads cannot starve a writer
+                slot: List[sqlite3.Connection] = []
+                self._waiters.append(slot)
+                while not slot:
+                    self._cond.wait()
+                return slot[0]
+            self._created += 1
+        try:
+            return self._open()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+            raise
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            if self._waiters:
+                self._waiters.popleft().append(conn)
+                self._cond.notify_all()
+            else:
+                self._idle.append(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for autocommit reads."""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection inside ``BEGIN IMMEDIATE`` ... ``COMMIT``. The write
+        lock is taken up front so the transaction cannot fail half-way on upgrade.
+        """
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        with self._cond:
+            self.commits += 1
+
+    def close(self):
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._created -= len(self._idle)
+            self._idle.clear()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+
+def connection():
+    return get_pool().connection()
+
+
+def transaction():
+    return get_pool().transaction()
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def init_db():
+    """Create and migrate the schema; runs once per process, later calls are free."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with transaction() as conn:
+            _create_schema(conn)
+        _schema_ready = True
+
+
+def _create_schema(conn: sqlite3.Connection):
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            name TEXT,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER PRIMARY KEY,
+            profile_json TEXT,
+            challenges_json TEXT,
+            accepted_ids_json TEXT,
+            completed_ids_json TEXT,
+            tokens INTEGER DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_challenges (
+            user_id INTEGER NOT NULL,
+            challenge_id TEXT NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            title TEXT,
+            description TEXT,
+            difficulty TEXT,
+            co2_kg_month REAL DEFAULT 0,
+            why_it_fits TEXT,
+            company TEXT,
+            extra_json TEXT,
+            status TEXT NOT NULL DEFAULT 'offered',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            accepted_at TIMESTAMP,
+            completed_at TIMESTAMP,
+            PRIMARY KEY(user_id, challenge_id),
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_challenges_status ON user_challenges(status)")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_challenges_company ON user_challenges(company, status)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_challenges_challenge ON user_challenges(challenge_id, status)"
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS challenge_cache (
+            cache_key TEXT PRIMARY KEY,
+            challenges_json TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_challenge_cache_last_used ON challenge_cache(last_used_at)"
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS inflight_calls (
+            key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            result_json TEXT,
+            finished_at REAL
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS challenge_pools (
+            segment TEXT PRIMARY KEY,
+            version TEXT NOT NULL,
+            challenges_json TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS proof_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            challenge_id TEXT NOT NULL,
+            challenge_title TEXT,
+            challenge_description TEXT,
+            image_sha TEXT NOT NULL,
+            fingerprint TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            verdict TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            not_before REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_proof_jobs_status ON proof_jobs(status, id)")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_proof_jobs_user_challenge ON proof_jobs(user_id, challenge_id, id)"
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reward_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            challenge_id TEXT NOT NULL,
+            action TEXT NOT NULL,
+            points INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            UNIQUE(user_id, challenge_id, action),
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS wheel_rewards (
+            campaign TEXT NOT NULL,
+            reward_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            label TEXT NOT NULL,
+            weight REAL NOT NULL,
+            stock INTEGER,
+            awarded INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(campaign, reward_id)
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS wheel_draws (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            campaign TEXT NOT NULL,
+            request_id TEXT NOT NULL,
+            reward_id TEXT NOT NULL,
+            cost INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            UNIQUE(user_id, request_id),
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS impact_stats (
+            dimension TEXT NOT NULL,
+            value TEXT NOT NULL,
+            day TEXT NOT NULL,
+            accepted INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            co2_accepted REAL NOT NULL DEFAULT 0,
+            co2_completed REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY(dimension, value, day)
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_impact_stats_day ON impact_stats(dimension, day)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS challenge_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            challenge_id TEXT NOT NULL,
+            action TEXT NOT NULL,
+            day TEXT NOT NULL,
+            company TEXT,
+            difficulty TEXT,
+            co2_kg_month REAL,
+            housing TEXT,
+            UNIQUE(user_id, challenge_id, action),
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+    )
+    # leaderboard order (ties by user id), so a rank is a count over an index range
+    cur.execute("DROP INDEX IF EXISTS idx_user_state_tokens")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_state_rank ON user_state(tokens DESC, user_id)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            records INTEGER NOT NULL,
+            imported INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        migrate_state_blobs(conn)
+    if version < 2:
+        migrate_opening_balances(conn)
+    if version < 4:
+        migrate_challenge_events(conn)
+        rebuild_impact_stats(conn)
+    if version < 5:
+        migrate_proof_backoff(conn)
+    if version < SCHEMA_VERSION:
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def migrate_state_blobs(conn: sqlite3.Connection):
+    """
+    One-time move of ``challenges_json`` / ``accepted_ids_json`` / ``completed_ids_json``
+    into ``user_challenges``. The blob columns are cleared afterwards but kept so an
+    older build can still open the database. Challenges are tagged with the company
+    they name, like new ones, so per-company stats do not count them as unknown.
+    """
+    from greenmatch.recommender import tag_companies
+
+    company_names = _company_names()
+    rows = conn.execute(
+        """
+        SELECT user_id, challenges_json, accepted_ids_json, completed_ids_json
+        FROM user_state WHERE challenges_json IS NOT NULL
+        """
+    ).fetchall()
+    for row in rows:
+        challenges = json.loads(row["challenges_json"]) if row["challenges_json"] else []
+        accepted = set(json.loads(row["accepted_ids_json"])) if row["accepted_ids_json"] else set()
+        completed = set(json.loads(row["completed_ids_json"])) if row["completed_ids_json"] else set()
+        _replace_challenges(conn, row["user_id"], tag_companies(challenges, company_names))
+        _apply_status(conn, row["user_id"], "accepted_at", accepted | completed)
+        _apply_status(conn, row["user_id"], "completed_at", completed)
+    conn.execute(
+        """
+        UPDATE user_state
+        SET challenges_json = NULL, accepted_ids_json = NULL, completed_ids_json = NULL
+        """
+    )
+
+
+def _company_names() -> List[str]:
+    if not os.path.exists(COMPANIES_PATH):
+        return []
+    from greenmatch.static_data import load_json
+
+    return [c["company_name"] for c in load_json(COMPANIES_PATH).get("companies_report", [])]
+
+
+def migrate_opening_balances(conn: sqlite3.Connection):
+    """Book existing point totals as one ``opening_balance`` event so the ledger sums to them."""
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO reward_events (user_id, challenge_id, action, points, created_at)
+        SELECT user_id, '', 'opening_balance', tokens, strftime('%s', 'now')
+        FROM user_state WHERE tokens > 0
+        """
+    )
+
+
+def migrate_challenge_events(conn: sqlite3.Connection):
+    """Book the accepts and completions still in ``user_challenges`` as ``challenge_events``."""
+    for kind in ("accepted", "completed"):
+        conn.execute(
+            f"""
+            INSERT OR IGNORE INTO challenge_events
+                (user_id, challenge_id, action, day, company, difficulty, co2_kg_month, housing)
+            SELECT c.user_id, c.challenge_id, '{kind}', date(c.{kind}_at), c.company, c.difficulty,
+                   c.co2_kg_month, json_extract(s.profile_json, '$.housing')
+            FROM user_challenges c LEFT JOIN user_state s ON s.user_id = c.user_id
+            WHERE c.{kind}_at IS NOT NULL
+            """
+        )
+
+
+def migrate_proof_backoff(conn: sqlite3.Connection):
+    """Add ``proof_jobs.not_before`` to tables created before it existed."""
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(proof_jobs)")}
+    if "not_before" not in columns:
+        conn.execute("ALTER TABLE proof_jobs ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+
+
+def rebuild_impact_stats(conn: sqlite3.Connection):
+    """Recompute ``impact_stats`` from ``challenge_events``; the backfill and repair path."""
+    conn.execute("DELETE FROM impact_stats")
+    for kind in ("accepted", "completed"):
+        rows = conn.execute(
+            """
+            SELECT day, company, difficulty, co2_kg_month, housing FROM challenge_events
+            WHERE action = ?
+            """,
+            (kind,),
+        )
+        while True:
+            batch = rows.fetchmany(1000)
+            if not batch:
+                break
+            bump_impact(conn, kind, batch)
+
+
+def _impact_keys(row, housing: Optional[str]):
+    return (
+        ("all", ""),
+        ("company", row["company"] or "unknown"),
+        ("difficulty", row["difficulty"] or "unknown"),
+        ("housing", housing or "unknown"),
+    )
+
+
+def record_challenge_events(conn: sqlite3.Connection, user_id: int, kind: str, rows, housing: Optional[str] = None):
+    """
+    Append a ``kind`` event for each of ``rows`` (challenge_id, company, difficulty,
+    co2_kg_month) the user has none for yet, and count the new ones in ``impact_stats``.
+    Like the reward ledger, a challenge re-offered after a refresh counts once.
+    """
+    new = [
+        row
+        for row in rows
+        if conn.execute(
+            """
+            INSERT INTO challenge_events
+                (user_id, challenge_id, action, day, company, difficulty, co2_kg_month, housing)
+            VALUES (?, ?, ?, date('now'), ?, ?, ?, ?)
+            ON CONFLICT(user_id, challenge_id, action) DO NOTHING
+            """,
+            (user_id, row["challenge_id"], kind, row["company"], row["difficulty"], row["co2_kg_month"], housing),
+        ).rowcount
+    ]
+    if new:
+        bump_impact(conn, kind, new, housing)
+
+
+def bump_impact(conn: sqlite3.Connection, kind: str, rows, housing: Optional[str] = None):
+    """
+    Count ``rows`` (with company, difficulty, co2_kg_month and optionally day/housing)
+    as ``kind`` events in every breakdown, for their day and for the all-time total.
+    """
+    today = conn.execute("SELECT date('now')").fetchone()[0]
+    deltas: Dict[tuple, List[float]] = {}
+    for row in rows:
+        keys = row.keys()
+        day = row["day"] if "day" in keys else None
+        row_housing = row["housing"] if "housing" in keys else housing
+        for dimension, value in _impact_keys(row, row_housing):
+            for d in (day or today, TOTAL_DAY):
+                delta = deltas.setdefault((dimension, value, d), [0, 0.0])
+                delta[0] += 1
+                delta[1] += row["co2_kg_month"] or 0
+    conn.executemany(
+        f"""
+        INSERT INTO impact_stats (dimension, value, day, {kind}, co2_{kind}) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(dimension, value, day) DO UPDATE SET
+            {kind} = {kind} + excluded.{kind},
+            co2_{kind} = co2_{kind} + excluded.co2_{kind}
+        """,
+        [(*key, n, co2) for key, (n, co2) in deltas.items()],
+    )
+
+
+def hash_pw(password: str) -> str:
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+
+def create_user(email: str, name: str, password: str):
+    with transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO users (email, name, password_hash) VALUES (?, ?, ?)",
+            (email.lower().strip(), name.strip(), hash_pw(password)),
+        )
+        return cur.lastrowid
+
+
+def get_user_by_email(email: str):
+    with connection() as conn:
+        cur = conn.execute("SELECT * FROM users WHERE email = ?", (email.lower().strip(),))
+        return cur.fetchone()
+
+
+@timed("db.load_state")
+def load_state(user_id: int):
+    # both reads see the same snapshot, even while a writer commits in between
+    with connection() as conn:
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute("SELECT * FROM user_state WHERE user_id = ?", (user_id,)).fetchone()
+            challenge_rows = conn.execute(
+                "SELECT * FROM user_challenges WHERE user_id = ? ORDER BY position", (user_id,)
+            ).fetchall()
+        finally:
+            conn.rollback()
+    if not row and not challenge_rows:
+        return None
+    return {
+        "profile": json.loads(row["profile_json"]) if row and row["profile_json"] else None,
+        "challenges": [challenge_from_row(r) for r in challenge_rows],
+        "accepted_ids": {r["challenge_id"] for r in challenge_rows if r["accepted_at"]},
+        "completed_ids": {r["challenge_id"] for r in challenge_rows if r["completed_at"]},
+        "tokens": (row["tokens"] or 0) if row else 0,
+    }
+
+
+def challenge_from_row(row: sqlite3.Row) -> Dict[str, Any]:
+    challenge = {"id": row["challenge_id"]}
+    for key, column in CHALLENGE_COLUMNS.items():
+        if row[column] is not None:
+            challenge[key] = row[column]
+    co2 = challenge.get("estimated_monthly_co2_saving_kg")
+    if isinstance(co2, float) and co2.is_integer():
+        challenge["estimated_monthly_co2_saving_kg"] = int(co2)
+    if row["extra_json"]:
+        challenge.update(json.loads(row["extra_json"]))
+    return challenge
+
+
+def challenge_row(user_id: int, position: int, ch: Dict[str, Any], skip=()) -> tuple:
+    """
+    ``(user_id, challenge_id, position, *CHALLENGE_COLUMNS, extra_json)`` for one
+    challenge; keys in ``skip`` are left out of ``extra_json``.
+    """
+    extra = {k: v for k, v in ch.items() if k != "id" and k not in CHALLENGE_COLUMNS and k not in skip}
+    return (
+        user_id,
+        str(ch["id"]),
+        position,
+        *(ch.get(k) for k in CHALLENGE_COLUMNS),
+        json.dumps(extra, ensure_ascii=False) if extra else None,
+    )
+
+
+def _replace_challenges(conn: sqlite3.Connection, user_id: int, challenges: List[Dict[str, Any]]):
+    """Upsert the user's current challenge list and drop challenges no longer offered."""
+    rows = [challenge_row(user_id, position, ch) for position, ch in enumerate(challenges)]
+    columns = ", ".join(CHALLENGE_COLUMNS.values())
+    updates = ", ".join(f"{c} = excluded.{c}" for c in ("position", *CHALLENGE_COLUMNS.values(), "extra_json"))
+    conn.executemany(
+        f"""
+        INSERT INTO user_challenges (user_id, challenge_id, position, {columns}, extra_json)
+        VALUES (?, ?, ?{", ?" * len(CHALLENGE_COLUMNS)}, ?)
+        ON CONFLICT(user_id, challenge_id) DO UPDATE SET {updates}
+        """,
+        rows,
+    )
+    keep = [r[1] for r in rows]
+    conn.execute(
+        f"""
+        DELETE FROM user_challenges
+        WHERE user_id = ? AND challenge_id NOT IN ({", ".join("?" * len(keep))})
+        """,
+        (user_id, *keep),
+    )
+
+
+class IdChanges(NamedTuple):
+    """
+    Ids added to and removed from a session's id set since it was last saved.
+    Saving these instead of the whole set keeps two tabs of one user from
+    undoing each other's accepts and completions.
+    """
+
+    added: FrozenSet[Any]
+    removed: FrozenSet[Any]
+
+    @classmethod
+    def between(cls, before: Iterable[Any], after: Iterable[Any]) -> "IdChanges":
+        before, after = set(before or ()), set(after or ())
+        return cls(frozenset(after - before), frozenset(before - after))
+
+    def then(self, later: "IdChanges") -> "IdChanges":
+        """These changes followed by ``later`` ones, as a single change."""
+        return IdChanges(
+            (self.added - later.removed) | later.added, (self.removed - later.added) | later.removed
+        )
+
+    def apply(self, ids: Optional[Iterable[Any]]) -> Set[Any]:
+        return (set(ids or ()) - self.removed) | self.added
+
+
+def _mark_status(conn: sqlite3.Connection, user_id: int, column: str, ids: List[str]):
+    """Set ``column`` for those of ``ids`` where it is NULL; newly set rows go to ``record_challenge_events``."""
+    if not ids:
+        return
+    marks = ", ".join("?" * len(ids))
+    where = f"user_id = ? AND {column} IS NULL AND challenge_id IN ({marks})"
+    if HAS_RETURNING:
+        changed = conn.execute(
+            f"""
+            UPDATE user_challenges SET {column} = CURRENT_TIMESTAMP WHERE {where}
+            RETURNING challenge_id, company, difficulty, co2_kg_month
+            """,
+            (user_id, *ids),
+        ).fetchall()
+    else:
+        changed = conn.execute(
+            f"SELECT challenge_id, company, difficulty, co2_kg_month FROM user_challenges WHERE {where}",
+            (user_id, *ids),
+        ).fetchall()
+        conn.execute(f"UPDATE user_challenges SET {column} = CURRENT_TIMESTAMP WHERE {where}", (user_id, *ids))
+    if changed:
+        housing = conn.execute(
+            "SELECT json_extract(profile_json, '$.housing') FROM user_state WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        record_challenge_events(conn, user_id, column[: -len("_at")], changed, housing[0] if housing else None)
+
+
+def _sync_status(conn: sqlite3.Connection, user_id: int):
+    conn.execute(
+        """
+        UPDATE user_challenges
+        SET status = CASE
+            WHEN completed_at IS NOT NULL THEN 'completed'
+            WHEN accepted_at IS NOT NULL THEN 'accepted'
+            ELSE 'offered'
+        END
+        WHERE user_id = ? AND status != CASE
+            WHEN completed_at IS NOT NULL THEN 'completed'
+            WHEN accepted_at IS NOT NULL THEN 'accepted'
+            ELSE 'offered'
+        END
+        """,
+        (user_id,),
+    )
+
+
+def _apply_status(conn: sqlite3.Connection, user_id: int, column: str, ids):
+    """
+    Make ``column`` (``accepted_at`` / ``completed_at``) non-NULL exactly for ``ids``.
+    Only rows whose status actually changes are written. ``IdChanges`` touch only
+    the ids they add or remove.
+    """
+    if isinstance(ids, IdChanges):
+        _mark_status(conn, user_id, column, [str(i) for i in ids.added])
+        removed = [str(i) for i in ids.removed]
+        if removed:
+            conn.execute(
+                f"""
+                UPDATE user_challenges SET {column} = NULL
+                WHERE user_id = ? AND {column} IS NOT NULL AND challenge_id IN ({", ".join("?" * len(removed))})
+                """,
+                (user_id, *removed),
+            )
+    else:
+        ids = [str(i) for i in ids]
+        _mark_status(conn, user_id, column, ids)
+        conn.execute(
+            f"""
+            UPDATE user_challenges SET {column} = NULL
+            WHERE user_id = ? AND {column} IS NOT NULL AND challenge_id NOT IN ({", ".join("?" * len(ids))})
+            """,
+            (user_id, *ids),
+        )
+    _sync_status(conn, user_id)
+
+
+def _encode_field(field: str, value: Any):
+    return json.dumps(value) if value else None
+
+
+@timed("db.save_state")
+def save_state_fields(user_id: int, fields: Dict[str, Any]):
+    """
+    Write only the given state fields. Columns of ``user_state`` are upserted, the
+    challenge list is upserted row by row and id sets become per-row status updates,
+    so accepting one challenge touches a single ``user_challenges`` row. Id sets may
+    be given whole or as ``IdChanges``.
+    """
+    if not fields:
+        return
+    with transaction() as conn:
+        _write_state_fields(conn, user_id, fields)
+
+
+def _write_state_fields(conn: sqlite3.Connection, user_id: int, fields: Dict[str, Any]):
+    columns = [STATE_COLUMNS[f] for f in fields if f in STATE_COLUMNS]
+    if columns:
+        values = [_encode_field(f, v) for f, v in fields.items() if f in STATE_COLUMNS]
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns)
+        conn.execute(
+            f"""
+            INSERT INTO user_state (user_id, {", ".join(columns)})
+            VALUES (?{", ?" * len(columns)})
+            ON CONFLICT(user_id) DO UPDATE SET {updates}
+            """,
+            (user_id, *values),
+        )
+    if "challenges" in fields:
+        _replace_challenges(conn, user_id, fields["challenges"] or [])
+    if "accepted_ids" in fields:
+        _apply_status(conn, user_id, "accepted_at", fields["accepted_ids"] or ())
+    if "completed_ids" in fields:
+        _apply_status(conn, user_id, "completed_at", fields["completed_ids"] or ())
+
+
+def save_state(user_id: int, profile, challenges, accepted_ids, completed_ids):
+    save_state_fields(
+        user_id,
+        {
+            "profile": profile,
+            "challenges": challenges,
+            "accepted_ids": accepted_ids,
+            "completed_ids": completed_ids,
+        },
+    )
@@ -0,0 +1,102 @@
+"""
+Proof image preprocessing and a bounded cache of AI verdicts.
+
+Phone photos are several megabytes at 4000px; the model needs far less to judge
+whether a photo fits a challenge. ``preprocess_image`` applies the EXIF
+orientation, downsizes to ``MAX_SIDE`` and re-encodes to a JPEG under
+``MAX_BYTES``. ``image_fingerprint`` is a perceptual difference hash, so the
+same photo uploaded twice (even re-encoded or resized) maps to the same
+``VerdictCache`` entry. ``verdict_key`` also covers the challenge text, since
+ids like ``night_charging`` are shared by challenges worded differently.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+MAX_SIDE = 1024
+MAX_BYTES = 350_000
+JPEG_QUALITIES = (85, 75, 65, 50)
+
+
+def preprocess_image(source: Any, max_side: int = MAX_SIDE, max_bytes: int = MAX_BYTES) -> Tuple[Image.Image, bytes]:
+    """
+    ``source`` is a path, file-like object (e.g. a Streamlit upload) or raw bytes.
+    Returns the downsized RGB image and its JPEG encoding.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        img.draft("RGB", (max_side, max_side))  # lets JPEG decode at reduced scale
+        img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    data = b""
+    for quality in JPEG_QUALITIES:
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+        data = buf.getvalue()
+        if len(data) <= max_bytes:
+            break
+    return Image.open(io.BytesIO(data)), data
+
+
+def _dhash(px: bytes, width: int, rows: int, cols: int, step: int) -> int:
+    bits = 0
+    for row in range(rows):
+        for col in range(cols):
+            i = row * width + col
+            bits = (bits << 1) | (px[i] > px[i + step])
+    return bits
+
+
+def image_fingerprint(img: Image.Image, hash_size: int = 8) -> str:
+    """
+    Horizontal and vertical difference hashes plus the coarse mean colour, as hex.
+    Robust to resizing and re-encoding; the colour part keeps flat, low-detail
+    photos from all collapsing onto the same hash.
+    """
+    n = hash_size + 1
+    px = img.convert("L").resize((n, n), Image.BILINEAR).tobytes()
+    horizontal = _dhash(px, n, hash_size, hash_size, 1)
+    vertical = _dhash(px, n, hash_size, hash_size, n)
+    r, g, b = (c // 32 for c in img.convert("RGB").resize((1, 1), Image.BOX).getpixel((0, 0)))
+    digits = hash_size * hash_size // 4
+    return f"{horizontal:0{digits}x}{vertical:0{digits}x}{r}{g}{b}"
+
+
+def verdict_key(challenge: Dict[str, Any], image_key: str) -> Tuple[str, str, str]:
+    """(challenge id, hash of its title and description, image fingerprint)."""
+    text = f"{challenge.get('title', '')}\n{challenge.get('description', '')}"
+    return str(challenge.get("id")), hashlib.sha1(text.encode("utf-8")).hexdigest()[:16], image_key
+
+
+class VerdictCache:
+    """Thread-safe LRU of verdict texts keyed by ``verdict_key``."""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, verdict: str):
+        with self._lock:
+            self._data[key] = verdict
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
@@ -0,0 +1,78 @@
+"""
+Incremental extraction of array items from a streamed JSON answer.
+
+Model answers arrive in chunks and are not always clean JSON: a sentence of
+prose or a ```json fence around the payload, and sometimes a response cut off
+mid-object. ``ArrayItemParser`` scans the text as it arrives, keeping only
+bracket depth and string/escape state, and returns every element of the first
+JSON array as soon as that element's closing brace is seen. Each element is
+parsed with ``json.loads`` on its own, so one malformed or truncated element is
+dropped without losing the ones before it.
+"""
+import json
+from typing import Any, List, Optional
+
+
+class ArrayItemParser:
+    """
+    ``feed(chunk)`` returns the objects completed by that chunk. Objects are
+    taken from the first array in the text (``{"challenges": [...]}`` or a bare
+    ``[...]``); text before the first bracket is ignored.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._array_depth: Optional[int] = None  # stack depth of the array being read
+        self._start: Optional[int] = None  # buffer offset of the element being read
+        self._done = False
+        self.items = 0
+
+    def feed(self, chunk: str) -> List[Any]:
+        self._buf += chunk
+        buf, out = self._buf, []
+        i = self._pos
+        while i < len(buf):
+            c = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                # quotes in prose before the payload are not strings
+                self._in_string = bool(self._stack)
+            elif c in "{[":
+                self._stack.append(c)
+                if c == "[" and self._array_depth is None and not self._done:
+                    self._array_depth = len(self._stack)
+                elif c == "{" and self._array_depth is not None and len(self._stack) == self._array_depth + 1:
+                    self._start = i
+            elif c in "}]" and self._stack:
+                self._stack.pop()
+                depth = len(self._stack)
+                if c == "}" and self._start is not None and depth == self._array_depth:
+                    try:
+                        out.append(json.loads(buf[self._start:i + 1]))
+                    except ValueError:
+                        pass
+                    self._start = None
+                elif c == "]" and self._array_depth is not None and depth < self._array_depth:
+                    # an empty bracket pair (e.g. in leading prose) is not the payload; keep looking
+                    self._done = bool(out or self.items)
+                    self._array_depth = None
+            i += 1
+
+        # keep only the element still being read
+        keep = self._start if self._start is not None else i
+        self._buf = buf[keep:]
+        self._pos = i - keep
+        if self._start is not None:
+            self._start = 0
+        self.items += len(out)
+        return out
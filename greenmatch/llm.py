@@ -0,0 +1,427 @@
+"""
+Pluggable LLM backends with deadlines, retries and a circuit breaker.
+
+``LLMBackend.generate(contents, timeout)`` is the whole interface: ``contents``
+is a prompt string or a list of prompt parts (strings and PIL images) and the
+result is the response text. ``stream(contents, timeout)`` yields the same text
+in chunks as the model produces it (by default in one piece). ``timeout`` is
+the seconds left before the caller's deadline, passed on as a request timeout
+so a call the caller gave up on does not hang on. ``GeminiBackend``
+wraps ``google.generativeai``; ``StubBackend`` answers locally and
+deterministically with configurable latency and failure rate, for development,
+benchmarks and brownout drills.
+
+``ResilientLLM`` puts every call under a deadline, retries failed attempts
+with full-jitter exponential backoff while time remains, and trips a
+``CircuitBreaker`` after repeated failures so callers go straight to their
+fallback path instead of waiting on an unhealthy provider. A thread cannot be
+cancelled, so at most ``max_concurrency`` calls may be running at once, counting
+ones whose caller already timed out; beyond that calls fail fast with
+``Overloaded`` instead of queueing behind hung requests. With an
+``AdmissionController`` (``greenmatch.admission``) every call first has to be
+admitted; a call that would queue too long fails fast with ``Overloaded``.
+Streams get the same treatment, except that a stream is only retried until its
+first chunk has been handed to the caller.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Iterator, List, Optional, Union
+
+from greenmatch import metrics
+from greenmatch.admission import INTERACTIVE, AdmissionController, Rejected
+
+Contents = Union[str, List[Any]]
+
+DEFAULT_MODEL = "gemini-2.5-pro"
+DEFAULT_DEADLINE_SECONDS = float(os.getenv("GREENMATCH_LLM_CALL_DEADLINE", "45"))
+DEFAULT_RETRIES = 2
+
+
+class LLMUnavailable(Exception):
+    """The backend could not produce an answer; callers should use their fallback."""
+
+
+class LLMTimeout(LLMUnavailable):
+    pass
+
+
+class CircuitOpen(LLMUnavailable):
+    pass
+
+
+class Overloaded(LLMUnavailable):
+    """Not admitted: per-user quota used up, or the queue is too long to wait for."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMBackend:
+    name = "base"
+
+    def generate(self, contents: Contents, timeout: Optional[float] = None) -> str:
+        raise NotImplementedError
+
+    def stream(self, contents: Contents, timeout: Optional[float] = None) -> Iterator[str]:
+        yield self.generate(contents, timeout)
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = DEFAULT_MODEL):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    @staticmethod
+    def _options(timeout: Optional[float]) -> dict:
+        return {"request_options": {"timeout": timeout}} if timeout else {}
+
+    def generate(self, contents: Contents, timeout: Optional[float] = None) -> str:
+        return self.model.generate_content(contents, **self._options(timeout)).text
+
+    def stream(self, contents: Contents, timeout: Optional[float] = None) -> Iterator[str]:
+        for chunk in self.model.generate_content(contents, stream=True, **self._options(timeout)):
+            yield chunk.text
+
+
+class StubBackend(LLMBackend):
+    """
+    Offline stand-in for a real model. Challenge prompts get a fixed-format JSON
+    answer chosen from the local seed catalog by a hash of the prompt; image
+    checks get a short canned verdict. Failures are drawn from a seeded RNG.
+    ``stream`` spreads the latency evenly over ``chunk_size`` character chunks.
+    A ``timeout`` shorter than the latency ends the call with ``TimeoutError``.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0, chunk_size: int = 64):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.chunk_size = chunk_size
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def generate(self, contents: Contents, timeout: Optional[float] = None) -> str:
+        fail = self._start_call()
+        self._wait(self.latency, timeout)
+        if fail:
+            raise RuntimeError("stub backend: injected failure")
+        return self._answer(contents)
+
+    def stream(self, contents: Contents, timeout: Optional[float] = None) -> Iterator[str]:
+        end = None if timeout is None else time.monotonic() + timeout
+        if self._start_call():
+            self._wait(self.latency, timeout)
+            raise RuntimeError("stub backend: injected failure")
+        text = self._answer(contents)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        for chunk in chunks:
+            if self.latency:
+                self._wait(self.latency / len(chunks), None if end is None else end - time.monotonic())
+            yield chunk
+
+    @staticmethod
+    def _wait(seconds: float, timeout: Optional[float]):
+        if timeout is not None and seconds > timeout:
+            time.sleep(max(0.0, timeout))
+            raise TimeoutError("stub backend: request timed out")
+        if seconds:
+            time.sleep(seconds)
+
+    def _start_call(self) -> bool:
+        """Count the call; True if it should fail."""
+        with self._lock:
+            self.calls += 1
+            return self._rng.random() < self.failure_rate
+
+    def _answer(self, contents: Contents) -> str:
+        if isinstance(contents, list):
+            return (
+                "The photo looks plausibly related to the challenge. "
+                "It is great to see you taking action. Keep it up!"
+            )
+        return self._challenges(contents)
+
+    @staticmethod
+    def _challenges(prompt: str) -> str:
+        from greenmatch.recommender import SEED_CHALLENGES
+
+        digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        start = digest % len(SEED_CHALLENGES)
+        picked = [SEED_CHALLENGES[(start + i * 3) % len(SEED_CHALLENGES)] for i in range(4)]
+        challenges = [
+            {k: v for k, v in ch.items() if k not in ("requires", "housing")} for ch in picked
+        ]
+        return "```json\n" + json.dumps({"challenges": challenges}, ensure_ascii=False) + "\n```"
+
+
+class CircuitBreaker:
+    """
+    Closed → open after ``failure_threshold`` consecutive failures; after
+    ``reset_timeout`` one trial call is let through (half-open) and its outcome
+    closes or re-opens the circuit. A call that ends without an outcome (closed
+    by its caller, interrupted) calls ``release()`` instead, so that the next
+    call can be the trial.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._trial_thread: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            self._trial_thread = threading.get_ident()
+            return True
+
+    def release(self):
+        """End this thread's trial without an outcome; the circuit stays half-open."""
+        with self._lock:
+            if self._trial_running and self._trial_thread == threading.get_ident():
+                self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class ResilientLLM:
+    def __init__(
+        self,
+        backend: LLMBackend,
+        deadline: float = DEFAULT_DEADLINE_SECONDS,
+        retries: int = DEFAULT_RETRIES,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        breaker: Optional[CircuitBreaker] = None,
+        max_concurrency: int = 32,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.backend = backend
+        self.admission = admission
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="greenmatch-llm-call")
+        # one per backend call still running, released when it ends, not when its caller gives up
+        self._outstanding = threading.BoundedSemaphore(max_concurrency)
+
+    @property
+    def name(self) -> str:
+        return self.backend.name
+
+    def _submit(self, fn, *args):
+        """Run ``fn(*args)`` on the call executor if a call slot is free, else raise ``Overloaded``."""
+        if not self._outstanding.acquire(blocking=False):
+            metrics.inc("llm.saturated")
+            raise Overloaded(f"{self.name}: too many calls still running")
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._outstanding.release()
+            raise
+        future.add_done_callback(lambda _: self._outstanding.release())
+        return future
+
+    @contextlib.contextmanager
+    def _admitted(self, user: Any, priority: int, end: float):
+        if self.admission is None:
+            yield
+            return
+        max_wait = min(self.admission.max_wait.get(priority, 0.0), end - time.monotonic())
+        try:
+            self.admission.acquire(user, priority, max_wait)
+        except Rejected as e:
+            raise Overloaded(f"{self.name} call not admitted: {e}", e.retry_after) from e
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.admission.release(time.monotonic() - started)
+
+    def generate(
+        self, contents: Contents, deadline: Optional[float] = None, user: Any = None, priority: int = INTERACTIVE
+    ) -> str:
+        """
+        Response text, or ``LLMUnavailable`` once retries or the deadline are exhausted.
+        ``user`` and ``priority`` are for admission control; queueing counts against the deadline.
+        """
+        end = time.monotonic() + (self.deadline if deadline is None else deadline)
+        with self._admitted(user, priority, end):
+            return self._generate(contents, end)
+
+    def _generate(self, contents: Contents, end: float) -> str:
+        last_error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            # check the deadline first: a half-open trial must not be taken and then dropped
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self.breaker.allow():
+                metrics.inc("llm.circuit_open")
+                raise CircuitOpen(f"{self.name} backend circuit is open") from last_error
+            settled = False
+            try:
+                future = self._submit(self.backend.generate, contents, remaining)
+                try:
+                    text = future.result(timeout=remaining)
+                except FutureTimeout:
+                    future.cancel()
+                    metrics.inc("llm.timeout")
+                    settled = True
+                    self.breaker.record_failure()
+                    raise LLMTimeout(f"{self.name} backend did not answer within the deadline") from last_error
+                except Exception as e:
+                    metrics.inc("llm.error")
+                    settled = True
+                    self.breaker.record_failure()
+                    last_error = e
+                else:
+                    settled = True
+                    self.breaker.record_success()
+                    return text
+            finally:
+                if not settled:
+                    self.breaker.release()
+            if attempt < self.retries:
+                pause = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if time.monotonic() + pause >= end:
+                    break
+                time.sleep(pause)
+        raise LLMUnavailable(f"{self.name} backend failed: {last_error}") from last_error
+
+    def stream(
+        self, contents: Contents, deadline: Optional[float] = None, user: Any = None, priority: int = INTERACTIVE
+    ) -> Iterator[str]:
+        """
+        Response chunks as they arrive. The deadline covers the whole stream;
+        once a chunk has been yielded a failure is raised instead of retried,
+        so the caller keeps whatever it already consumed. The admission slot
+        is held until the stream ends or is closed.
+        """
+        end = time.monotonic() + (self.deadline if deadline is None else deadline)
+        with self._admitted(user, priority, end):
+            yield from self._stream(contents, end)
+
+    def _stream(self, contents: Contents, end: float) -> Iterator[str]:
+        last_error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            if end - time.monotonic() <= 0:
+                break
+            if not self.breaker.allow():
+                metrics.inc("llm.circuit_open")
+                raise CircuitOpen(f"{self.name} backend circuit is open") from last_error
+            chunks: "queue.Queue[tuple]" = queue.Queue()
+            stop = threading.Event()
+            received = settled = False
+            try:
+                self._submit(self._pump, contents, chunks, stop, end - time.monotonic())
+                while True:
+                    try:
+                        kind, value = chunks.get(timeout=max(0.0, end - time.monotonic()))
+                    except queue.Empty:
+                        metrics.inc("llm.timeout")
+                        settled = True
+                        self.breaker.record_failure()
+                        raise LLMTimeout(f"{self.name} backend did not finish within the deadline") from last_error
+                    if kind == "chunk":
+                        received = True
+                        yield value  # GeneratorExit here when the caller stops reading
+                    elif kind == "done":
+                        settled = True
+                        self.breaker.record_success()
+                        return
+                    else:
+                        metrics.inc("llm.error")
+                        settled = True
+                        self.breaker.record_failure()
+                        last_error = value
+                        break
+            finally:
+                stop.set()
+                if not settled:
+                    self.breaker.release()
+            if received:
+                raise LLMUnavailable(f"{self.name} stream broke off: {last_error}") from last_error
+            if attempt < self.retries:
+                pause = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if time.monotonic() + pause >= end:
+                    break
+                time.sleep(pause)
+        raise LLMUnavailable(f"{self.name} backend failed: {last_error}") from last_error
+
+    def _pump(self, contents: Contents, chunks: "queue.Queue[tuple]", stop: threading.Event, timeout: float):
+        # runs on the call executor so a stalled stream cannot block the caller past its deadline
+        try:
+            for chunk in self.backend.stream(contents, timeout):
+                if stop.is_set():
+                    return
+                chunks.put(("chunk", chunk))
+            chunks.put(("done", None))
+        except Exception as e:
+            chunks.put(("error", e))
+
+
+def backend_from_env() -> Optional[LLMBackend]:
+    """
+    ``GREENMATCH_LLM_BACKEND``: ``gemini`` (default when ``GEMINI_API_KEY`` is set),
+    ``stub`` or ``none``. The stub reads ``GREENMATCH_STUB_LATENCY`` (seconds),
+    ``GREENMATCH_STUB_FAILURE_RATE`` (0..1) and ``GREENMATCH_STUB_SEED``.
+    """
+    api_key = os.getenv("GEMINI_API_KEY")
+    choice = os.getenv("GREENMATCH_LLM_BACKEND", "gemini" if api_key else "none").lower()
+    if choice == "stub":
+        return StubBackend(
+            latency=float(os.getenv("GREENMATCH_STUB_LATENCY", "0.5")),
+            failure_rate=float(os.getenv("GREENMATCH_STUB_FAILURE_RATE", "0")),
+            seed=int(os.getenv("GREENMATCH_STUB_SEED", "0")),
+        )
+    if choice == "gemini" and api_key:
+        try:
+            return GeminiBackend(api_key, os.getenv("GREENMATCH_GEMINI_MODEL", DEFAULT_MODEL))
+        except ImportError:
+            return None
+    return None
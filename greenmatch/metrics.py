@@ -0,0 +1,215 @@
+"""
+Lightweight in-process timing metrics.
+
+``span(name)`` (context manager) and ``timed(name)`` (decorator) record how long
+a block takes into a per-name ``Histogram``; ``inc(name)`` bumps a counter.
+Histograms keep Prometheus-style cumulative buckets for export plus a bounded
+window of recent samples for p50/p95/p99. With ``GREENMATCH_METRICS=0`` spans
+are a shared no-op object and cost one attribute lookup.
+
+``render_prometheus()`` produces the text exposition format; set
+``GREENMATCH_METRICS_FILE`` and call ``start_exporter()`` to have it written
+periodically (e.g. for node_exporter's textfile collector).
+"""
+import functools
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+ENABLED = os.getenv("GREENMATCH_METRICS", "1") != "0"
+METRICS_FILE = os.getenv("GREENMATCH_METRICS_FILE")
+EXPORT_INTERVAL_SECONDS = 15.0
+
+# Upper bounds in seconds, roughly x2.5 apart from 1 ms to 60 s.
+BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0,
+)
+
+
+class Histogram:
+    def __init__(self, window: int = 2048):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        with self._lock:
+            self.counts[i] += 1
+            self.total += seconds
+            self.count += 1
+            self.recent.append(seconds)
+
+    def quantiles(self, qs=(0.5, 0.95, 0.99)) -> Dict[float, float]:
+        with self._lock:
+            ordered = sorted(self.recent)
+        if not ordered:
+            return {q: 0.0 for q in qs}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in qs}
+
+
+class Registry:
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        h = self.histograms.get(name)
+        if h is None:
+            with self._lock:
+                h = self.histograms.setdefault(name, Histogram())
+        return h
+
+    def observe(self, name: str, seconds: float):
+        self.histogram(name).observe(seconds)
+
+    def inc(self, name: str, amount: float = 1.0):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0.0) + amount
+
+    # Readers copy under the lock: a new series added meanwhile would otherwise
+    # break iteration ("dictionary changed size during iteration").
+    def histogram_items(self) -> List[Tuple[str, Histogram]]:
+        with self._lock:
+            return sorted(self.histograms.items())
+
+    def counter_values(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.counters)
+
+    def summary(self) -> List[Dict[str, float]]:
+        rows = []
+        for name, h in self.histogram_items():
+            q = h.quantiles()
+            with h._lock:
+                count, total = h.count, h.total
+            rows.append(
+                {
+                    "span": name,
+                    "count": count,
+                    "p50_ms": round(q[0.5] * 1000, 1),
+                    "p95_ms": round(q[0.95] * 1000, 1),
+                    "p99_ms": round(q[0.99] * 1000, 1),
+                    "mean_ms": round(total / count * 1000, 1) if count else 0.0,
+                }
+            )
+        return rows
+
+    def render_prometheus(self, prefix: str = "greenmatch") -> str:
+        lines = []
+        histograms = self.histogram_items()
+        if histograms:
+            metric = f"{prefix}_span_seconds"
+            lines += [f"# HELP {metric} Duration of instrumented code paths.", f"# TYPE {metric} histogram"]
+            for name, h in histograms:
+                with h._lock:
+                    counts, total, count = list(h.counts), h.total, h.count
+                cumulative = 0
+                for bound, c in zip(BUCKETS + (float("inf"),), counts):
+                    cumulative += c
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{metric}_bucket{{span="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{span="{name}"}} {total:.6f}')
+                lines.append(f'{metric}_count{{span="{name}"}} {count}')
+        counters = sorted(self.counter_values().items())
+        if counters:
+            metric = f"{prefix}_events_total"
+            lines += [f"# HELP {metric} Counted events.", f"# TYPE {metric} counter"]
+            for name, value in counters:
+                lines.append(f'{metric}{{event="{name}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        REGISTRY.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str):
+    return _Span(name) if ENABLED else _NOOP
+
+
+def timed(name: str) -> Callable:
+    def decorate(fn: Callable) -> Callable:
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                REGISTRY.observe(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorate
+
+
+def observe(name: str, seconds: float):
+    if ENABLED:
+        REGISTRY.observe(name, seconds)
+
+
+def inc(name: str, amount: float = 1.0):
+    if ENABLED:
+        REGISTRY.inc(name, amount)
+
+
+_exporter: Optional[threading.Thread] = None
+
+
+def start_exporter(path: Optional[str] = METRICS_FILE, interval: float = EXPORT_INTERVAL_SECONDS):
+    """Write the Prometheus text file every ``interval`` seconds; no-op without a path."""
+    global _exporter
+    if not ENABLED or not path or _exporter is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                REGISTRY.write_prometheus(path)
+            except OSError:
+                pass
+
+    _exporter = threading.Thread(target=run, name="greenmatch-metrics-export", daemon=True)
+    _exporter.start()
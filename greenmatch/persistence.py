@@ -0,0 +1,281 @@
+"""
+Write-behind persistence for per-user session state.
+
+Streamlit re-executes the script on every interaction, but most reruns do not
+change anything worth storing. ``DirtyTracker`` remembers what was last handed
+to storage and reports only the fields that changed; ``WriteBehindQueue``
+coalesces those changes per user and flushes them from a background thread
+after a short window, so a burst of clicks becomes a single write. Id sets are
+staged as ``IdChanges`` (what this session added or removed), so two tabs of
+one user do not overwrite each other's accepts.
+
+``StateCache`` keeps decoded state of recently seen users for the whole
+process, so a reconnect or a second tab does not go back to the database.
+The queue applies every successful write to it (write-through).
+"""
+import atexit
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from greenmatch import metrics
+from greenmatch.db import IdChanges
+
+# Reward points are not staged here: they go through the greenmatch.rewards ledger.
+STATE_FIELDS = ("profile", "challenges", "accepted_ids", "completed_ids")
+# Fields staged as IdChanges once the tracker knows the stored value.
+ID_SET_FIELDS = ("accepted_ids", "completed_ids")
+
+FLUSH_WINDOW_SECONDS = 0.5
+STATE_CACHE_ENTRIES = 2048
+# Other processes may write the same user; after this long a cached entry is reloaded.
+STATE_CACHE_MAX_AGE_SECONDS = 300.0
+
+logger = logging.getLogger(__name__)
+
+
+def merge_fields(older: Dict[str, Any], newer: Dict[str, Any]) -> Dict[str, Any]:
+    """Staged ``older`` fields followed by ``newer`` ones; ``IdChanges`` are combined, not replaced."""
+    merged = dict(older)
+    for f, value in newer.items():
+        if isinstance(value, IdChanges) and f in merged:
+            before = merged[f]
+            merged[f] = before.then(value) if isinstance(before, IdChanges) else value.apply(before)
+        else:
+            merged[f] = value
+    return merged
+
+
+def apply_fields(state: Dict[str, Any], fields: Dict[str, Any]):
+    """Update decoded ``state`` in place with written ``fields``."""
+    for f, value in fields.items():
+        state[f] = value.apply(state.get(f)) if isinstance(value, IdChanges) else copy.deepcopy(value)
+
+
+class DirtyTracker:
+    """Tracks the last persisted value of each state field for one session."""
+
+    def __init__(self, fields: Iterable[str] = STATE_FIELDS):
+        self.fields = tuple(fields)
+        self._clean: Dict[str, Any] = {}
+
+    def reset(self, state: Dict[str, Any]):
+        """Mark ``state`` as already stored (e.g. right after loading it)."""
+        self._clean = {f: copy.deepcopy(state.get(f)) for f in self.fields}
+
+    def changes(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return the fields of ``state`` that differ from the last snapshot and mark
+        them clean. Id sets with a snapshot come back as ``IdChanges``.
+        """
+        dirty: Dict[str, Any] = {}
+        for f in self.fields:
+            value = state.get(f)
+            if f not in self._clean or self._clean[f] != value:
+                clean = copy.deepcopy(value)
+                if f in ID_SET_FIELDS and f in self._clean:
+                    dirty[f] = IdChanges.between(self._clean[f], value)
+                else:
+                    dirty[f] = clean
+                self._clean[f] = clean
+        return dirty
+
+
+class StateCache:
+    """
+    Process-wide LRU of decoded user state. ``loader(user_id)`` fills misses and
+    may return None for a user without stored state. Entries are deep-copied on
+    the way in and out, because sessions mutate their state in place.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[int], Optional[Dict[str, Any]]],
+        fields: Iterable[str] = STATE_FIELDS,
+        max_entries: int = STATE_CACHE_ENTRIES,
+        max_age: float = STATE_CACHE_MAX_AGE_SECONDS,
+    ):
+        self.loader = loader
+        self.fields = tuple(fields)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[int, Tuple[float, Optional[Dict[str, Any]]]]" = OrderedDict()
+        # Per user with a load in flight: loads running and writes applied meanwhile.
+        # A load that overlapped a write of its user is not cached.
+        self._loading: Dict[int, int] = {}
+        self._writes: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is not None and now - entry[0] < self.max_age:
+                self._data.move_to_end(user_id)
+                self.hits += 1
+                metrics.inc("state_cache.hit")
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+            self._loading[user_id] = self._loading.get(user_id, 0) + 1
+            writes = self._writes.get(user_id, 0)
+        metrics.inc("state_cache.miss")
+        try:
+            state = self.loader(user_id)
+            if state is not None:
+                state = {f: state.get(f) for f in self.fields}
+        except BaseException:
+            with self._lock:
+                self._done_loading(user_id)
+            raise
+        with self._lock:
+            overlapped = self._writes.get(user_id, 0) != writes
+            self._done_loading(user_id)
+            if overlapped:
+                return state
+            self._data[user_id] = (now, copy.deepcopy(state))
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return state
+
+    def _done_loading(self, user_id: int):
+        """Holds ``_lock``; forgets a user's write count once none of its loads is running."""
+        self._loading[user_id] -= 1
+        if not self._loading[user_id]:
+            del self._loading[user_id]
+            self._writes.pop(user_id, None)
+
+    def apply(self, user_id: int, fields: Dict[str, Any]):
+        """Write-through: merge freshly written ``fields`` into a cached entry."""
+        with self._lock:
+            if user_id in self._loading:
+                self._writes[user_id] = self._writes.get(user_id, 0) + 1
+            entry = self._data.get(user_id)
+            if entry is None:
+                return
+            state = entry[1] if entry[1] is not None else {f: None for f in self.fields}
+            apply_fields(state, {f: v for f, v in fields.items() if f in self.fields})
+            self._data[user_id] = (entry[0], state)
+
+    def invalidate(self, user_id: Optional[int] = None):
+        with self._lock:
+            if user_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+class WriteBehindQueue:
+    """
+    Coalesces staged field updates per user and writes them after ``flush_window``
+    seconds. ``writer(user_id, fields)`` is called with the merged changes; after
+    it succeeds, so is ``on_written(user_id, fields)`` (e.g. ``StateCache.apply``).
+    At most one write per user is in flight, whether from the background thread
+    or ``flush()``, so an older batch can never commit after a newer one.
+    """
+
+    def __init__(
+        self,
+        writer: Callable[[int, Dict[str, Any]], None],
+        flush_window: float = FLUSH_WINDOW_SECONDS,
+        on_written: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+    ):
+        self.writer = writer
+        self.on_written = on_written
+        self.flush_window = flush_window
+        self.writes = 0
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._due: Dict[int, float] = {}
+        self._writing: Set[int] = set()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        atexit.register(self.flush)
+
+    def stage(self, user_id: int, fields: Dict[str, Any]):
+        if not fields:
+            return
+        with self._cond:
+            self._pending[user_id] = merge_fields(self._pending.get(user_id, {}), fields)
+            # The deadline is set by the first change of a burst and not pushed
+            # back by later ones, so a busy session still gets written regularly.
+            self._due.setdefault(user_id, time.monotonic() + self.flush_window)
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def pending(self, user_id: int) -> bool:
+        with self._cond:
+            return user_id in self._pending
+
+    def flush(self, user_id: Optional[int] = None):
+        """Synchronously write pending changes for one user, or for everyone."""
+        with self._cond:
+            ids = list(set(self._pending) | self._writing) if user_id is None else [user_id]
+            # let in-flight writes of these users finish first, then write what is left
+            while any(uid in self._writing for uid in ids):
+                self._cond.wait()
+            batch = {uid: self._take(uid) for uid in ids if uid in self._pending}
+        for uid, fields in batch.items():
+            self._write(uid, fields)
+
+    def _take(self, user_id: int) -> Dict[str, Any]:
+        """Pop the pending fields of a user and mark a write of them in flight; holds ``_cond``."""
+        self._due.pop(user_id, None)
+        self._writing.add(user_id)
+        return self._pending.pop(user_id)
+
+    def _write(self, user_id: int, fields: Dict[str, Any]):
+        try:
+            self.writer(user_id, fields)
+            self.writes += 1
+            if self.on_written is not None:
+                self.on_written(user_id, fields)
+        except Exception:
+            logger.exception("Write-behind flush failed for user %s; will retry", user_id)
+            with self._cond:
+                # No other write of this user ran meanwhile, so only values staged
+                # since then are newer than the ones we failed to write.
+                self._pending[user_id] = merge_fields(fields, self._pending.get(user_id, {}))
+                self._due[user_id] = time.monotonic() + self.flush_window
+        finally:
+            with self._cond:
+                self._writing.discard(user_id)
+                self._cond.notify_all()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="greenmatch-write-behind", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # users with a write in flight wait until it is done
+                due = {uid: at for uid, at in self._due.items() if uid not in self._writing}
+                if not due:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                ready = [uid for uid, at in due.items() if at <= now]
+                if not ready:
+                    self._cond.wait(min(due.values()) - now)
+                    continue
+                batch = {uid: self._take(uid) for uid in ready}
+            for uid, fields in batch.items():
+                self._write(uid, fields)
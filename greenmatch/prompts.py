@@ -0,0 +1,244 @@
+"""
+Prompt construction for challenge generation.
+
+Persona and company entries are rendered once per data version and reused;
+per request only the selected entries and the user profile are joined onto the
+fixed instructions. By default entries are compact digests that keep just the
+fields the model uses to match and pick companies (no links, no full reports).
+
+``PromptStats`` records the size of every prompt that is sent and counts it in
+``greenmatch.metrics`` as ``prompt.<kind>.requests``, ``.chars`` and
+``.est_tokens``, so sizes show up in the Prometheus export and on the admin
+dashboard.
+"""
+import json
+import math
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+from greenmatch import metrics
+
+CHALLENGE_SYSTEM_PROMPT = """
+You are a helpful AI assistant. You design personalised, realistic sustainability challenges.
+
+You have access to a library of archetype personas (ARCHETYPE_PERSONAS) which describe values, challenges, and motivations. You also have access to a curated list of sustainable startups (COMPANY_LISTS).
+
+Your task is to analyze the provided user_profile and perform the following steps:
+
+1.  **Internal Persona Matching:** Silently determine which **one or two** archetype personas the user is closest to based on their age, values, tech attitude, income, housing, and habits.
+
+2.  **Company-Driven Challenge Generation:** Generate 3–4 challenges that are **directly inspired by the products or services** in the `COMPANY_LISTS`.
+
+Each challenge must:
+*   Be linked to a specific company. The action you describe should be something a user could achieve using a product from the list. Mention the company by name as a concrete example (e.g., "...using a kit from YUMA or Priwatt," or "...by switching to WILDBAGS.").
+*   Be feasible for the user. The suggested company and product must respect the user's housing situation, financial constraints, and comfort with technology.
+*   Reflect the persona's priorities. The challenge's tone and goal must align with the values of the matched persona (e.g., cost-saving for Sarah, convenience for Clara, tech optimization for Felix).
+*   Offer clear impact. Focus on realistic energy or CO₂ reduction and/or clear cost savings.
+
+---
+#### **Important Constraints and Nuances:**
+
+*   **Financial Sensitivity (e.g., Sarah, Julia):** For users on a low income, **only** suggest challenges based on low-cost or free company offerings. For example, switching to WILDPLASTIC trash bags is a great fit; suggesting a Priwatt solar system (which requires a large upfront investment) is **not**.
+*   **Tech Skepticism (e.g., David):** For users who are older, overwhelmed, or tech-averse, suggest simple, offline actions. A good match would be hosting bees with Wildbiene + Partner. A poor match would be setting up a smart EV charger from Entratek.
+*   **Tech-Savvy & DIY (e.g., Felix, Thomas):** For these users, you **should** propose challenges that involve smart-home tech, data monitoring, or hands-on installation, such as the offerings from Priwatt, YUMA, or Entratek.
+*   **Privacy-Aware (e.g., Ben):** When suggesting tech solutions for this persona, prioritize companies that offer local control or have a clear privacy focus.
+*   **Activist & Ethical Focus (e.g., Lena, Hannah):** For these users, highlight the systemic or community impact of a company's mission. WILDPLASTIC (fair wages for collectors) or Wildbiene + Partner (supporting agricultural pollination) are excellent examples.
+*   **Concrete Actions:** Always describe a specific behavior: what to do, how often, for how long.
+*   **CO₂ Savings:** For each challenge, provide a rough monthly CO₂ saving as a *positive number* in kg (typically between 3 and 100 kg/month).
+
+---
+#### **Example of a Good Response Flow:**
+
+*   **User Profile:** "I'm 45, own my home with a garden, and recently bought an electric car. I'm a software engineer, so I'm comfortable with tech and like optimizing things to save money and be more efficient."
+*   **Internal Persona Match:** Felix (tech-savvy, data-driven) and Thomas (DIY, homeowner).
+*   **Company Match from List:** Entratek GmbH (specializes in EV charging solutions).
+*   **Generated Challenge:**
+    *   **Title:** "Install an Intelligent EV Charging Station"
+    *   **Description:** "Optimize your electric vehicle charging by installing a smart wallbox from a provider like Entratek. This allows you to schedule charging for off-peak hours and monitor your energy consumption."
+    *   **Why_it_fits:** "As a tech-savvy homeowner with an EV, this project aligns perfectly with your interest in optimization and efficiency, giving you direct control over your energy costs."
+
+---
+#### **Output Format (VERY IMPORTANT):**
+
+Return ONLY valid JSON with exactly this structure. Do not add any text or explanation outside of the JSON block.
+
+```json
+{
+  "challenges": [
+    {
+      "id": "short_unique_id",
+      "title": "short title",
+      "description": "1–3 short sentences explaining what to do, referencing a company from the list.",
+      "difficulty": "Easy | Medium | Advanced",
+      "estimated_monthly_co2_saving_kg": number,
+      "why_it_fits": "1–2 sentences explaining why this challenge and the suggested company's approach suit THIS user."
+    }
+  ]
+}
+
+- DO NOT include persona names in the JSON.
+- DO NOT add extra explanation outside of the JSON.
+"""
+
+# Profile fields never sent to the model. Generated challenges are cached and shared
+# by every user with the same normalized profile, so nothing personal may shape them.
+PRIVATE_PROFILE_FIELDS = ("name",)
+
+# Rough characters-per-token ratio for English prose; good enough for trend tracking.
+CHARS_PER_TOKEN = 4
+
+
+def _join(values: Any) -> str:
+    if isinstance(values, (list, tuple)):
+        return ", ".join(str(v) for v in values)
+    return str(values or "")
+
+
+def persona_line(p: Dict[str, Any]) -> str:
+    return (
+        f"- {p.get('name')} ({p.get('age')}, {p.get('occupation')}, {_join(p.get('demographics'))}): "
+        f"values: {_join(p.get('values'))}; challenges: {_join(p.get('challenges'))}; "
+        f"tech: {p.get('attitude_technology', '')} energy: {p.get('attitude_energy', '')} "
+        f"motivation: {p.get('motivation', '')}"
+    )
+
+
+def company_line(c: Dict[str, Any]) -> str:
+    report = c.get("detailed_report", {})
+    return (
+        f"- {c.get('company_name')}: {c.get('what_it_does', '')} "
+        f"Offers: {'; '.join(p.rstrip('.') for p in report.get('products_and_services', []))}. "
+        f"For: {report.get('target_audience', '')}"
+    )
+
+
+def persona_digest(personas: List[Dict[str, Any]]) -> str:
+    return "\n".join(persona_line(p) for p in personas)
+
+
+def company_digest(companies: Dict[str, Any]) -> str:
+    return "\n".join(company_line(c) for c in companies.get("companies_report", []))
+
+
+# (id(personas), id(companies), compact) -> (personas, companies, lines). The entry
+# keeps the data objects alive, so their ids cannot be reused by newer ones.
+_lines_cache: Dict[Tuple[int, int, bool], Tuple[Any, Any, Tuple[List[str], List[str]]]] = {}
+_lines_lock = threading.Lock()
+
+
+def catalog_lines(
+    personas: List[Dict[str, Any]], companies: Dict[str, Any], compact: bool = True
+) -> Tuple[List[str], List[str]]:
+    """
+    One rendered entry per persona and per company. Cached by the identity of the
+    data objects, which ``greenmatch.static_data`` keeps stable until the files change.
+    """
+    key = (id(personas), id(companies), compact)
+    entry = _lines_cache.get(key)
+    if entry is not None and entry[0] is personas and entry[1] is companies:
+        return entry[2]
+    company_list = companies.get("companies_report", [])
+    if compact:
+        lines = ([persona_line(p) for p in personas], [company_line(c) for c in company_list])
+    else:
+        lines = (
+            [json.dumps(p, ensure_ascii=False) for p in personas],
+            [json.dumps(c, ensure_ascii=False) for c in company_list],
+        )
+    with _lines_lock:
+        if len(_lines_cache) >= 4:
+            _lines_cache.clear()
+        _lines_cache[key] = (personas, companies, lines)
+    return lines
+
+
+def build_challenge_prompt(
+    profile: Dict[str, Any],
+    personas: List[Dict[str, Any]],
+    companies: Dict[str, Any],
+    compact: bool = True,
+    selection: Optional[Tuple[Sequence[int], Sequence[int]]] = None,
+) -> str:
+    """
+    ``selection`` holds (persona indices, company indices) from the retrieval stage;
+    without it the whole catalog is included.
+    """
+    persona_lines, company_lines = catalog_lines(personas, companies, compact)
+    header = ""
+    if selection is not None:
+        persona_idx, company_idx = selection
+        persona_lines = [persona_lines[i] for i in persona_idx]
+        company_lines = [company_lines[i] for i in company_idx]
+        header = (
+            "\n\nThe personas and companies below were pre-selected as the closest matches "
+            "for this user; only use companies from this list."
+        )
+    return (
+        CHALLENGE_SYSTEM_PROMPT
+        + header
+        + "\n\nARCHETYPE_PERSONAS:\n"
+        + "\n".join(persona_lines)
+        + "\n\nCOMPANY_LISTS:\n"
+        + "\n".join(company_lines)
+        + "\n\nUser profile:\n"
+        + json.dumps(
+            {k: v for k, v in profile.items() if k not in PRIVATE_PROFILE_FIELDS},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def prompt_sizes(counters: Dict[str, float]) -> List[Dict[str, Any]]:
+    """Per-kind prompt size rows from the ``prompt.*`` counters of a ``metrics.Registry``."""
+    kinds: Dict[str, Dict[str, float]] = {}
+    for name, value in counters.items():
+        parts = name.split(".")
+        if len(parts) == 3 and parts[0] == "prompt":
+            kinds.setdefault(parts[1], {})[parts[2]] = value
+    rows = []
+    for kind, t in sorted(kinds.items()):
+        requests = t.get("requests", 0) or 1
+        rows.append(
+            {
+                "prompt": kind,
+                "requests": int(t.get("requests", 0)),
+                "avg_chars": round(t.get("chars", 0) / requests),
+                "avg_est_tokens": round(t.get("est_tokens", 0) / requests),
+            }
+        )
+    return rows
+
+
+class PromptStats:
+    """Per-request prompt sizes (recent window) plus running totals, per prompt kind."""
+
+    def __init__(self, window: int = 500):
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=window)
+        self.totals: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, prompt: str) -> Dict[str, Any]:
+        entry = {"kind": kind, "chars": len(prompt), "est_tokens": estimate_tokens(prompt)}
+        with self._lock:
+            self.recent.append(entry)
+            total = self.totals.setdefault(kind, {"requests": 0, "chars": 0, "est_tokens": 0})
+            total["requests"] += 1
+            total["chars"] += entry["chars"]
+            total["est_tokens"] += entry["est_tokens"]
+        metrics.inc(f"prompt.{kind}.requests")
+        metrics.inc(f"prompt.{kind}.chars", entry["chars"])
+        metrics.inc(f"prompt.{kind}.est_tokens", entry["est_tokens"])
+        return entry
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                kind: {**t, "avg_chars": t["chars"] / t["requests"], "avg_est_tokens": t["est_tokens"] / t["requests"]}
+                for kind, t in self.totals.items()
+            }
@@ -0,0 +1,253 @@
+"""
+Persisted proof uploads and asynchronous verification.
+
+Uploaded photos are downscaled (``greenmatch.images``) and written once to a
+content-addressed directory, together with a small thumbnail for the challenge
+card. Each "check this proof" request becomes a row in ``proof_jobs``;
+``ProofWorkerPool`` threads claim queued rows straight from SQLite, run the
+verifier and store the verdict, which the UI polls for. Because jobs are claimed
+in the database, several app processes can share the same queue, and
+verification throughput scales with the number of workers.
+
+A failed check is retried with exponential backoff (``not_before``), up to
+``MAX_ATTEMPTS`` times. While the model is shedding load (circuit open or
+admission refused) jobs wait without using up attempts; a job whose user is
+out of model quota waits until the quota window frees a call.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from PIL import Image
+
+from greenmatch import db
+from greenmatch.images import image_fingerprint, preprocess_image
+from greenmatch.llm import CircuitOpen, Overloaded
+
+UPLOAD_DIR = os.getenv("GREENMATCH_UPLOAD_DIR", "uploads")
+THUMB_SIDE = 256
+DEFAULT_PROOF_WORKERS = int(os.getenv("GREENMATCH_PROOF_WORKERS", "2"))
+MAX_ATTEMPTS = 3
+# Retry delay after the n-th failed attempt: RETRY_BASE_SECONDS * 2 ** (n - 1), capped.
+RETRY_BASE_SECONDS = 5.0
+RETRY_MAX_SECONDS = 300.0
+# Shown to the user when every attempt failed; the error itself only goes to the log.
+FAILED_VERDICT = "We could not check this photo right now. Please try again later."
+# A job still "running" after this long is assumed orphaned by a dead worker.
+STALE_AFTER_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+# verify(image, challenge, fingerprint, user_id) -> verdict
+Verifier = Callable[[Image.Image, Dict[str, Any], str, int], str]
+
+
+class ProofStore:
+    """Content-addressed files: ``<root>/<sha[:2]>/<sha>.jpg`` plus ``<sha>_thumb.jpg``."""
+
+    def __init__(self, root: str = UPLOAD_DIR):
+        self.root = root
+
+    def path(self, sha: str) -> str:
+        return os.path.join(self.root, sha[:2], f"{sha}.jpg")
+
+    def thumb_path(self, sha: str) -> str:
+        return os.path.join(self.root, sha[:2], f"{sha}_thumb.jpg")
+
+    def save(self, upload: Any) -> Dict[str, str]:
+        """Store an upload (file-like or bytes); returns its ``sha`` and image ``fingerprint``."""
+        img, data = preprocess_image(upload)
+        sha = hashlib.sha256(data).hexdigest()
+        path = self.path(sha)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            thumb = img.copy()
+            thumb.thumbnail((THUMB_SIDE, THUMB_SIDE))
+            thumb.save(self.thumb_path(sha), format="JPEG", quality=80)
+        return {"sha": sha, "fingerprint": image_fingerprint(img)}
+
+    def open(self, sha: str) -> Image.Image:
+        with Image.open(self.path(sha)) as img:
+            img.load()
+            return img
+
+
+def enqueue_proof(user_id: int, challenge: Dict[str, Any], stored: Dict[str, str]) -> int:
+    with db.transaction() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO proof_jobs (user_id, challenge_id, challenge_title, challenge_description,
+                                    image_sha, fingerprint, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                user_id,
+                str(challenge["id"]),
+                challenge.get("title", ""),
+                challenge.get("description", ""),
+                stored["sha"],
+                stored["fingerprint"],
+                time.time(),
+            ),
+        )
+        return cur.lastrowid
+
+
+def latest_proof_job(user_id: int, challenge_id: str) -> Optional[Dict[str, Any]]:
+    with db.connection() as conn:
+        row = conn.execute(
+            """
+            SELECT * FROM proof_jobs WHERE user_id = ? AND challenge_id = ?
+            ORDER BY id DESC LIMIT 1
+            """,
+            (user_id, str(challenge_id)),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def queue_depth() -> int:
+    with db.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM proof_jobs WHERE status = 'queued'").fetchone()[0]
+
+
+def claim_next_job() -> Optional[Dict[str, Any]]:
+    now = time.time()
+    # idle workers poll; only take the write lock when there is something to claim
+    with db.connection() as conn:
+        ready = conn.execute(
+            "SELECT 1 FROM proof_jobs WHERE status = 'queued' AND not_before <= ? LIMIT 1", (now,)
+        ).fetchone()
+    if ready is None:
+        return None
+    with db.transaction() as conn:
+        if db.HAS_RETURNING:
+            row = conn.execute(
+                """
+                UPDATE proof_jobs
+                SET status = 'running', started_at = ?, attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM proof_jobs WHERE status = 'queued' AND not_before <= ? ORDER BY id LIMIT 1
+                )
+                RETURNING *
+                """,
+                (now, now),
+            ).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT id FROM proof_jobs WHERE status = 'queued' AND not_before <= ? ORDER BY id LIMIT 1", (now,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE proof_jobs SET status = 'running', started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (now, row["id"]),
+                )
+                row = conn.execute("SELECT * FROM proof_jobs WHERE id = ?", (row["id"],)).fetchone()
+    return dict(row) if row else None
+
+
+def retry_delay(attempts: int) -> float:
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def requeue_job(job_id: int, delay: float, count_attempt: bool = True):
+    """Put a claimed job back in the queue, claimable again after ``delay`` seconds."""
+    with db.transaction() as conn:
+        conn.execute(
+            """
+            UPDATE proof_jobs SET status = 'queued', not_before = ?, attempts = attempts - ?
+            WHERE id = ?
+            """,
+            (time.time() + delay, 0 if count_attempt else 1, job_id),
+        )
+
+
+def finish_job(job_id: int, status: str, verdict: str):
+    with db.transaction() as conn:
+        conn.execute(
+            "UPDATE proof_jobs SET status = ?, verdict = ?, finished_at = ? WHERE id = ?",
+            (status, verdict, time.time(), job_id),
+        )
+
+
+def requeue_stale_jobs(older_than: float = STALE_AFTER_SECONDS) -> int:
+    with db.transaction() as conn:
+        cur = conn.execute(
+            "UPDATE proof_jobs SET status = 'queued' WHERE status = 'running' AND started_at < ?",
+            (time.time() - older_than,),
+        )
+        return cur.rowcount
+
+
+class ProofWorkerPool:
+    """Worker threads that drain ``proof_jobs`` with ``verify(image, challenge, fingerprint, user_id)``."""
+
+    def __init__(
+        self,
+        verify: Verifier,
+        store: Optional[ProofStore] = None,
+        workers: int = DEFAULT_PROOF_WORKERS,
+        poll_interval: float = 2.0,
+    ):
+        self.verify = verify
+        self.store = store or ProofStore()
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        requeue_stale_jobs()
+        self._threads: List[threading.Thread] = [
+            threading.Thread(target=self._run, name=f"greenmatch-proof-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def notify(self):
+        """Wake idle workers after enqueueing; other processes are picked up by polling."""
+        with self._wake:
+            self._wake.notify_all()
+
+    def stop(self):
+        self._stop.set()
+        self.notify()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = claim_next_job()
+            except Exception:
+                logger.exception("Could not claim proof job")
+                job = None
+            if job is None:
+                with self._wake:
+                    self._wake.wait(self.poll_interval)
+                continue
+            self._process(job)
+
+    def _process(self, job: Dict[str, Any]):
+        challenge = {
+            "id": job["challenge_id"],
+            "title": job["challenge_title"],
+            "description": job["challenge_description"],
+        }
+        try:
+            verdict = self.verify(self.store.open(job["image_sha"]), challenge, job["fingerprint"], job["user_id"])
+            finish_job(job["id"], "done", verdict)
+            self.processed += 1
+        except (CircuitOpen, Overloaded) as e:
+            # the model is shedding load; that says nothing about this photo
+            logger.info("Proof job %s deferred: %s", job["id"], e)
+            requeue_job(job["id"], max(RETRY_BASE_SECONDS, getattr(e, "retry_after", 0.0)), count_attempt=False)
+        except Exception:
+            logger.exception("Proof job %s failed (attempt %s)", job["id"], job["attempts"])
+            if job["attempts"] < MAX_ATTEMPTS:
+                requeue_job(job["id"], retry_delay(job["attempts"]))
+            else:
+                finish_job(job["id"], "failed", FAILED_VERDICT)
@@ -0,0 +1,487 @@
+"""
+Local challenge recommender used when no AI result is available.
+
+Every catalog challenge is described by a small feature vector: which devices
+and motivations it speaks to, which housing types it works for, which devices
+it requires, its upfront cost, the tech comfort it needs and a category. A
+profile is encoded the same way and the whole catalog is scored in one batch of
+NumPy operations; the best candidates are then picked greedily with a penalty
+for repeating a category, so the result is not four variations of one idea.
+
+The catalog starts from ``SEED_CHALLENGES`` and grows with AI-generated
+challenges (e.g. the rows of ``challenge_cache``), whose features are derived
+from their text. Each added challenge appends one row to the feature arrays;
+past ``max_entries`` the oldest added challenges are evicted.
+"""
+import json
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+DEVICES = ("ev", "pv", "heat_pump", "smart_thermostat", "smart_meter", "car")
+MOTIVATIONS = ("save_money", "climate", "comfort", "health")
+HOUSING = ("apartment", "house", "other")
+CATEGORIES = ("heating", "electricity", "mobility", "consumption", "nature", "health")
+
+DEVICE_LABELS = {
+    "ev": "your EV",
+    "pv": "your solar setup",
+    "heat_pump": "your heat pump",
+    "smart_thermostat": "your smart thermostat",
+    "smart_meter": "your smart meter",
+    "car": "your daily travel",
+}
+MOTIVATION_LABELS = {
+    "save_money": "saving money",
+    "climate": "protecting the climate",
+    "comfort": "comfort",
+    "health": "a healthy lifestyle",
+}
+
+# Keyword patterns used both to read profiles and to derive features of generated challenges.
+DEVICE_PATTERNS = {
+    "ev": r"\bev\b|electric (?:car|vehicle)|wallbox|charg",
+    "pv": r"solar|\bpv\b|photovoltaic|balkonkraftwerk",
+    "heat_pump": r"heat ?pump",
+    "smart_thermostat": r"thermostat",
+    "smart_meter": r"smart meter|monitor|consumption data",
+    "car": r"\bcar\b|driv|commut",
+}
+MOTIVATION_PATTERNS = {
+    "save_money": r"save money|sav|cost|bill|cheap|afford|free",
+    "climate": r"climate|co2|co₂|emission|plastic|renewable|bee|biodivers|planet",
+    "comfort": r"comfort|convenien|easy|simple|cozy",
+    "health": r"health|walk|bike|cycl|training|food|diet|fitness",
+}
+CATEGORY_PATTERNS = {
+    "heating": r"heat|temperature|shower|hot water|thermostat|insulat",
+    "electricity": r"solar|pv|standby|electric|power|led|appliance|balkonkraftwerk|meter",
+    "mobility": r"car|ev\b|charg|bike|transport|commut|driv",
+    "consumption": r"plastic|bag|waste|packag|recycl|buy|shop|meat|food",
+    "nature": r"bee|garden|plant|biodivers|tree",
+    "health": r"health|training|walk|fitness",
+}
+HIGH_TECH = r"smart|app|data|monitor|install|wallbox|schedul|automat|system"
+HIGH_COST = r"install|buy|purchase|system|kit|wallbox|heat pump|panel"
+
+SEED_CHALLENGES: List[Dict[str, Any]] = [
+    {
+        "id": "heat_1c",
+        "title": "Lower room temperature by 1°C",
+        "description": "Keep your rooms about 1°C cooler than usual for the next 4 weeks.",
+        "difficulty": "Easy",
+        "estimated_monthly_co2_saving_kg": 20,
+        "why_it_fits": "A small, low-effort adjustment that usually doesn’t reduce comfort.",
+    },
+    {
+        "id": "standby",
+        "title": "Turn off standby devices at night",
+        "description": "Identify at least 5 devices and switch them fully off every night.",
+        "difficulty": "Easy",
+        "estimated_monthly_co2_saving_kg": 10,
+        "why_it_fits": "Quick action with visible impact on both your bill and emissions.",
+    },
+    {
+        "id": "car_free_day",
+        "title": "Choose one car-free workday",
+        "description": "Once per week, use public transport, bike or walk instead of driving.",
+        "difficulty": "Medium",
+        "estimated_monthly_co2_saving_kg": 25,
+        "why_it_fits": "Targets your commuting pattern and also supports a healthier routine.",
+        "requires": ["car"],
+    },
+    {
+        "id": "night_charging",
+        "title": "Charge your EV mainly at night",
+        "description": "Schedule your EV charging to off-peak or high-renewable hours.",
+        "difficulty": "Medium",
+        "estimated_monthly_co2_saving_kg": 30,
+        "why_it_fits": "You own an EV, so small changes in charging time can have a big effect.",
+        "requires": ["ev"],
+    },
+    {
+        "id": "shower_shorter",
+        "title": "Shorten hot showers",
+        "description": "Reduce each shower by around 2 minutes and slightly lower the hot water temperature.",
+        "difficulty": "Medium",
+        "estimated_monthly_co2_saving_kg": 15,
+        "why_it_fits": "Water heating is a major energy consumer in houses.",
+        "housing": ["house"],
+    },
+    {
+        "id": "wash_30",
+        "title": "Wash laundry at 30°C",
+        "description": "Run every regular laundry load at 30°C and air-dry instead of using the dryer for 4 weeks.",
+        "difficulty": "Easy",
+        "estimated_monthly_co2_saving_kg": 8,
+        "why_it_fits": "A free habit change that lowers your electricity bill right away.",
+    },
+    {
+        "id": "led_swap",
+        "title": "Swap your five most-used bulbs to LED",
+        "description": "Replace the bulbs you use most with LEDs and note the change on your next bill.",
+        "difficulty": "Easy",
+        "estimated_monthly_co2_saving_kg": 6,
+        "why_it_fits": "Cheap, simple and pays for itself within months.",
+    },
+    {
+        "id": "meat_free_days",
+        "title": "Two meat-free days a week",
+        "description": "Plan two vegetarian days every week for the next month.",
+        "difficulty": "Easy",
+        "estimated_monthly_co2_saving_kg": 25,
+        "why_it_fits": "Good for the climate and for a healthy diet, and usually cheaper too.",
+    },
+    {
+        "id": "balcony_solar",
+        "title": "Plan a plug-in balcony solar kit",
+        "description": "Check your balcony or terrace for a plug-and-play solar kit, e.g. from priwatt or YUMA, and compare offers.",
+        "difficulty": "Advanced",
+        "estimated_monthly_co2_saving_kg": 30,
+        "why_it_fits": "Generates your own renewable electricity without a full rooftop installation.",
+    },
+    {
+        "id": "thermostat_schedule",
+        "title": "Set up a heating schedule",
+        "description": "Programme your smart thermostat to lower the temperature at night and while you are away.",
+        "difficulty": "Medium",
+        "estimated_monthly_co2_saving_kg": 20,
+        "why_it_fits": "Lets your thermostat do the saving automatically.",
+        "requires": ["smart_thermostat"],
+    },
+    {
+        "id": "solar_self_use",
+        "title": "Shift appliances to sunny hours",
+        "description": "Run the dishwasher and washing machine when your solar panels produce the most power.",
+        "difficulty": "Easy",
+        "estimated_monthly_co2_saving_kg": 15,
+        "why_it_fits": "Uses more of the electricity you already generate yourself.",
+        "requires": ["pv"],
+    },
+    {
+        "id": "meter_check",
+        "title": "Weekly energy check-in",
+        "description": "Read your smart meter data once a week and find your biggest consumer.",
+        "difficulty": "Easy",
+        "estimated_monthly_co2_saving_kg": 10,
+        "why_it_fits": "Turns your meter data into concrete savings.",
+        "requires": ["smart_meter"],
+    },
+    {
+        "id": "wildbags",
+        "title": "Switch to recycled trash bags",
+        "description": "Replace your usual trash bags with WILDBAGS made from recovered plastic by WILDPLASTIC.",
+        "difficulty": "Easy",
+        "estimated_monthly_co2_saving_kg": 3,
+        "why_it_fits": "A low-cost swap that keeps plastic out of nature.",
+    },
+    {
+        "id": "host_bees",
+        "title": "Host wild bees",
+        "description": "Put up a wild bee nesting aid from Wildbiene + Partner on your balcony or in your garden.",
+        "difficulty": "Easy",
+        "estimated_monthly_co2_saving_kg": 3,
+        "why_it_fits": "A simple, offline way to support biodiversity where you live.",
+    },
+]
+
+
+def _flags(text: str, patterns: Dict[str, str], names: Iterable[str]) -> np.ndarray:
+    return np.array([1.0 if re.search(patterns[n], text) else 0.0 for n in names])
+
+
+def challenge_features(ch: Dict[str, Any]) -> Dict[str, Any]:
+    """Feature dict for a challenge; explicit ``requires`` / ``housing`` keys win over text heuristics."""
+    text = f"{ch.get('title', '')} {ch.get('description', '')}".lower()
+    difficulty = str(ch.get("difficulty", "")).lower()
+    requires = set(ch.get("requires", []))
+    if not requires and re.search(r"your (?:ev|electric car|electric vehicle)", text):
+        requires.add("ev")
+    housing = ch.get("housing")
+    if housing is None:
+        housing = ["house"] if re.search(r"garden|roof|wallbox|heat pump install", text) else list(HOUSING)
+    cost = {"easy": 0.1, "medium": 0.4, "advanced": 0.8}.get(difficulty, 0.4)
+    if re.search(HIGH_COST, text):
+        cost = max(cost, 0.7)
+    tech = 0.7 if re.search(HIGH_TECH, text) else 0.2
+    categories = _flags(text, CATEGORY_PATTERNS, CATEGORIES)
+    return {
+        "relevance": np.concatenate(
+            [_flags(text, DEVICE_PATTERNS, DEVICES), _flags(text, MOTIVATION_PATTERNS, MOTIVATIONS)]
+        ),
+        "housing": np.array([1.0 if h in housing else 0.0 for h in HOUSING]),
+        "requires": np.array([1.0 if d in requires else 0.0 for d in DEVICES]),
+        "cost": cost,
+        "tech": tech,
+        "co2": float(ch.get("estimated_monthly_co2_saving_kg") or 0),
+        "category": int(categories.argmax()) if categories.any() else len(CATEGORIES),
+    }
+
+
+def profile_features(profile: Dict[str, Any]) -> Dict[str, Any]:
+    devices_text = " ".join(profile.get("devices", [])).lower()
+    habits = str(profile.get("habits", "")).lower()
+    motivations_text = " ".join(profile.get("motivations", [])).lower()
+    devices = _flags(devices_text, DEVICE_PATTERNS, DEVICES)
+    devices[DEVICES.index("car")] = max(
+        devices[DEVICES.index("car")], devices[DEVICES.index("ev")], 1.0 if re.search(DEVICE_PATTERNS["car"], habits) else 0.0
+    )
+    motivations = _flags(motivations_text, MOTIVATION_PATTERNS, MOTIVATIONS)
+    housing = profile.get("housing", "apartment")
+    smart = devices[: DEVICES.index("car")].sum()
+    age = profile.get("age") or 40
+    tech_comfort = 0.3 + 0.15 * smart + (0.2 if age < 40 else -0.15 if age >= 65 else 0.0)
+    budget_sensitivity = 0.8 if motivations[MOTIVATIONS.index("save_money")] else 0.4
+    if devices[DEVICES.index("pv")] or devices[DEVICES.index("heat_pump")]:
+        budget_sensitivity -= 0.2
+    return {
+        "relevance": np.concatenate([devices, motivations]),
+        "devices": devices,
+        "housing": np.array([1.0 if h == housing else 0.0 for h in HOUSING]),
+        "tech_comfort": float(np.clip(tech_comfort, 0.0, 1.0)),
+        "budget_sensitivity": budget_sensitivity,
+    }
+
+
+def is_feasible(ch: Dict[str, Any], profile_feats: Dict[str, Any]) -> bool:
+    """Whether the challenge suits the profile's housing and needs only devices it has."""
+    f = challenge_features(ch)
+    return bool(
+        f["housing"] @ profile_feats["housing"] > 0 and f["requires"] @ (1.0 - profile_feats["devices"]) == 0
+    )
+
+
+# Catalog size cap: beyond it the oldest non-seed challenges are evicted.
+DEFAULT_CATALOG_ENTRIES = 10000
+# Feature columns of the catalog: name -> (shape of one row, dtype).
+FEATURE_LAYOUT = {
+    "relevance": ((len(DEVICES) + len(MOTIVATIONS),), float),
+    "housing": ((len(HOUSING),), float),
+    "requires": ((len(DEVICES),), float),
+    "cost": ((), float),
+    "tech": ((), float),
+    "co2": ((), float),
+    "category": ((), int),
+}
+
+
+class ChallengeCatalog:
+    """
+    Challenge catalog with its features stacked into arrays for batched scoring.
+    The challenges it is created with are kept for good; challenges added later
+    are evicted oldest first once there are more than ``max_entries``.
+    """
+
+    # relative weights of the score terms
+    RELEVANCE_WEIGHT = 1.0
+    CO2_WEIGHT = 0.5
+    COST_WEIGHT = 0.8
+    TECH_WEIGHT = 1.0
+    DIVERSITY_PENALTY = 0.6
+
+    def __init__(self, challenges: Iterable[Dict[str, Any]] = (), max_entries: int = DEFAULT_CATALOG_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._challenges: List[Dict[str, Any]] = []
+        self._keys = set()
+        # Rows are appended in place; readers hold views of the first rows, so
+        # growing or evicting builds new arrays instead of moving these.
+        self._arrays = self._allocate(64)
+        self._seeds: Optional[int] = None  # None while the seeds themselves are added
+        self.add(challenges)
+        self._seeds = len(self._challenges)
+
+    def __len__(self) -> int:
+        return len(self._challenges)
+
+    @staticmethod
+    def _allocate(capacity: int) -> Dict[str, np.ndarray]:
+        return {name: np.zeros((capacity, *shape), dtype) for name, (shape, dtype) in FEATURE_LAYOUT.items()}
+
+    def add(self, challenges: Iterable[Dict[str, Any]], keep_why: bool = True) -> int:
+        """
+        Add challenges whose id is new; returns how many were added. The first
+        challenge with an id wins, as ids key widgets and ``user_challenges`` rows.
+        Pass ``keep_why=False`` for challenges written for another user, whose
+        ``why_it_fits`` would not make sense to anyone else.
+        """
+        added = 0
+        with self._lock:
+            for ch in challenges:
+                if not ch.get("id") or not ch.get("title"):
+                    continue
+                key = str(ch["id"])
+                if key in self._keys:
+                    continue
+                self._keys.add(key)
+                ch = dict(ch)
+                if not keep_why:
+                    ch["why_it_fits"] = ""
+                self._append(ch)
+                added += 1
+        return added
+
+    def _append(self, ch: Dict[str, Any]):
+        """Holds ``_lock``."""
+        row = len(self._challenges)
+        if self._seeds is not None and row >= self.max_entries > self._seeds:
+            row = self._evict()
+        elif row == len(self._arrays["cost"]):
+            self._arrays = self._resized(2 * row)
+        features = challenge_features(ch)
+        for name, column in self._arrays.items():
+            column[row] = features[name]
+        self._challenges.append(ch)
+
+    def _resized(self, capacity: int, keep: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        arrays = self._allocate(capacity)
+        rows = np.arange(len(self._challenges)) if keep is None else keep
+        for name, column in arrays.items():
+            column[: len(rows)] = self._arrays[name][rows]
+        return arrays
+
+    def _evict(self) -> int:
+        """
+        Holds ``_lock``. Drop the oldest added challenges, a tenth of the cap at
+        once so eviction stays rare; returns the number of rows left.
+        """
+        n = len(self._challenges)
+        drop = max(1, min(n - self._seeds, self.max_entries // 10))
+        keep = np.concatenate([np.arange(self._seeds), np.arange(self._seeds + drop, n)])
+        for ch in self._challenges[self._seeds : self._seeds + drop]:
+            self._keys.discard(str(ch["id"]))
+        self._arrays = self._resized(max(len(self._arrays["cost"]), self.max_entries), keep)
+        self._challenges = [self._challenges[i] for i in keep]
+        return len(self._challenges)
+
+    def _snapshot(self) -> Tuple[List[Dict[str, Any]], Tuple[np.ndarray, ...]]:
+        with self._lock:
+            challenges, arrays, n = self._challenges, self._arrays, len(self._challenges)
+        co2 = arrays["co2"][:n]
+        # indices below n stay valid: later adds only append, evictions make a new list
+        return challenges, (
+            arrays["relevance"][:n],
+            arrays["housing"][:n],
+            arrays["requires"][:n],
+            arrays["cost"][:n],
+            arrays["tech"][:n],
+            co2 / ((co2.max() if n else 0.0) or 1.0),
+            arrays["category"][:n],
+        )
+
+    def scores(self, profile: Dict[str, Any]) -> np.ndarray:
+        _, (rel, housing, requires, cost, tech, co2, _cat) = self._snapshot()
+        return self._scores(profile_features(profile), rel, housing, requires, cost, tech, co2)
+
+    def _scores(self, p, rel, housing, requires, cost, tech, co2) -> np.ndarray:
+        score = (
+            self.RELEVANCE_WEIGHT * (rel @ p["relevance"])
+            + self.CO2_WEIGHT * co2
+            - self.COST_WEIGHT * cost * p["budget_sensitivity"]
+            - self.TECH_WEIGHT * np.maximum(0.0, tech - p["tech_comfort"])
+        )
+        feasible = (housing @ p["housing"] > 0) & (requires @ (1.0 - p["devices"]) == 0)
+        return np.where(feasible, score, -np.inf)
+
+    def recommend(self, profile: Dict[str, Any], k: int = 4, pool: int = 32) -> List[Dict[str, Any]]:
+        challenges, (rel, housing, requires, cost, tech, co2, cat) = self._snapshot()
+        if not challenges:
+            return []
+        p = profile_features(profile)
+        score = self._scores(p, rel, housing, requires, cost, tech, co2)
+        pool = min(pool, len(score))
+        candidates = np.argpartition(-score, pool - 1)[:pool]
+        candidates = candidates[np.isfinite(score[candidates])]
+        candidates = candidates[np.argsort(-score[candidates])]
+
+        picked: List[int] = []
+        picked_ids = set()
+        used = np.zeros(len(CATEGORIES) + 1)
+        remaining = list(candidates)
+        while remaining and len(picked) < k:
+            adjusted = [score[i] - self.DIVERSITY_PENALTY * used[cat[i]] for i in remaining]
+            best = remaining.pop(int(np.argmax(adjusted)))
+            if str(challenges[best]["id"]) in picked_ids:
+                continue
+            picked.append(best)
+            picked_ids.add(str(challenges[best]["id"]))
+            used[cat[best]] += 1
+        return [self._personalise(challenges[i], rel[i], p) for i in picked]
+
+    @staticmethod
+    def _personalise(ch: Dict[str, Any], rel: np.ndarray, p: Dict[str, Any]) -> Dict[str, Any]:
+        out = {k: v for k, v in ch.items() if k not in ("requires", "housing")}
+        matched = rel * p["relevance"]
+        devices = [DEVICE_LABELS[d] for d, m in zip(DEVICES, matched[: len(DEVICES)]) if m]
+        motivations = [MOTIVATION_LABELS[m] for m, v in zip(MOTIVATIONS, matched[len(DEVICES):]) if v]
+        reasons = []
+        if motivations:
+            reasons.append(f"Matches your focus on {' and '.join(motivations[:2])}.")
+        if devices:
+            reasons.append(f"Fits {devices[0]}.")
+        why = " ".join(reasons + [ch.get("why_it_fits", "")]).strip()
+        out["why_it_fits"] = why or "A practical step with a clear, measurable impact."
+        return out
+
+
+def load_cached_challenges(conn, limit: int = 5000) -> List[Dict[str, Any]]:
+    """
+    AI-generated challenges of the ``limit`` most recently used ``challenge_cache``
+    rows, least recently used first, so adding them in order evicts those first.
+    """
+    rows = conn.execute(
+        "SELECT challenges_json FROM challenge_cache ORDER BY last_used_at DESC LIMIT ?", (limit,)
+    ).fetchall()[::-1]
+    out: List[Dict[str, Any]] = []
+    for row in rows:
+        try:
+            out.extend(json.loads(row["challenges_json"]))
+        except ValueError:
+            continue
+    return out
+
+
+# Legal-form words dropped from company names, so "priwatt GmbH" is found as "Priwatt".
+LEGAL_FORMS = {"gmbh", "ag", "ug", "kg", "ohg", "se", "mbh", "co", "ltd", "inc", "llc", "sa", "bv"}
+
+
+def _words(text: str) -> List[str]:
+    words = re.findall(r"[a-z0-9äöüß]+", str(text).lower().replace("&", " und ").replace("+", " und "))
+    return ["und" if w == "and" else w for w in words]
+
+
+def company_aliases(name: str) -> Tuple[str, ...]:
+    """Normalized spellings of a company name: the short name without legal form, spaced and joined."""
+    words = _words(name)
+    while len(words) > 1 and words[-1] in LEGAL_FORMS:
+        words.pop()
+    return tuple(dict.fromkeys((" ".join(words), "".join(words)))) if words else ()
+
+
+def match_company(text: str, company_names: Iterable[str]) -> Optional[str]:
+    """The first of ``company_names`` mentioned in ``text`` under any of its aliases, else None."""
+    words = _words(text)
+    spaced = f" {' '.join(words)} "
+    for name in company_names:
+        if any(f" {alias} " in spaced for alias in company_aliases(name)):
+            return name
+    return None
+
+
+def tag_companies(challenges: List[Dict[str, Any]], company_names: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Attach the first of ``company_names`` named in each challenge, for per-company
+    stats. A ``company`` the challenge already has is kept; if it names a known
+    company it is replaced by that company's canonical name.
+    """
+    names = list(company_names)
+    for ch in challenges:
+        if ch.get("company"):
+            ch["company"] = match_company(ch["company"], names) or ch["company"]
+            continue
+        company = match_company(f"{ch.get('title', '')} {ch.get('description', '')}", names)
+        if company:
+            ch["company"] = company
+    return challenges
@@ -0,0 +1,180 @@
+"""
+Local retrieval stage in front of challenge generation.
+
+Companies and personas are indexed as TF-IDF vectors (company description and
+offers; persona values, attitudes and motivation). A profile is turned into a
+query, expanded with a few domain terms for the fixed form options, and only
+the top-k companies and the nearest personas are put into the prompt. The index
+is built once per data version, so the per-request cost is one sparse dot
+product per catalog entry and the prompt size no longer grows with the catalog.
+"""
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_TOP_COMPANIES = 6
+DEFAULT_TOP_PERSONAS = 2
+
+# Weight of age similarity relative to text similarity when ranking personas.
+PERSONA_AGE_WEIGHT = 0.3
+
+STOPWORDS = frozenset(
+    """
+    a an and are as at be by for from has have in into is it its of on or our that the their
+    them they this to was were will with who what which your you i my me we e g
+    """.split()
+)
+
+# Extra query terms for the fixed form options and a few common free-text words,
+# so "Heat pump" also finds offers phrased as "heating" or "renewable energy".
+QUERY_EXPANSIONS = {
+    "electric car (ev)": "electric vehicle ev charging e-mobility wallbox",
+    "solar panels (pv)": "solar photovoltaic pv renewable electricity self-sufficiency",
+    "heat pump": "heat pump heating renewable energy",
+    "smart thermostat": "smart home heating automation data",
+    "smart meter": "smart energy monitoring data consumption",
+    "save money": "affordable cost saving bills low-cost",
+    "protect climate": "sustainability climate co2 renewable environment",
+    "more comfort": "comfort convenient simple easy",
+    "healthy lifestyle": "health training balance fitness food",
+    "apartment": "balcony tenants plug-and-play households",
+    "house": "homeowners garden installation private households",
+    "car": "vehicle commute mobility",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for tok in re.findall(r"[a-zäöüß0-9][a-zäöüß0-9+-]*", text.lower()):
+        if tok in STOPWORDS or len(tok) < 2:
+            continue
+        if len(tok) > 4 and tok.endswith("s") and not tok.endswith("ss"):
+            tok = tok[:-1]
+        tokens.append(tok)
+    return tokens
+
+
+# Expansion keys as token runs, so "car" matches the word and not "care".
+_EXPANSION_TOKENS = [(tuple(tokenize(term)), extra) for term, extra in QUERY_EXPANSIONS.items()]
+
+
+def _contains_run(tokens: List[str], run: Tuple[str, ...]) -> bool:
+    n = len(run)
+    return n > 0 and any(tuple(tokens[i : i + n]) == run for i in range(len(tokens) - n + 1))
+
+
+def _join(values: Any) -> str:
+    if isinstance(values, (list, tuple)):
+        return " ".join(str(v) for v in values)
+    return str(values or "")
+
+
+def company_text(company: Dict[str, Any]) -> str:
+    report = company.get("detailed_report", {})
+    return " ".join(
+        [
+            company.get("company_name", ""),
+            company.get("what_it_does", ""),
+            _join(report.get("products_and_services")),
+            report.get("target_audience", ""),
+        ]
+    )
+
+
+def persona_text(persona: Dict[str, Any]) -> str:
+    return " ".join(
+        [
+            persona.get("occupation", ""),
+            _join(persona.get("values")),
+            _join(persona.get("challenges")),
+            persona.get("attitude_technology", ""),
+            persona.get("attitude_energy", ""),
+            persona.get("motivation", ""),
+        ]
+    )
+
+
+def profile_query(profile: Dict[str, Any]) -> str:
+    parts = [profile.get("housing", ""), profile.get("country", ""), profile.get("habits", "")]
+    parts.extend(profile.get("devices", []))
+    parts.extend(profile.get("motivations", []))
+    tokens = tokenize(" ".join(str(p) for p in parts if p))
+    parts.extend(extra for run, extra in _EXPANSION_TOKENS if _contains_run(tokens, run))
+    return " ".join(str(p) for p in parts if p)
+
+
+class TfidfIndex:
+    def __init__(self, documents: Sequence[str]):
+        tokenized = [tokenize(d) for d in documents]
+        df = Counter(tok for toks in tokenized for tok in set(toks))
+        n = len(tokenized)
+        self.idf = {tok: math.log((1 + n) / (1 + count)) + 1 for tok, count in df.items()}
+        self.vectors = [self._vector(toks) for toks in tokenized]
+
+    def _vector(self, tokens: List[str]) -> Dict[str, float]:
+        tf = Counter(t for t in tokens if t in self.idf)
+        vec = {tok: (1 + math.log(count)) * self.idf[tok] for tok, count in tf.items()}
+        norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+        return {tok: v / norm for tok, v in vec.items()}
+
+    def scores(self, query: str) -> List[float]:
+        q = self._vector(tokenize(query))
+        return [sum(w * vec.get(tok, 0.0) for tok, w in q.items()) for vec in self.vectors]
+
+
+class CatalogIndex:
+    def __init__(self, personas: List[Dict[str, Any]], companies: Dict[str, Any]):
+        self.personas = personas
+        self.companies = companies.get("companies_report", [])
+        self.company_index = TfidfIndex([company_text(c) for c in self.companies])
+        self.persona_index = TfidfIndex([persona_text(p) for p in self.personas])
+
+    def top_companies(self, profile: Dict[str, Any], k: int = DEFAULT_TOP_COMPANIES) -> List[int]:
+        scores = self.company_index.scores(profile_query(profile))
+        return sorted(range(len(scores)), key=lambda i: -scores[i])[:k]
+
+    def top_personas(self, profile: Dict[str, Any], k: int = DEFAULT_TOP_PERSONAS) -> List[int]:
+        scores = self.persona_index.scores(profile_query(profile))
+        age = profile.get("age")
+        if isinstance(age, (int, float)):
+            for i, p in enumerate(self.personas):
+                if isinstance(p.get("age"), (int, float)):
+                    scores[i] += PERSONA_AGE_WEIGHT * max(0.0, 1 - abs(age - p["age"]) / 30)
+        return sorted(range(len(scores)), key=lambda i: -scores[i])[:k]
+
+    def select(
+        self,
+        profile: Dict[str, Any],
+        top_companies: int = DEFAULT_TOP_COMPANIES,
+        top_personas: int = DEFAULT_TOP_PERSONAS,
+    ) -> Tuple[List[int], List[int]]:
+        """Indices of the nearest personas and the best-matching companies, best first."""
+        return self.top_personas(profile, top_personas), self.top_companies(profile, top_companies)
+
+
+# (personas, companies, index) of the latest catalog; holding the data objects
+# keeps their identity meaningful (a freed object's id can be reused)
+_index_cache: Optional[Tuple[Any, Any, CatalogIndex]] = None
+_index_lock = threading.Lock()
+
+
+def _cached_index(personas: List[Dict[str, Any]], companies: Dict[str, Any]) -> Optional[CatalogIndex]:
+    entry = _index_cache
+    if entry is not None and entry[0] is personas and entry[1] is companies:
+        return entry[2]
+    return None
+
+
+def get_catalog_index(personas: List[Dict[str, Any]], companies: Dict[str, Any]) -> CatalogIndex:
+    """The index for these data objects; rebuilt only when ``static_data`` hands out new ones."""
+    global _index_cache
+    index = _cached_index(personas, companies)
+    if index is None:
+        with _index_lock:
+            index = _cached_index(personas, companies)
+            if index is None:
+                index = CatalogIndex(personas, companies)
+                _index_cache = (personas, companies, index)
+    return index
@@ -0,0 +1,98 @@
+"""
+Append-only ledger of reward points.
+
+Every payout is a row in ``reward_events`` that is unique per (user, challenge,
+action), so a double click, a second tab or a retried request cannot pay twice.
+The balance is materialized in ``user_state.tokens`` and bumped in the same
+transaction as the insert: concurrent awards add up instead of overwriting each
+other, and reading the balance stays a single primary-key lookup.
+"""
+import time
+from typing import Any, Dict, List, Tuple
+
+from greenmatch import db, metrics
+
+ACCEPT_POINTS = 3
+MIN_COMPLETION_POINTS = 5
+
+
+def completion_points(challenge: Dict[str, Any]) -> int:
+    """Bigger reward on completion, based on the challenge's CO2 impact."""
+    try:
+        co2 = int(challenge.get("estimated_monthly_co2_saving_kg", 0) or 0)
+    except (TypeError, ValueError):
+        co2 = 0
+    return max(MIN_COMPLETION_POINTS, co2 // 5)
+
+
+def award(user_id: int, challenge_id: str, action: str, points: int) -> Tuple[int, int]:
+    """
+    Record ``points`` for ``action`` on a challenge once; returns the balance
+    afterwards and the points actually paid (0 if the event was already recorded).
+    """
+    with db.transaction() as conn:
+        paid = points
+        if not record(conn, user_id, challenge_id, action, points):
+            metrics.inc("rewards.duplicate")
+            paid = 0
+        row = conn.execute("SELECT tokens FROM user_state WHERE user_id = ?", (user_id,)).fetchone()
+    return ((row["tokens"] or 0) if row else 0), paid
+
+
+def record(conn, user_id: int, challenge_id: str, action: str, points: int) -> bool:
+    """
+    Ledger insert plus balance bump inside the caller's transaction; False if
+    the event was already recorded. Negative ``points`` spend from the balance.
+    """
+    cur = conn.execute(
+        """
+        INSERT INTO reward_events (user_id, challenge_id, action, points, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, challenge_id, action) DO NOTHING
+        """,
+        (user_id, str(challenge_id), action, int(points), time.time()),
+    )
+    if not cur.rowcount:
+        return False
+    conn.execute(
+        """
+        INSERT INTO user_state (user_id, tokens) VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET tokens = COALESCE(tokens, 0) + excluded.tokens
+        """,
+        (user_id, int(points)),
+    )
+    return True
+
+
+def balance(user_id: int) -> int:
+    with db.connection() as conn:
+        row = conn.execute("SELECT tokens FROM user_state WHERE user_id = ?", (user_id,)).fetchone()
+    return (row["tokens"] or 0) if row else 0
+
+
+def history(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+    with db.connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT challenge_id, action, points, created_at FROM reward_events
+            WHERE user_id = ? ORDER BY id DESC LIMIT ?
+            """,
+            (user_id, limit),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def rebuild_balances() -> int:
+    """Recompute every materialized balance from the ledger; returns the number of rows fixed."""
+    with db.transaction() as conn:
+        cur = conn.execute(
+            """
+            UPDATE user_state SET tokens = (
+                SELECT COALESCE(SUM(points), 0) FROM reward_events e WHERE e.user_id = user_state.user_id
+            )
+            WHERE COALESCE(tokens, 0) != (
+                SELECT COALESCE(SUM(points), 0) FROM reward_events e WHERE e.user_id = user_state.user_id
+            )
+            """
+        )
+        return cur.rowcount
@@ -0,0 +1,345 @@
+"""
+Pre-generated challenge pools per user segment.
+
+A segment is the nearest archetype persona × housing × budget bucket × tech
+bucket, e.g. ``Julia Lehmann|house|budget|simple``. The buckets come from the
+recommender's ``profile_features`` (budget sensitivity and tech comfort), the
+persona from the retrieval index, so classifying a profile is a local, sub-
+millisecond step.
+
+An offline batch job asks the model once per segment for a larger pool of
+challenges that name a company from ``companies.json``, vets them (required
+fields, difficulty, a plausible CO₂ number, a known company, feasible for the
+segment) and stores them in ``challenge_pools``:
+
+    python -m greenmatch.segments build --workers 4
+    python -m greenmatch.segments build --persona "Felix König" --force
+    python -m greenmatch.segments list
+
+At runtime ``ChallengePools.lookup`` classifies the profile, scores the pool
+with the local recommender and personalises ``why_it_fits``, so users of a
+segment with a pool never wait for a model call. Pools are tied to a version of
+the persona and company data and are ignored once that changes.
+"""
+import argparse
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from greenmatch import db, metrics
+from greenmatch.challenge_cache import fingerprint
+from greenmatch.jsonstream import ArrayItemParser
+from greenmatch.prompts import build_challenge_prompt
+from greenmatch.recommender import HOUSING, is_feasible, match_company, profile_features
+from greenmatch.retrieval import get_catalog_index
+
+# Bump when the segment prompt or the vetting rules change.
+POOL_VERSION = 1
+POOL_SIZE = 8
+
+BUDGETS = ("budget", "flexible")
+TECH_LEVELS = ("simple", "tech")
+# profile_features thresholds that split the buckets
+BUDGET_THRESHOLD = 0.6
+TECH_THRESHOLD = 0.5
+
+DIFFICULTIES = ("Easy", "Medium", "Advanced")
+MAX_CO2_KG = 100
+CHALLENGE_KEYS = ("title", "description", "difficulty", "estimated_monthly_co2_saving_kg", "why_it_fits")
+
+SEGMENT_INSTRUCTIONS = """
+
+This request is for a user SEGMENT, not a single person. Generate {n} challenges (instead of 3–4)
+that suit every user in the segment below, with a mix of difficulties and companies. Write
+why_it_fits for the segment as a whole, in second person and without personal details; it is
+adapted to each user later.
+
+Segment: {description}
+"""
+
+
+def segment_key(persona: str, housing: str, budget: str, tech: str) -> str:
+    return "|".join((persona, housing, budget, tech))
+
+
+def classify(profile: Dict[str, Any], personas: List[Dict[str, Any]], companies: Dict[str, Any]) -> str:
+    """The segment key of ``profile``."""
+    persona = personas[get_catalog_index(personas, companies).top_personas(profile, 1)[0]]
+    features = profile_features(profile)
+    housing = profile.get("housing") if profile.get("housing") in HOUSING else "other"
+    budget = "budget" if features["budget_sensitivity"] >= BUDGET_THRESHOLD else "flexible"
+    tech = "tech" if features["tech_comfort"] > TECH_THRESHOLD else "simple"
+    return segment_key(persona.get("name", ""), housing, budget, tech)
+
+
+def all_segments(personas: Sequence[Dict[str, Any]]) -> Iterator[Tuple[int, str, str, str]]:
+    """(persona index, housing, budget, tech) for every segment."""
+    for i in range(len(personas)):
+        for housing in HOUSING:
+            for budget in BUDGETS:
+                for tech in TECH_LEVELS:
+                    yield i, housing, budget, tech
+
+
+def segment_profile(persona: Dict[str, Any], housing: str, budget: str, tech: str) -> Dict[str, Any]:
+    """A representative profile of the segment, used for the prompt, company retrieval and vetting."""
+    devices = ["Smart thermostat", "Smart meter"] if tech == "tech" else []
+    return {
+        "age": persona.get("age") or 40,
+        "country": "Germany",
+        "housing": housing,
+        "devices": devices,
+        "motivations": ["Save money"] if budget == "budget" else ["Protect climate", "More comfort"],
+        "habits": "",
+    }
+
+
+def describe_segment(persona: Dict[str, Any], housing: str, budget: str, tech: str) -> str:
+    money = "on a tight budget, wants free or low-cost actions" if budget == "budget" else "can afford upfront costs"
+    comfort = "comfortable with smart-home tech and apps" if tech == "tech" else "prefers simple, offline actions"
+    return f"users closest to {persona.get('name')}, living in a {housing}, {money}, {comfort}."
+
+
+def _slug(value: Any) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", str(value).lower()).strip("_")[:40] or "challenge"
+
+
+def vet(
+    items: Sequence[Any], segment: str, profile: Dict[str, Any], company_names: Sequence[str]
+) -> List[Dict[str, Any]]:
+    """The generated challenges that are usable for the segment, normalised and with segment-unique ids."""
+    prefix = "pool" + hashlib.sha1(segment.encode("utf-8")).hexdigest()[:6]
+    features = profile_features(profile)
+    vetted: List[Dict[str, Any]] = []
+    titles, ids = set(), set()
+    for item in items:
+        if not isinstance(item, dict) or not all(item.get(k) for k in ("id", "title", "description")):
+            continue
+        try:
+            co2 = float(item.get("estimated_monthly_co2_saving_kg"))
+        except (TypeError, ValueError):
+            continue
+        if not 0 < co2 <= MAX_CO2_KG:
+            continue
+        title = " ".join(str(item["title"]).split())
+        if title.lower() in titles:
+            continue
+        difficulty = str(item.get("difficulty", "")).strip().capitalize()
+        ch = {k: item.get(k, "") for k in CHALLENGE_KEYS}
+        ch.update(
+            title=title,
+            difficulty=difficulty if difficulty in DIFFICULTIES else "Medium",
+            estimated_monthly_co2_saving_kg=int(co2) if co2.is_integer() else round(co2, 1),
+        )
+        # the model's own company field counts if it names a listed company, else the text has to
+        company = match_company(str(item.get("company") or ""), company_names)
+        company = company or match_company(f"{title} {ch.get('description', '')}", company_names)
+        if company is None:
+            continue  # pools only hold challenges built on a listed company
+        ch["company"] = company
+        if not is_feasible(ch, features):
+            continue
+        # the model repeats ids, and distinct ids can share a slug; ids key widgets and rows
+        base = ch["id"] = f"{prefix}_{_slug(item['id'])}"
+        n = 2
+        while ch["id"] in ids:
+            ch["id"] = f"{base}_{n}"
+            n += 1
+        ids.add(ch["id"])
+        titles.add(title.lower())
+        vetted.append(ch)
+    return vetted
+
+
+# (personas, companies, version) of the latest catalog; holding the data objects
+# keeps a freed catalog's id from being mistaken for a new one
+_version: Optional[Tuple[Any, Any, str]] = None
+
+
+def pool_version(personas: List[Dict[str, Any]], companies: Dict[str, Any]) -> str:
+    global _version
+    entry = _version
+    if entry is None or entry[0] is not personas or entry[1] is not companies:
+        entry = _version = (personas, companies, fingerprint(POOL_VERSION, personas, companies))
+    return entry[2]
+
+
+def generate_pool(
+    llm, personas: List[Dict[str, Any]], companies: Dict[str, Any], segment: Tuple[int, str, str, str]
+) -> Tuple[str, List[Dict[str, Any]], int]:
+    """Ask the model for one segment's pool; returns (segment key, vetted challenges, generated count)."""
+    persona_idx, housing, budget, tech = segment
+    persona = personas[persona_idx]
+    key = segment_key(persona.get("name", ""), housing, budget, tech)
+    profile = segment_profile(persona, housing, budget, tech)
+    index = get_catalog_index(personas, companies)
+    prompt = build_challenge_prompt(
+        profile, personas, companies, selection=([persona_idx], index.top_companies(profile))
+    ) + SEGMENT_INSTRUCTIONS.format(n=POOL_SIZE, description=describe_segment(persona, housing, budget, tech))
+    items = ArrayItemParser().feed(llm.generate(prompt))
+    names = [c["company_name"] for c in companies.get("companies_report", [])]
+    return key, vet(items, key, profile, names), len(items)
+
+
+def store_pool(segment: str, version: str, challenges: List[Dict[str, Any]]):
+    with db.transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO challenge_pools (segment, version, challenges_json, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(segment) DO UPDATE SET
+                version = excluded.version,
+                challenges_json = excluded.challenges_json,
+                created_at = excluded.created_at
+            """,
+            (segment, version, json.dumps(challenges, ensure_ascii=False), time.time()),
+        )
+
+
+def build_pools(
+    llm,
+    personas: List[Dict[str, Any]],
+    companies: Dict[str, Any],
+    persona_names: Sequence[str] = (),
+    force: bool = False,
+    min_size: int = 4,
+    workers: int = 1,
+    progress: Optional[Callable[[str], None]] = None,
+) -> Dict[str, int]:
+    """
+    Generate and store pools for every segment (or those of ``persona_names``)
+    without a current one. Pools with fewer than ``min_size`` vetted challenges
+    are not stored, so those users keep going to the model.
+    """
+    version = pool_version(personas, companies)
+    with db.connection() as conn:
+        current = {
+            r["segment"] for r in conn.execute("SELECT segment FROM challenge_pools WHERE version = ?", (version,))
+        }
+    todo = [
+        s for s in all_segments(personas)
+        if (not persona_names or personas[s[0]].get("name") in persona_names)
+        and (force or segment_key(personas[s[0]].get("name", ""), *s[1:]) not in current)
+    ]
+    counts = {"segments": len(todo), "stored": 0, "too_small": 0, "failed": 0, "generated": 0, "vetted": 0}
+    lock = threading.Lock()
+
+    def run(segment):
+        try:
+            key, pool, generated = generate_pool(llm, personas, companies, segment)
+        except Exception as e:
+            with lock:
+                counts["failed"] += 1
+                if progress:
+                    progress(f"{segment}: failed: {e}")
+            return
+        if len(pool) >= min_size:
+            store_pool(key, version, pool)
+        with lock:
+            counts["generated"] += generated
+            counts["vetted"] += len(pool)
+            counts["stored" if len(pool) >= min_size else "too_small"] += 1
+            if progress:
+                progress(f"{key}: {len(pool)}/{generated} challenges kept")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(run, todo))
+    return counts
+
+
+class ChallengePools:
+    """Runtime lookup of the stored pools; the parsed catalog of each segment is kept in memory."""
+
+    def __init__(self):
+        self._catalogs: Dict[str, Tuple[float, ChallengeCatalog]] = {}
+        self._lock = threading.Lock()
+
+    def lookup(
+        self, profile: Dict[str, Any], personas: List[Dict[str, Any]], companies: Dict[str, Any], k: int = 4
+    ) -> Optional[List[Dict[str, Any]]]:
+        """``k`` challenges from the profile's segment pool, personalised; None if the segment has no pool."""
+        segment = classify(profile, personas, companies)
+        with db.connection() as conn:
+            row = conn.execute(
+                "SELECT challenges_json, created_at FROM challenge_pools WHERE segment = ? AND version = ?",
+                (segment, pool_version(personas, companies)),
+            ).fetchone()
+        if row is None:
+            metrics.inc("challenge_pool.miss")
+            return None
+        with self._lock:
+            cached = self._catalogs.get(segment)
+        if cached is None or cached[0] != row["created_at"]:
+            cached = (row["created_at"], ChallengeCatalog(json.loads(row["challenges_json"])))
+            with self._lock:
+                self._catalogs[segment] = cached
+        challenges = cached[1].recommend(profile, k=k)
+        if not challenges:
+            metrics.inc("challenge_pool.miss")
+            return None
+        metrics.inc("challenge_pool.hit")
+        return challenges
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m greenmatch.segments", description="Pre-generate challenge pools per user segment"
+    )
+    parser.add_argument("command", choices=("build", "list"))
+    parser.add_argument("--persona", action="append", default=[], help="only this persona (repeatable)")
+    parser.add_argument("--force", action="store_true", help="regenerate pools that are already current")
+    parser.add_argument("--min-size", type=int, default=4, help="smallest vetted pool worth storing")
+    parser.add_argument("--workers", type=int, default=1, help="segments generated in parallel")
+    parser.add_argument("--personas", default="persona_analysis.json")
+    parser.add_argument("--companies", default="companies.json")
+    parser.add_argument("--db", help="database file (default: GREENMATCH_DB or greenmatch.db)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.DB_PATH = args.db
+    db.init_db()
+    with open(args.personas, encoding="utf-8") as f:
+        personas = json.load(f)
+    with open(args.companies, encoding="utf-8") as f:
+        companies = json.load(f)
+
+    if args.command == "list":
+        version = pool_version(personas, companies)
+        with db.connection() as conn:
+            rows = conn.execute(
+                "SELECT segment, version, challenges_json FROM challenge_pools ORDER BY segment"
+            ).fetchall()
+        for r in rows:
+            stale = "" if r["version"] == version else "  (stale)"
+            print(f"{r['segment']}: {len(json.loads(r['challenges_json']))}{stale}")
+        total = sum(1 for _ in all_segments(personas))
+        print(f"{sum(1 for r in rows if r['version'] == version)} of {total} segments have a current pool")
+        return 0
+
+    from greenmatch.llm import ResilientLLM, backend_from_env
+
+    backend = backend_from_env()
+    if backend is None:
+        print("no model backend configured (set GEMINI_API_KEY or GREENMATCH_LLM_BACKEND)", file=sys.stderr)
+        return 1
+    started = time.perf_counter()
+    counts = build_pools(
+        ResilientLLM(backend),
+        personas,
+        companies,
+        persona_names=args.persona,
+        force=args.force,
+        min_size=args.min_size,
+        workers=args.workers,
+        progress=lambda line: print(line, file=sys.stderr, flush=True),
+    )
+    print(f"done in {time.perf_counter() - started:.1f}s: {counts}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Collapse concurrent identical calls into one.
+
+``SingleFlight.do(key, fn, ...)`` runs ``fn`` once per key at a time: callers
+in the same process that arrive while a call for their key is in flight wait
+for it and get its result (or exception). Across processes the same is done
+through a lease row in ``inflight_calls``: the first process to claim the key
+runs the call, writes the JSON-encoded result into the row and keeps it there
+for ``result_ttl`` seconds; other processes poll the row instead of calling.
+A lease that runs out without a result (crashed or stuck owner) can be taken
+over, and a caller that waited ``lease_seconds`` in vain runs the call itself,
+so the worst case is the old behaviour of one call per request.
+
+With ``stream=True`` the call is passed an ``emit`` callback and every item it
+emits is forwarded to all in-process callers, including those that join late.
+Waiters get deep copies, so callers never share mutable results. A result that
+``share(result)`` rejects (e.g. a cut-off answer) only goes to the callers in
+this process: the lease is released, so waiting processes make the call again.
+"""
+import copy
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from greenmatch import db, metrics
+
+DEFAULT_LEASE_SECONDS = float(os.getenv("GREENMATCH_SINGLEFLIGHT_LEASE", "120"))
+DEFAULT_RESULT_TTL = 30.0
+POLL_INTERVAL = 0.2
+
+
+class _Flight:
+    def __init__(self):
+        self.future: Future = Future()
+        self.items: List[Any] = []
+        self.listeners: List[Callable[[Any], None]] = []
+        self.lock = threading.Lock()
+
+    def emit(self, item: Any):
+        with self.lock:
+            self.items.append(item)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(copy.deepcopy(item))
+
+    def listen(self, listener: Callable[[Any], None]):
+        with self.lock:
+            replay = list(self.items)
+            self.listeners.append(listener)
+        for item in replay:
+            listener(copy.deepcopy(item))
+
+
+class SingleFlight:
+    def __init__(
+        self,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        result_ttl: float = DEFAULT_RESULT_TTL,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[..., Any],
+        *args,
+        stream: bool = False,
+        emit: Optional[Callable[[Any], None]] = None,
+        share: Optional[Callable[[Any], bool]] = None,
+        **kwargs,
+    ) -> Any:
+        """``fn(*args, **kwargs)``, shared with every concurrent caller using the same ``key``."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if emit is not None:
+            flight.listen(emit)
+        if not leader:
+            metrics.inc("singleflight.shared")
+            # every caller gets its own copy, as if it had made the call
+            return copy.deepcopy(flight.future.result())
+
+        try:
+            if stream:
+                kwargs["emit"] = flight.emit
+            result = self._run(key, fn, args, kwargs, share)
+        except BaseException as e:
+            flight.future.set_exception(e)
+            raise
+        else:
+            flight.future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def _run(
+        self, key: str, fn: Callable[..., Any], args: tuple, kwargs: dict, share: Optional[Callable[[Any], bool]]
+    ) -> Any:
+        waited_until = time.monotonic() + self.lease_seconds
+        while True:
+            state, result = self._claim(key)
+            if state == "done":
+                metrics.inc("singleflight.remote")
+                return result
+            if state == "claimed":
+                break
+            if time.monotonic() >= waited_until:
+                metrics.inc("singleflight.gave_up")
+                return fn(*args, **kwargs)
+            time.sleep(self.poll_interval)
+
+        metrics.inc("singleflight.leader")
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            self._release(key)
+            raise
+        if share is None or share(result):
+            self._publish(key, result)
+        else:
+            metrics.inc("singleflight.not_shared")
+            self._release(key)
+        return result
+
+    def _claim(self, key: str) -> Tuple[str, Any]:
+        """("done", result) if a fresh result is stored, ("held", None) if another process runs it, else claims."""
+        # read first, so waiting processes poll without taking the write lock
+        with db.connection() as conn:
+            state = self._state(self._lease(conn, key))
+        if state[0] != "free":
+            return state
+        with db.transaction() as conn:
+            state = self._state(self._lease(conn, key))
+            if state[0] != "free":
+                return state
+            conn.execute(
+                """
+                INSERT INTO inflight_calls (key, owner, expires_at, result_json, finished_at)
+                VALUES (?, ?, ?, NULL, NULL)
+                ON CONFLICT(key) DO UPDATE SET
+                    owner = excluded.owner, expires_at = excluded.expires_at,
+                    result_json = NULL, finished_at = NULL
+                """,
+                (key, self.owner, time.time() + self.lease_seconds),
+            )
+        return "claimed", None
+
+    @staticmethod
+    def _lease(conn, key: str):
+        return conn.execute(
+            "SELECT expires_at, result_json, finished_at FROM inflight_calls WHERE key = ?", (key,)
+        ).fetchone()
+
+    def _state(self, row) -> Tuple[str, Any]:
+        now = time.time()
+        if row is not None:
+            if row["finished_at"] is not None and now - row["finished_at"] <= self.result_ttl:
+                return "done", json.loads(row["result_json"])
+            if row["finished_at"] is None and row["expires_at"] > now:
+                return "held", None
+        return "free", None
+
+    def _publish(self, key: str, result: Any):
+        try:
+            payload = json.dumps(result, ensure_ascii=False)
+        except (TypeError, ValueError):
+            self._release(key)  # not shareable across processes; in-process waiters still get it
+            return
+        now = time.time()
+        with db.transaction() as conn:
+            conn.execute(
+                "UPDATE inflight_calls SET result_json = ?, finished_at = ? WHERE key = ? AND owner = ?",
+                (payload, now, key, self.owner),
+            )
+            conn.execute("DELETE FROM inflight_calls WHERE finished_at < ?", (now - self.result_ttl,))
+
+    def _release(self, key: str):
+        with db.transaction() as conn:
+            conn.execute("DELETE FROM inflight_calls WHERE key = ? AND owner = ?", (key, self.owner))
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
@@ -0,0 +1,31 @@
+"""
+Process-wide cache for the static JSON files the app reads on every rerun.
+
+Files are parsed once and shared by all sessions; a file is re-read only when
+its modification time or size changes. The returned objects are shared between
+sessions and must be treated as read-only.
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, Tuple
+
+_cache: Dict[str, Tuple[Tuple[float, int], Any]] = {}
+_lock = threading.Lock()
+
+
+def load_json(path: str) -> Any:
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size)
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with _lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        _cache[path] = (stamp, data)
+        return data
@@ -0,0 +1,221 @@
+"""
+Offline, seedable synthetic user populations.
+
+Each persona in ``persona_analysis.json`` is turned into a ``PersonaModel``:
+an age distribution around the persona's age, housing odds from its location
+and household, and device and motivation odds from keyword matches in its
+values, attitudes and motivation text (the same patterns the recommender
+uses). A synthetic user picks a persona, samples a profile from that model,
+gets challenges from the local recommender and a plausible accept/complete
+history with timestamps spread over the last ``days`` days.
+
+Records come out in the ``greenmatch.bulk`` format, so they can be written to
+NDJSON or bulk-inserted into SQLite. User ``i`` only depends on ``(seed, i)``,
+which keeps a population reproducible and lets it be generated in shards.
+"""
+import datetime
+import random
+import re
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from greenmatch.db import hash_pw
+from greenmatch.recommender import (
+    DEVICE_PATTERNS,
+    HOUSING,
+    MOTIVATION_PATTERNS,
+    SEED_CHALLENGES,
+    ChallengeCatalog,
+    tag_companies,
+)
+from greenmatch.rewards import ACCEPT_POINTS, completion_points
+
+# Labels exactly as the profile form in main.py stores them.
+DEVICE_OPTIONS = {
+    "ev": "Electric car (EV)",
+    "pv": "Solar panels (PV)",
+    "heat_pump": "Heat pump",
+    "smart_thermostat": "Smart thermostat",
+    "smart_meter": "Smart meter",
+}
+MOTIVATION_OPTIONS = {
+    "save_money": "Save money",
+    "climate": "Protect climate",
+    "comfort": "More comfort",
+    "health": "Healthy lifestyle",
+}
+
+# Share of users owning each device before persona and housing adjustments.
+DEVICE_BASE = {"ev": 0.06, "pv": 0.08, "heat_pump": 0.06, "smart_thermostat": 0.10, "smart_meter": 0.18}
+HOUSE_DEVICES = ("pv", "heat_pump")
+SMART_DEVICES = ("smart_thermostat", "smart_meter")
+
+TECH_PATTERN = r"tech-savvy|smart home|automat|early adopter|embraces technology|ai tools|innovat|diy"
+URBAN_PATTERN = r"city|berlin|munich|urban|apartment|university"
+RURAL_PATTERN = r"rural|village|small town|farm|suburban|home with"
+FAMILY_PATTERN = r"married|kids|family|parent"
+
+FIRST_NAMES = (
+    "Anna", "Ben", "Clara", "David", "Emma", "Felix", "Hannah", "Jonas", "Julia", "Kevin", "Lena", "Leon",
+    "Maria", "Mark", "Mia", "Noah", "Paul", "Sarah", "Sophie", "Thomas", "Yusuf", "Zoe",
+)
+LAST_NAMES = (
+    "Becker", "Chen", "Fischer", "Hoffmann", "Jallow", "Keller", "König", "Lehmann", "Meyer", "Müller",
+    "Nguyen", "Schmidt", "Schneider", "Schulz", "Wagner", "Weber", "Yilmaz",
+)
+
+DEFAULT_PASSWORD = "synthetic"
+
+
+class PersonaModel:
+    def __init__(self, persona: Dict[str, Any]):
+        text = " ".join(
+            str(v) if not isinstance(v, list) else " ".join(map(str, v))
+            for k, v in persona.items()
+            if k != "name"
+        ).lower()
+        where = f"{persona.get('location', '')} {' '.join(persona.get('demographics', []))}".lower()
+        self.name = persona.get("name", "")
+        self.age = float(persona.get("age") or 40)
+        self.age_sd = max(4.0, self.age * 0.12)
+
+        if re.search(URBAN_PATTERN, where):
+            housing = {"apartment": 0.75, "house": 0.15, "other": 0.10}
+        elif re.search(RURAL_PATTERN, where):
+            housing = {"apartment": 0.20, "house": 0.70, "other": 0.10}
+        else:
+            housing = {"apartment": 0.45, "house": 0.45, "other": 0.10}
+        if re.search(FAMILY_PATTERN, where):
+            housing["house"] += 0.15
+            housing["apartment"] = max(0.05, housing["apartment"] - 0.15)
+        if "shared" in where:
+            housing["other"] += 0.3
+        self.housing_weights = [housing[h] for h in HOUSING]
+
+        tech = 1.0 if re.search(TECH_PATTERN, text) else 0.0
+        self.devices = {
+            d: base
+            + (0.25 if re.search(DEVICE_PATTERNS[d], text) else 0.0)
+            + (0.2 if d in SMART_DEVICES else 0.1) * tech
+            for d, base in DEVICE_BASE.items()
+        }
+        self.motivations = {
+            m: 0.15 + (0.55 if re.search(MOTIVATION_PATTERNS[m], text) else 0.0) for m in MOTIVATION_OPTIONS
+        }
+        self.car = 0.8 if re.search(RURAL_PATTERN, where) else 0.35 if re.search(URBAN_PATTERN, where) else 0.6
+        matched = sum(1 for p in self.motivations.values() if p > 0.5)
+        self.accept_rate = min(0.8, 0.35 + 0.1 * matched)
+        self.complete_rate = 0.55
+
+
+def sample_profile(model: PersonaModel, rng: random.Random, name: str) -> Dict[str, Any]:
+    age = int(min(90, max(16, round(rng.gauss(model.age, model.age_sd)))))
+    housing = rng.choices(HOUSING, weights=model.housing_weights)[0]
+    devices = []
+    for d, p in model.devices.items():
+        if d in HOUSE_DEVICES:
+            p *= 2.5 if housing == "house" else 0.3
+        if rng.random() < p:
+            devices.append(DEVICE_OPTIONS[d])
+    motivations = [label for m, label in MOTIVATION_OPTIONS.items() if rng.random() < model.motivations[m]]
+    if not motivations:
+        motivations.append(MOTIVATION_OPTIONS[max(model.motivations, key=model.motivations.get)])
+
+    habits = ["I commute by car" if rng.random() < model.car else rng.choice(("I cycle to work", "I take the train"))]
+    if rng.random() < 0.3:
+        habits.append(f"work from home {rng.randint(1, 4)} days")
+    if rng.random() < 0.3:
+        habits.append("like long showers")
+    return {
+        "name": name,
+        "age": age,
+        "country": "Germany",
+        "housing": housing,
+        "devices": devices,
+        "motivations": motivations,
+        "custom_motivation": "",
+        "habits": ", ".join(habits),
+    }
+
+
+def _timestamp(t: datetime.datetime) -> str:
+    return t.strftime("%Y-%m-%d %H:%M:%S")  # CURRENT_TIMESTAMP format
+
+
+class PopulationGenerator:
+    """``generator.user(i)`` is the i-th synthetic user record; ``generator.users(n)`` streams n of them."""
+
+    def __init__(
+        self,
+        personas: Sequence[Dict[str, Any]],
+        company_names: Sequence[str] = (),
+        seed: int = 0,
+        days: int = 90,
+        end: Optional[datetime.datetime] = None,
+        password: str = DEFAULT_PASSWORD,
+        challenges_per_user: int = 4,
+    ):
+        if not personas:
+            raise ValueError("at least one persona is needed")
+        self.models = [PersonaModel(p) for p in personas]
+        self.company_names = list(company_names)
+        self.seed = seed
+        self.days = days
+        self.end = end or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+        self.password_hash = hash_pw(password)
+        self.k = challenges_per_user
+        self.catalog = ChallengeCatalog(SEED_CHALLENGES)
+        self._offers: Dict[Tuple, List[Dict[str, Any]]] = {}
+
+    def _offer(self, profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # the recommender only looks at these parts of a profile
+        key = (
+            profile["housing"],
+            tuple(profile["devices"]),
+            tuple(profile["motivations"]),
+            profile["age"] < 40,
+            profile["age"] >= 65,
+            "car" in profile["habits"],
+        )
+        offer = self._offers.get(key)
+        if offer is None:
+            offer = tag_companies(self.catalog.recommend(profile, k=self.k + 2), self.company_names)
+            self._offers[key] = offer
+        return offer
+
+    def user(self, i: int) -> Dict[str, Any]:
+        rng = random.Random(f"{self.seed}:{i}")
+        model = rng.choice(self.models)
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        profile = sample_profile(model, rng, name)
+
+        window = datetime.timedelta(days=self.days)
+        created = self.end - window * rng.random()
+        offer = self._offer(profile)
+        picked = sorted(rng.sample(range(len(offer)), min(self.k, len(offer))))
+        challenges, tokens = [], 0
+        for index in picked:
+            ch = dict(offer[index], status="offered")
+            if rng.random() < model.accept_rate:
+                accepted = created + (self.end - created) * rng.random() ** 2
+                ch.update(status="accepted", accepted_at=_timestamp(accepted))
+                tokens += ACCEPT_POINTS
+                if rng.random() < model.complete_rate:
+                    completed = min(self.end, accepted + datetime.timedelta(days=rng.expovariate(1 / 7)))
+                    ch.update(status="completed", completed_at=_timestamp(completed))
+                    tokens += completion_points(ch)
+            challenges.append(ch)
+
+        return {
+            "email": f"synthetic{i}@example.com",
+            "name": name,
+            "password_hash": self.password_hash,
+            "created_at": _timestamp(created),
+            "persona": model.name,
+            "profile": profile,
+            "tokens": tokens,
+            "challenges": challenges,
+        }
+
+    def users(self, n: int, start: int = 0) -> Iterator[Dict[str, Any]]:
+        for i in range(start, start + n):
+            yield self.user(i)
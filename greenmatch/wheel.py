@@ -0,0 +1,300 @@
+"""
+Server-side rewards wheel: weighted draws with limited stock.
+
+Each campaign is a table of rewards in ``wheel_rewards``: a weight, a position
+on the wheel and a stock (NULL = unlimited) next to an ``awarded`` counter.
+Draws are O(1) samples from an alias table (Vose's method) over the rewards
+still in stock; the table is rebuilt when a reward sells out and every
+``TABLE_TTL_SECONDS`` (to pick up restocks), not per spin.
+
+A spin is one short write transaction: it pays ``cost`` points through the
+reward ledger, decrements the drawn reward with ``stock > 0`` in the WHERE
+clause and records the draw in ``wheel_draws``. Writers are serialized by
+SQLite, so thousands of concurrent spins cannot oversell a prize; a draw that
+hits a reward another process just sold out resamples from the rewards left,
+which hands the sold-out weight to the others in proportion. Draws are unique
+per (user, ``request_id``), so a retried or double-clicked spin returns the
+first draw instead of charging again. The client only animates the result.
+
+    python -m greenmatch.wheel status
+    python -m greenmatch.wheel stock free_month 25
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from greenmatch import db, metrics
+from greenmatch.rewards import record
+
+DEFAULT_CAMPAIGN = "default"
+SPIN_COST = int(os.getenv("GREENMATCH_WHEEL_COST", "20"))
+# Rebuild the alias table at least this often, to pick up restocks and weight changes.
+TABLE_TTL_SECONDS = 30.0
+
+# Wheel order; weights are relative, stock None means unlimited.
+DEFAULT_REWARDS = [
+    {"id": "free_month", "label": "Free Month of Energy", "weight": 1, "stock": 10},
+    {"id": "bill_discount", "label": "20% Bill Discount", "weight": 4, "stock": 200},
+    {"id": "gift_card", "label": "$100 Gift Card", "weight": 2, "stock": 50},
+    {"id": "priority_support", "label": "Priority Support", "weight": 12, "stock": None},
+    {"id": "solar_consultation", "label": "Solar Panel Consultation", "weight": 10, "stock": 500},
+    {"id": "efficiency_audit", "label": "Energy Efficiency Audit", "weight": 12, "stock": None},
+    {"id": "smart_device", "label": "Smart Home Device", "weight": 3, "stock": 100},
+    {"id": "vip_status", "label": "VIP Customer Status", "weight": 16, "stock": None},
+    {"id": "try_again", "label": "Try Again", "weight": 40, "stock": None},
+]
+
+
+class WheelError(Exception):
+    pass
+
+
+class NotEnoughPoints(WheelError):
+    pass
+
+
+class SoldOut(WheelError):
+    pass
+
+
+class AliasTable:
+    """Vose's alias method: O(n) to build, two random numbers per O(1) sample."""
+
+    def __init__(self, weights: Sequence[float]):
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError("alias table needs at least one positive weight")
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # whatever is left is 1.0 up to rounding
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def __len__(self) -> int:
+        return len(self.prob)
+
+    def sample(self, rng: random.Random) -> int:
+        i = int(rng.random() * len(self.prob))
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+
+def load_campaign(campaign: str, rewards: List[Dict[str, Any]]) -> int:
+    """Insert the rewards a campaign does not have yet; stock and counters of existing ones are kept."""
+    with db.transaction() as conn:
+        added = 0
+        for position, r in enumerate(rewards):
+            cur = conn.execute(
+                """
+                INSERT INTO wheel_rewards (campaign, reward_id, position, label, weight, stock)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(campaign, reward_id) DO NOTHING
+                """,
+                (campaign, r["id"], position, r["label"], float(r["weight"]), r.get("stock")),
+            )
+            added += cur.rowcount
+    return added
+
+
+def set_stock(campaign: str, reward_id: str, stock: Optional[int]) -> bool:
+    with db.transaction() as conn:
+        cur = conn.execute(
+            "UPDATE wheel_rewards SET stock = ? WHERE campaign = ? AND reward_id = ?",
+            (stock, campaign, reward_id),
+        )
+    return bool(cur.rowcount)
+
+
+def _draw_from_row(row, labels: Dict[str, Tuple[int, str]]) -> Dict[str, Any]:
+    index, label = labels.get(row["reward_id"], (-1, row["reward_id"]))
+    return {
+        "id": row["id"],
+        "reward_id": row["reward_id"],
+        "label": label,
+        "index": index,
+        "cost": row["cost"],
+        "created_at": row["created_at"],
+    }
+
+
+class Wheel:
+    """Draws for one campaign; share one instance per process (it caches the alias table)."""
+
+    def __init__(
+        self,
+        campaign: str = DEFAULT_CAMPAIGN,
+        rewards: Optional[List[Dict[str, Any]]] = None,
+        cost: int = SPIN_COST,
+        rng: Optional[random.Random] = None,
+    ):
+        self.campaign = campaign
+        self.cost = cost
+        self.rng = rng or random.SystemRandom()
+        if rewards:
+            load_campaign(campaign, rewards)
+        # (built_at, reward ids, table over those ids); None until the first spin
+        self._table: Optional[Tuple[float, List[str], Optional[AliasTable]]] = None
+        self._lock = threading.Lock()
+
+    def rewards(self) -> List[Dict[str, Any]]:
+        """Every reward of the campaign in wheel order, with stock left (None = unlimited)."""
+        with db.connection() as conn:
+            rows = conn.execute(
+                """
+                SELECT reward_id, label, weight, stock, awarded FROM wheel_rewards
+                WHERE campaign = ? ORDER BY position
+                """,
+                (self.campaign,),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def _labels(self, conn) -> Dict[str, Tuple[int, str]]:
+        rows = conn.execute(
+            "SELECT reward_id, label FROM wheel_rewards WHERE campaign = ? ORDER BY position", (self.campaign,)
+        ).fetchall()
+        return {r["reward_id"]: (i, r["label"]) for i, r in enumerate(rows)}
+
+    def _build(self, conn) -> Tuple[float, List[str], Optional[AliasTable]]:
+        rows = conn.execute(
+            """
+            SELECT reward_id, weight FROM wheel_rewards
+            WHERE campaign = ? AND weight > 0 AND (stock IS NULL OR stock > 0) ORDER BY position
+            """,
+            (self.campaign,),
+        ).fetchall()
+        ids = [r["reward_id"] for r in rows]
+        table = AliasTable([r["weight"] for r in rows]) if rows else None
+        metrics.inc("wheel.table_rebuild")
+        return time.monotonic(), ids, table
+
+    def _take(self, conn) -> str:
+        """Sample a reward in stock and take one unit of it, inside the caller's transaction."""
+        with self._lock:
+            cached = self._table
+        fresh = False
+        if cached is None or time.monotonic() - cached[0] > TABLE_TTL_SECONDS:
+            cached, fresh = self._build(conn), True
+        while True:
+            _, ids, table = cached
+            if table is None:
+                raise SoldOut(f"every reward of campaign {self.campaign!r} is gone")
+            reward_id = ids[table.sample(self.rng)]
+            cur = conn.execute(
+                """
+                UPDATE wheel_rewards SET stock = stock - 1, awarded = awarded + 1
+                WHERE campaign = ? AND reward_id = ? AND (stock IS NULL OR stock > 0)
+                """,
+                (self.campaign, reward_id),
+            )
+            if cur.rowcount:
+                if fresh:
+                    with self._lock:
+                        self._table = cached
+                return reward_id
+            # sold out since the table was built; the rebuild reads under our write lock, so it is exact
+            metrics.inc("wheel.sold_out")
+            cached, fresh = self._build(conn), True
+
+    def _repeat(self, user_id: int, request_id: str, conn=None) -> Optional[Dict[str, Any]]:
+        if conn is None:
+            with db.connection() as conn:
+                return self._repeat(user_id, request_id, conn)
+        row = conn.execute(
+            "SELECT * FROM wheel_draws WHERE user_id = ? AND request_id = ?", (user_id, request_id)
+        ).fetchone()
+        if row is None:
+            return None
+        metrics.inc("wheel.duplicate")
+        return dict(_draw_from_row(row, self._labels(conn)), repeat=True)
+
+    def spin(self, user_id: int, request_id: str) -> Dict[str, Any]:
+        """
+        Pay ``cost`` points and draw once. Calling again with the same
+        ``request_id`` returns the same draw with ``repeat=True`` and charges
+        nothing. Raises ``NotEnoughPoints`` or ``SoldOut``.
+        """
+        # a repeat is answered from a read, without queueing for the write lock
+        repeat = self._repeat(user_id, request_id)
+        if repeat is not None:
+            return repeat
+        with metrics.span("wheel.spin"), db.transaction() as conn:
+            repeat = self._repeat(user_id, request_id, conn)
+            if repeat is not None:
+                return repeat
+
+            state = conn.execute("SELECT tokens FROM user_state WHERE user_id = ?", (user_id,)).fetchone()
+            points = (state["tokens"] or 0) if state else 0
+            if points < self.cost:
+                raise NotEnoughPoints(f"a spin costs {self.cost} points, you have {points}")
+
+            reward_id = self._take(conn)
+            now = time.time()
+            cur = conn.execute(
+                """
+                INSERT INTO wheel_draws (user_id, campaign, request_id, reward_id, cost, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, self.campaign, request_id, reward_id, self.cost, now),
+            )
+            record(conn, user_id, f"wheel:{cur.lastrowid}", "spin", -self.cost)
+            row = conn.execute("SELECT * FROM wheel_draws WHERE id = ?", (cur.lastrowid,)).fetchone()
+            draw = _draw_from_row(row, self._labels(conn))
+        metrics.inc(f"wheel.reward.{reward_id}")
+        return dict(draw, repeat=False)
+
+    def history(self, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+        with db.connection() as conn:
+            rows = conn.execute(
+                """
+                SELECT * FROM wheel_draws WHERE user_id = ? AND campaign = ?
+                ORDER BY id DESC LIMIT ?
+                """,
+                (user_id, self.campaign, limit),
+            ).fetchall()
+            labels = self._labels(conn)
+        return [_draw_from_row(r, labels) for r in rows]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m greenmatch.wheel", description="Rewards wheel stock")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="rewards, weights, stock left and awarded")
+    stock = sub.add_parser("stock", help="set the stock of a reward")
+    stock.add_argument("reward_id")
+    stock.add_argument("stock", help="units left, or 'unlimited'")
+    parser.add_argument("--campaign", default=DEFAULT_CAMPAIGN)
+    parser.add_argument("--db", help="database file (default: GREENMATCH_DB or greenmatch.db)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.DB_PATH = args.db
+    db.init_db()
+    if args.campaign == DEFAULT_CAMPAIGN:
+        load_campaign(DEFAULT_CAMPAIGN, DEFAULT_REWARDS)
+
+    if args.command == "stock":
+        value = None if args.stock == "unlimited" else int(args.stock)
+        if not set_stock(args.campaign, args.reward_id, value):
+            print(f"no reward {args.reward_id!r} in campaign {args.campaign!r}", file=sys.stderr)
+            return 1
+    for r in Wheel(args.campaign).rewards():
+        stock_left = "unlimited" if r["stock"] is None else r["stock"]
+        print(f"{r['reward_id']:<20} weight {r['weight']:>5g}  stock {stock_left:>9}  awarded {r['awarded']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,53 @@
 import os
 import json
 import re
-import sqlite3
-import hashlib
-from typing import Dict, Any, List
+import logging
+import time
+from typing import Dict, Any, Callable, List, Optional, Tuple
 
 import streamlit as st
 from PIL import Image
 
-
-
-with open("persona_analysis.json", "r", encoding="utf-8") as f:
-    ARCHETYPE_PERSONAS = json.load(f)
-
-with open("companies.json", "r", encoding="utf-8") as f:
-    COMPANY_LISTS = json.load(f)
-
-try:
-    import google.generativeai as genai
-    GEMINI_IMPORTED = True
-except ImportError:
-    GEMINI_IMPORTED = False
+from greenmatch.db import (
+    connection,
+    init_db,
+    hash_pw,
+    create_user,
+    get_user_by_email,
+    load_state,
+    save_state_fields,
+)
+from greenmatch.admission import BACKGROUND, INTERACTIVE, admission_from_env
+from greenmatch.analytics import is_admin, leaderboard, rank_for
+from greenmatch.background import WorkerPool
+from greenmatch.challenge_cache import ChallengeCache, fingerprint, profile_key
+from greenmatch.images import VerdictCache, verdict_key
+from greenmatch.jsonstream import ArrayItemParser
+from greenmatch.llm import ResilientLLM, backend_from_env
+from greenmatch.metrics import REGISTRY, observe, span, start_exporter, timed
+from greenmatch.proofs import ProofStore, ProofWorkerPool, enqueue_proof, latest_proof_job
+from greenmatch.prompts import PromptStats, build_challenge_prompt
+from greenmatch.recommender import SEED_CHALLENGES, ChallengeCatalog, load_cached_challenges
+from greenmatch.recommender import tag_companies as tag_challenge_companies
+from greenmatch.retrieval import get_catalog_index
+from greenmatch.rewards import ACCEPT_POINTS, award, balance, completion_points
+from greenmatch.segments import ChallengePools
+from greenmatch.singleflight import SingleFlight
+from greenmatch.persistence import STATE_FIELDS, DirtyTracker, StateCache, WriteBehindQueue
+from greenmatch.static_data import load_json
+
+
+
+# Parsed once per process and shared read-only by all sessions (see greenmatch.static_data).
+ARCHETYPE_PERSONAS = load_json("persona_analysis.json")
+COMPANY_LISTS = load_json("companies.json")
+
+# Bump when the challenge prompt changes so cached generations are not reused.
+PROMPT_VERSION = 5
+
+logger = logging.getLogger("greenmatch.app")
+
+_rerun_started = time.perf_counter()
 
 st.set_page_config(
     page_title="Green Impact Wallet – GreenMatch",
@@ -29,125 +56,39 @@ st.set_page_config(
 
 
 @st.cache_resource(show_spinner=False)
-def get_connection():
-    conn = sqlite3.connect("greenmatch.db", check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
-def init_db():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            name TEXT,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS user_state (
-            user_id INTEGER PRIMARY KEY,
-            profile_json TEXT,
-            challenges_json TEXT,
-            accepted_ids_json TEXT,
-            completed_ids_json TEXT,
-            tokens INTEGER DEFAULT 0,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-        """
-    )
-    conn.commit()
+def get_state_cache() -> StateCache:
+    return StateCache(load_state)
 
 
-def hash_pw(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+@st.cache_resource(show_spinner=False)
+def get_write_behind() -> WriteBehindQueue:
+    return WriteBehindQueue(save_state_fields, on_written=get_state_cache().apply)
 
 
-def create_user(email: str, name: str, password: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO users (email, name, password_hash) VALUES (?, ?, ?)",
-        (email.lower().strip(), name.strip(), hash_pw(password)),
-    )
-    conn.commit()
-    return cur.lastrowid
-
-
-def get_user_by_email(email: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE email = ?", (email.lower().strip(),))
-    return cur.fetchone()
-
-
-def load_state(user_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM user_state WHERE user_id = ?", (user_id,))
-    row = cur.fetchone()
-    if not row:
-        return None
-    return {
-        "profile": json.loads(row["profile_json"]) if row["profile_json"] else None,
-        "challenges": json.loads(row["challenges_json"]) if row["challenges_json"] else [],
-        "accepted_ids": set(json.loads(row["accepted_ids_json"])) if row["accepted_ids_json"] else set(),
-        "completed_ids": set(json.loads(row["completed_ids_json"])) if row["completed_ids_json"] else set(),
-        "tokens": row["tokens"] or 0,
-    }
-
-
-def save_state(user_id: int, profile, challenges, accepted_ids, completed_ids, tokens: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO user_state (user_id, profile_json, challenges_json,
-                                accepted_ids_json, completed_ids_json, tokens)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            profile_json = excluded.profile_json,
-            challenges_json = excluded.challenges_json,
-            accepted_ids_json = excluded.accepted_ids_json,
-            completed_ids_json = excluded.completed_ids_json,
-            tokens = excluded.tokens
-        """,
-        (
-            user_id,
-            json.dumps(profile) if profile else None,
-            json.dumps(challenges) if challenges else None,
-            json.dumps(list(accepted_ids)) if accepted_ids is not None else None,
-            json.dumps(list(completed_ids)) if completed_ids is not None else None,
-            int(tokens),
-        ),
-    )
-    conn.commit()
+def session_state_snapshot() -> Dict[str, Any]:
+    return {f: st.session_state[f] for f in STATE_FIELDS}
 
 
+def persist_session_state(user_id: int, flush: bool = False):
+    """Stage only the fields that changed since the last persist; optionally write them now."""
+    queue = get_write_behind()
+    queue.stage(user_id, st.session_state.state_tracker.changes(session_state_snapshot()))
+    if flush:
+        queue.flush(user_id)
 
-@st.cache_resource(show_spinner=False)
-def get_gemini_model():
-    if not GEMINI_IMPORTED:
-        return None
 
-    api_key = None
-    try:
-        api_key = os.getenv("GEMINI_API_KEY")
-    except Exception:
-        pass
-    api_key = api_key or os.getenv("GEMINI_API_KEY")
 
-    if not api_key:
-        return None
+@st.cache_resource(show_spinner=False)
+def get_llm() -> Optional[ResilientLLM]:
+    """The configured model backend (Gemini, or the local stub) or None; see greenmatch.llm."""
+    backend = backend_from_env()
+    # one admission controller per process: concurrency, rate, per-user quota and priorities
+    return ResilientLLM(backend, admission=admission_from_env()) if backend is not None else None
+
 
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel("gemini-2.5-pro")
+@st.cache_resource(show_spinner=False)
+def get_prompt_stats() -> PromptStats:
+    return PromptStats()
 
 
 def _extract_json(text: str) -> Any:
@@ -159,102 +100,165 @@ def _extract_json(text: str) -> Any:
     return json.loads(text)
 
 
-def generate_challenges_with_gemini(profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+def _is_challenge(item: Any) -> bool:
+    return isinstance(item, dict) and all(item.get(k) for k in ("id", "title", "description"))
+
+
+@timed("llm.generate_challenges")
+def generate_challenges_with_gemini(
+    profile: Dict[str, Any],
+    emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+    user_id: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], bool]:
     """
     Ask Gemini to generate 3–4 personalised challenges, using the archetype personas
     as a mental model. The UI stays user-based, but the AI can think in terms of
     Julia / Kevin / Hannah / Felix etc. when shaping the content.
+
+    The answer is streamed and every challenge is passed to ``emit`` as soon as
+    its JSON object is complete. Returns the challenges and whether the answer
+    arrived in full; a broken-off answer still returns the challenges before the cut.
     """
-    model = get_gemini_model()
-    if model is None:
-        return []
-
-    system_prompt = """
-You are a helpful AI assistant. You design personalised, realistic sustainability challenges.
-
-You have access to a library of archetype personas (ARCHETYPE_PERSONAS) which describe values, challenges, and motivations. You also have access to a curated list of sustainable startups (COMPANY_LISTS).
-
-Your task is to analyze the provided user_profile and perform the following steps:
-
-1.  **Internal Persona Matching:** Silently determine which **one or two** archetype personas the user is closest to based on their age, values, tech attitude, income, housing, and habits.
-
-2.  **Company-Driven Challenge Generation:** Generate 3–4 challenges that are **directly inspired by the products or services** in the `COMPANY_LISTS`.
-
-Each challenge must:
-*   Be linked to a specific company. The action you describe should be something a user could achieve using a product from the list. Mention the company by name as a concrete example (e.g., "...using a kit from YUMA or Priwatt," or "...by switching to WILDBAGS.").
-*   Be feasible for the user. The suggested company and product must respect the user's housing situation, financial constraints, and comfort with technology.
-*   Reflect the persona's priorities. The challenge's tone and goal must align with the values of the matched persona (e.g., cost-saving for Sarah, convenience for Clara, tech optimization for Felix).
-*   Offer clear impact. Focus on realistic energy or CO₂ reduction and/or clear cost savings.
-
----
-#### **Important Constraints and Nuances:**
-
-*   **Financial Sensitivity (e.g., Sarah, Julia):** For users on a low income, **only** suggest challenges based on low-cost or free company offerings. For example, switching to WILDPLASTIC trash bags is a great fit; suggesting a Priwatt solar system (which requires a large upfront investment) is **not**.
-*   **Tech Skepticism (e.g., David):** For users who are older, overwhelmed, or tech-averse, suggest simple, offline actions. A good match would be hosting bees with Wildbiene + Partner. A poor match would be setting up a smart EV charger from Entratek.
-*   **Tech-Savvy & DIY (e.g., Felix, Thomas):** For these users, you **should** propose challenges that involve smart-home tech, data monitoring, or hands-on installation, such as the offerings from Priwatt, YUMA, or Entratek.
-*   **Privacy-Aware (e.g., Ben):** When suggesting tech solutions for this persona, prioritize companies that offer local control or have a clear privacy focus.
-*   **Activist & Ethical Focus (e.g., Lena, Hannah):** For these users, highlight the systemic or community impact of a company's mission. WILDPLASTIC (fair wages for collectors) or Wildbiene + Partner (supporting agricultural pollination) are excellent examples.
-*   **Concrete Actions:** Always describe a specific behavior: what to do, how often, for how long.
-*   **CO₂ Savings:** For each challenge, provide a rough monthly CO₂ saving as a *positive number* in kg (typically between 3 and 100 kg/month).
-
----
-#### **Example of a Good Response Flow:**
-
-*   **User Profile:** "I'm 45, own my home with a garden, and recently bought an electric car. I'm a software engineer, so I'm comfortable with tech and like optimizing things to save money and be more efficient."
-*   **Internal Persona Match:** Felix (tech-savvy, data-driven) and Thomas (DIY, homeowner).
-*   **Company Match from List:** Entratek GmbH (specializes in EV charging solutions).
-*   **Generated Challenge:**
-    *   **Title:** "Install an Intelligent EV Charging Station"
-    *   **Description:** "Optimize your electric vehicle charging by installing a smart wallbox from a provider like Entratek. This allows you to schedule charging for off-peak hours and monitor your energy consumption."
-    *   **Why_it_fits:** "As a tech-savvy homeowner with an EV, this project aligns perfectly with your interest in optimization and efficiency, giving you direct control over your energy costs."
-
----
-#### **Output Format (VERY IMPORTANT):**
-
-Return ONLY valid JSON with exactly this structure. Do not add any text or explanation outside of the JSON block.
-
-```json
-{
-  "challenges": [
-    {
-      "id": "short_unique_id",
-      "title": "short title",
-      "description": "1–3 short sentences explaining what to do, referencing a company from the list.",
-      "difficulty": "Easy | Medium | Advanced",
-      "estimated_monthly_co2_saving_kg": number,
-      "why_it_fits": "1–2 sentences explaining why this challenge and the suggested company's approach suit THIS user."
-    }
-  ]
-}
-
-- DO NOT include persona names in the JSON.
-- DO NOT add extra explanation outside of the JSON.
-"""
+    llm = get_llm()
+    if llm is None:
+        return [], False
 
-    prompt = (
-        system_prompt
-        + "\n\nARCHETYPE_PERSONAS:\n"
-        + json.dumps(ARCHETYPE_PERSONAS, ensure_ascii=False)
-        + "\n\nUser profile:\n"
-        + json.dumps(profile, ensure_ascii=False)
-        + "\n\nCOMPANY_LISTS:\n"
-        + json.dumps(COMPANY_LISTS, ensure_ascii=False)
-    )
+    # the raw profile: retrieval weighs the numeric age, which the cache key only buckets
+    selection = get_catalog_index(ARCHETYPE_PERSONAS, COMPANY_LISTS).select(profile)
+    prompt = build_challenge_prompt(profile, ARCHETYPE_PERSONAS, COMPANY_LISTS, selection=selection)
+    size = get_prompt_stats().record("challenges", prompt)
+    logger.info("challenge prompt: %(chars)d chars, ~%(est_tokens)d tokens", size)
 
+    challenges: List[Dict[str, Any]] = []
+    parser = ArrayItemParser()
+    text = []
+    started = time.perf_counter()
     try:
-        resp = model.generate_content(prompt)
-        data = _extract_json(resp.text)
-        return data.get("challenges", [])
+        for chunk in llm.stream(prompt, user=user_id, priority=INTERACTIVE):
+            text.append(chunk)
+            for item in parser.feed(chunk):
+                if not _is_challenge(item):
+                    continue
+                if not challenges:
+                    observe("llm.first_challenge", time.perf_counter() - started)
+                challenges.append(item)
+                if emit is not None:
+                    emit(item)
     except Exception as e:
-        st.warning(f"Gemini error (using fallback challenges): {e}")
-        return []
+        # runs on a background worker, so there is no page to show a warning on
+        logger.warning("Gemini error after %d challenges (using what arrived): %s", len(challenges), e)
+        return challenges, False
+
+    if not challenges:
+        # not an array of objects after all; try the whole answer the old way
+        try:
+            challenges = [c for c in _extract_json("".join(text)).get("challenges", []) if _is_challenge(c)]
+        except Exception as e:
+            logger.warning("Gemini answer could not be parsed (using fallback challenges): %s", e)
+    return challenges, True
+
+
+@st.cache_resource(show_spinner=False)
+def get_llm_pool() -> WorkerPool:
+    return WorkerPool()
+
+
+@st.cache_resource(show_spinner=False)
+def get_challenge_cache() -> ChallengeCache:
+    return ChallengeCache()
+
+
+@st.cache_resource(show_spinner=False)
+def get_single_flight() -> SingleFlight:
+    """Collapses identical concurrent model calls, also across app processes on this host."""
+    return SingleFlight()
+
+
+# [personas, companies, version] for the data objects it was computed from; holding
+# them keeps their ids from being reused by a reloaded catalog
+_generation_version: List[Any] = [None, None, None]
+
+
+def generation_version() -> str:
+    """Hash of the prompt version and the static data it embeds; changes when either does."""
+    personas, companies, version = _generation_version
+    if personas is not ARCHETYPE_PERSONAS or companies is not COMPANY_LISTS:
+        version = fingerprint(PROMPT_VERSION, ARCHETYPE_PERSONAS, COMPANY_LISTS)
+        _generation_version[:] = [ARCHETYPE_PERSONAS, COMPANY_LISTS, version]
+    return version
+
+
+def cached_challenges(profile: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    return get_challenge_cache().get(profile_key(profile, generation_version()))
 
 
-def analyze_image_with_gemini(image: Image.Image, challenge: Dict[str, Any]) -> str:
-    model = get_gemini_model()
-    if model is None:
+@st.cache_resource(show_spinner=False)
+def get_challenge_pools() -> ChallengePools:
+    return ChallengePools()
+
+
+def pooled_challenges(profile: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """Challenges from the profile's pre-generated segment pool (see greenmatch.segments), if there is one."""
+    return get_challenge_pools().lookup(profile, ARCHETYPE_PERSONAS, COMPANY_LISTS)
+
+
+def generate_challenges(
+    profile: Dict[str, Any],
+    user_id: Optional[int] = None,
+    emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """generate_challenges_with_gemini behind the persistent per-profile cache."""
+    key = profile_key(profile, generation_version())
+    cached = get_challenge_cache().get(key)
+    if cached is not None:
+        return cached
+    # identical profiles submitted at the same time share one model call; a cut-off
+    # answer is not handed to other processes, which make the call themselves
+    challenges, _ = get_single_flight().do(
+        f"challenges:{key}", _generate_and_cache, profile, key, user_id,
+        stream=True, emit=emit, share=lambda result: bool(result[1]),
+    )
+    return challenges
+
+
+def _generate_and_cache(
+    profile: Dict[str, Any],
+    key: str,
+    user_id: Optional[int] = None,
+    emit: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """The challenges and whether the answer was complete."""
+    challenges, complete = generate_challenges_with_gemini(profile, emit, user_id)
+    # a cut-off answer is shown but not cached, so the next request asks again
+    if challenges and complete:
+        get_challenge_cache().put(key, challenges)
+        get_challenge_catalog().add(challenges, keep_why=False)
+    return challenges, complete
+
+
+@st.cache_resource(show_spinner=False)
+def get_verdict_cache() -> VerdictCache:
+    return VerdictCache()
+
+
+@timed("llm.analyze_image")
+def analyze_image_with_gemini(
+    image: Image.Image, challenge: Dict[str, Any], image_key: Optional[str] = None, user_id: Optional[int] = None
+) -> str:
+    """
+    ``image`` should come from preprocess_image; ``image_key`` is its fingerprint for
+    the verdict cache. The call counts against ``user_id``'s model quota.
+    """
+    llm = get_llm()
+    if llm is None:
         return "Gemini not configured – treat this as manual confirmation."
 
+    cache_key = verdict_key(challenge, image_key) if image_key else None
+    if cache_key:
+        cached = get_verdict_cache().get(cache_key)
+        if cached is not None:
+            return cached
+
     prompt = f"""
 You check if a photo could plausibly be evidence for a sustainability challenge.
 
@@ -269,73 +273,52 @@ Reply in 3–4 short sentences:
 No scores, just a friendly explanation.
 """
 
-    try:
-        resp = model.generate_content([prompt, image])
-        return resp.text
-    except Exception as e:
-        return f"Error while calling Gemini: {e}"
+    get_prompt_stats().record("proof_check", prompt)
+    # errors propagate so the proof worker can retry the job
+    if cache_key:
+        # a double-clicked check (or the same photo checked twice at once) makes one call
+        verdict = get_single_flight().do(
+            "verdict:" + ":".join(cache_key), llm.generate, [prompt, image], user=user_id, priority=BACKGROUND
+        )
+    else:
+        verdict = llm.generate([prompt, image], user=user_id, priority=BACKGROUND)
+    if cache_key:
+        get_verdict_cache().put(cache_key, verdict)
+    return verdict
 
 
 
-def simple_fallback_challenges(profile: Dict[str, Any]) -> List[Dict[str, Any]]:
-    motivations = " ".join(profile.get("motivations", [])).lower()
-    devices = " ".join(profile.get("devices", [])).lower()
-    housing = profile.get("housing", "apartment")
+@st.cache_resource(show_spinner=False)
+def get_proof_store() -> ProofStore:
+    return ProofStore()
+
+
+@st.cache_resource(show_spinner=False)
+def get_proof_workers() -> ProofWorkerPool:
+    return ProofWorkerPool(analyze_image_with_gemini, store=get_proof_store())
+
+
+def tag_companies(challenges: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Attach the first company from COMPANY_LISTS named in each challenge, for per-company stats."""
+    return tag_challenge_companies(challenges, (c["company_name"] for c in COMPANY_LISTS.get("companies_report", [])))
+
+
+@st.cache_resource(show_spinner=False)
+def get_challenge_catalog() -> ChallengeCatalog:
+    catalog = ChallengeCatalog(SEED_CHALLENGES)
+    with connection() as conn:
+        catalog.add(load_cached_challenges(conn), keep_why=False)
+    return catalog
 
-    challenges: List[Dict[str, Any]] = []
 
-    challenges.append({
-        "id": "heat_1c",
-        "title": "Lower room temperature by 1°C",
-        "description": "Keep your rooms about 1°C cooler than usual for the next 4 weeks.",
-        "difficulty": "Easy",
-        "estimated_monthly_co2_saving_kg": 20,
-        "why_it_fits": "A small, low-effort adjustment that usually doesn’t reduce comfort."
-    })
-
-    challenges.append({
-        "id": "standby",
-        "title": "Turn off standby devices at night",
-        "description": "Identify at least 5 devices and switch them fully off every night.",
-        "difficulty": "Easy",
-        "estimated_monthly_co2_saving_kg": 10,
-        "why_it_fits": "Quick action with visible impact on both your bill and emissions."
-    })
-
-    if "car" in profile.get("habits", "").lower():
-        challenges.append({
-            "id": "car_free_day",
-            "title": "Choose one car-free workday",
-            "description": "Once per week, use public transport, bike or walk instead of driving.",
-            "difficulty": "Medium",
-            "estimated_monthly_co2_saving_kg": 25,
-            "why_it_fits": "Targets your commuting pattern and also supports a healthier routine."
-        })
-
-    if "ev" in devices:
-        challenges.append({
-            "id": "night_charging",
-            "title": "Charge your EV mainly at night",
-            "description": "Schedule your EV charging to off-peak or high-renewable hours.",
-            "difficulty": "Medium",
-            "estimated_monthly_co2_saving_kg": 30,
-            "why_it_fits": "You own an EV, so small changes in charging time can have a big effect."
-        })
-
-    if housing == "house":
-        challenges.append({
-            "id": "shower_shorter",
-            "title": "Shorten hot showers",
-            "description": "Reduce each shower by around 2 minutes and slightly lower the hot water temperature.",
-            "difficulty": "Medium",
-            "estimated_monthly_co2_saving_kg": 15,
-            "why_it_fits": "Water heating is a major energy consumer in houses."
-        })
-
-    return challenges[:4]
+def recommend_challenges(profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Local, model-free recommendation from the challenge catalog."""
+    return get_challenge_catalog().recommend(profile, k=4)
 
 
 init_db()
+start_exporter()
+get_proof_workers()  # also drains jobs left over from a previous run
 
 if "user" not in st.session_state:
     st.session_state.user = None        # row from users table
@@ -351,6 +334,10 @@ if "tokens" not in st.session_state:
     st.session_state.tokens = 0
 if "state_loaded" not in st.session_state:
     st.session_state.state_loaded = False
+if "state_tracker" not in st.session_state:
+    st.session_state.state_tracker = DirtyTracker()
+if "generation_job" not in st.session_state:
+    st.session_state.generation_job = None  # BackgroundJob producing AI challenges
 
 
 def total_potential_co2() -> int:
@@ -361,6 +348,188 @@ def total_potential_co2() -> int:
     )
 
 
+def apply_finished_generation():
+    """Swap in AI challenges once the background job is done (or drop it after its deadline)."""
+    job = st.session_state.generation_job
+    if job is None or not (job.done() or job.expired()):
+        return
+    st.session_state.generation_job = None
+    # past the deadline, keep whatever the stream delivered so far
+    challenges = job.result(default=None) or list(job.partial)
+    if not challenges:
+        st.toast("Kept your starter challenges – the AI could not personalise them this time.")
+        return
+    challenges = tag_companies(challenges)
+    ids = {c["id"] for c in challenges}
+    # starter challenges the user already accepted stay on the list
+    kept = [
+        c for c in st.session_state.challenges
+        if c["id"] in st.session_state.accepted_ids and c["id"] not in ids
+    ]
+    st.session_state.challenges = challenges + kept
+    st.toast("Your personalised challenges are ready ✨")
+
+
+@st.fragment(run_every=0.5)
+def generation_status(user_id: int):
+    """Streamed challenges appear here one by one until the job finishes and they join the list."""
+    job = st.session_state.generation_job
+    if job is None:
+        return
+    if job.done() or job.expired():
+        st.rerun(scope="app")
+    st.info(f"⏳ Personalising your challenges with AI… ({job.elapsed():.0f}s) "
+            "Your starter challenges below are ready to use meanwhile.")
+    shown = {c["id"] for c in st.session_state.challenges}
+    for ch in list(job.partial):
+        if ch["id"] not in shown:
+            shown.add(ch["id"])
+            challenge_card(user_id, tag_companies([ch])[0], preview=True)
+
+
+def render_proof_job(job: Dict[str, Any]):
+    thumb = get_proof_store().thumb_path(job["image_sha"])
+    if os.path.exists(thumb):
+        st.image(thumb, width=120)
+    if job["status"] == "done":
+        st.markdown("**AI feedback:**")
+        st.write(job["verdict"])
+    elif job["status"] == "failed":
+        st.warning(job["verdict"] or "We could not check this photo.")
+    else:
+        st.caption("⏳ Your photo is queued for an AI check…")
+
+
+@st.fragment(run_every=2)
+def poll_proof_job(user_id: int, challenge_id: str):
+    job = latest_proof_job(user_id, challenge_id)
+    if job and job["status"] not in ("queued", "running"):
+        st.rerun(scope="app")
+    if job:
+        render_proof_job(job)
+
+
+def accept_challenge(user_id: int, ch: Dict[str, Any]):
+    st.session_state.accepted_ids.add(ch["id"])
+    # small instant reward for accepting a challenge
+    st.session_state.tokens, paid = award(user_id, ch["id"], "accept", ACCEPT_POINTS)
+    points_toast(paid)
+    st.session_state.summary_stale = True
+    # a fragment rerun never reaches the persist at the end of the script
+    persist_session_state(user_id)
+
+
+def complete_challenge(user_id: int, ch: Dict[str, Any]):
+    st.session_state.completed_ids.add(ch["id"])
+    st.session_state.tokens, paid = award(user_id, ch["id"], "complete", completion_points(ch))
+    points_toast(paid)
+    st.session_state.summary_stale = True
+    persist_session_state(user_id)
+
+
+def points_toast(points: int):
+    # Elements drawn from a callback land at the top of the app, so the clicked
+    # card shows the toast, not the callback.
+    # A challenge re-offered after a refresh is not paid again, so nothing to show.
+    if points:
+        st.session_state.points_earned = points
+
+
+def progress_summary():
+    tokens = st.session_state.tokens
+    potential = total_potential_co2()
+    st.metric("Reward points", tokens)
+    st.caption(level_from_tokens(tokens))
+    st.progress(min(1.0, potential / 100.0), text=f"🌍 {potential} kg CO₂ / month potential")
+    st.caption(
+        f"Accepted: {len(st.session_state.accepted_ids)} • Completed: {len(st.session_state.completed_ids)}"
+    )
+
+
+@st.fragment
+def proof_panel(user_id: int, ch: Dict[str, Any]):
+    cid = ch["id"]
+    proof = st.file_uploader(
+        "Upload image",
+        key=f"proof_{cid}",
+        type=["png", "jpg", "jpeg"],
+        label_visibility="collapsed",
+    )
+    if st.button("Ask AI to check", key=f"check_{cid}"):
+        if proof is None:
+            st.warning("Please upload a photo first.")
+        else:
+            enqueue_proof(user_id, ch, get_proof_store().save(proof))
+            get_proof_workers().notify()
+    job = latest_proof_job(user_id, cid)
+    if job and job["status"] in ("queued", "running"):
+        poll_proof_job(user_id, cid)
+    elif job:
+        render_proof_job(job)
+
+
+@st.fragment
+@timed("ui.challenge_card")
+def challenge_card(user_id: int, ch: Dict[str, Any], summary=None, preview: bool = False):
+    # Buttons use callbacks, so the card is drawn once in its new state and a
+    # click reruns this card only, not the profile form or the other cards.
+    # The counters it changed are redrawn into the summary placeholder at the top.
+    # A preview (streamed, not yet on the list) has no buttons: the swap-in
+    # replaces the list, and what was done on the preview would be lost.
+    cid = ch["id"]
+    accepted = cid in st.session_state.accepted_ids
+    completed = cid in st.session_state.completed_ids
+    earned = st.session_state.pop("points_earned", None)
+    if earned:
+        st.toast(f"+{earned} points · {st.session_state.tokens} in total 🎉")
+    if st.session_state.pop("summary_stale", False) and summary is not None:
+        with summary.container():
+            progress_summary()
+
+    with st.container(border=True):
+        header_cols = st.columns([3, 1])
+        with header_cols[0]:
+            st.markdown(f"**{ch['title']}**")
+        with header_cols[1]:
+            st.caption(ch.get("difficulty", ""))
+            st.caption(f"≈ {ch.get('estimated_monthly_co2_saving_kg', 0)} kg CO₂ / month")
+
+        st.write(ch["description"])
+        st.caption(f"Why this fits you: {ch['why_it_fits']}")
+        if preview:
+            st.caption("⏳ You can accept this challenge as soon as personalising is done.")
+            return
+
+        btn_cols = st.columns(3)
+        with btn_cols[0]:
+            if not accepted:
+                st.button("Accept", key=f"accept_{cid}", on_click=accept_challenge, args=(user_id, ch))
+            else:
+                st.success("Accepted")
+
+        with btn_cols[1]:
+            if accepted and not completed:
+                st.button("Mark completed", key=f"done_{cid}", on_click=complete_challenge, args=(user_id, ch))
+            elif completed:
+                st.success("Completed ✔️")
+
+        with btn_cols[2]:
+            with st.expander("Upload proof (optional)", expanded=False):
+                proof_panel(user_id, ch)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def top_savers(limit: int = 5) -> List[Dict[str, Any]]:
+    # shared by all sessions; a leaderboard a few seconds stale is fine
+    return leaderboard(limit)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def leaderboard_rank(user_id: int, points: int) -> Optional[int]:
+    # ties are broken by user id, like the leaderboard, so the key includes the user
+    return rank_for(user_id, points)
+
+
 def level_from_tokens(tokens: int) -> str:
     if tokens >= 150:
         return "🌟 Planet Hero"
@@ -378,8 +547,8 @@ if st.session_state.user is None:
 
     with login_tab:
         st.markdown("#### Welcome back")
-        email = st.text_input("Email")
-        password = st.text_input("Password", type="password")
+        email = st.text_input("Email", key="l_email")
+        password = st.text_input("Password", type="password", key="l_pw")
         if st.button("Login"):
             row = get_user_by_email(email)
             if row and row["password_hash"] == hash_pw(password):
@@ -415,15 +584,20 @@ if st.session_state.user is None:
 user = st.session_state.user
 
 if not st.session_state.state_loaded:
-    state = load_state(user["id"])
+    # another session of this user may still have changes waiting in the queue
+    get_write_behind().flush(user["id"])
+    # shared by all sessions of this process, so reconnects and extra tabs skip the DB
+    state = get_state_cache().get(user["id"])
     if state:
         st.session_state.profile = state["profile"]
         st.session_state.challenges = state["challenges"]
         st.session_state.accepted_ids = state["accepted_ids"]
         st.session_state.completed_ids = state["completed_ids"]
-        st.session_state.tokens = state["tokens"]
+        st.session_state.state_tracker.reset(state)
     st.session_state.state_loaded = True
 
+apply_finished_generation()
+
 
 top_left, top_right = st.columns([3, 1])
 
@@ -431,15 +605,34 @@ with top_left:
     st.markdown(f"### 👋 Hello, **{user['name'] or user['email']}**")
 
 with top_right:
-    tokens = st.session_state.tokens
-    st.metric("Reward points", tokens)
-    st.caption(level_from_tokens(tokens))
+    # the ledger is authoritative: points earned in another tab show up here too
+    st.session_state.tokens = balance(user["id"])
+    # a placeholder, so a clicked card can redraw the counters without a full rerun
+    summary = st.empty()
+    st.session_state.pop("summary_stale", None)
+    with summary.container():
+        progress_summary()
 
 st.markdown("---")
 
 st.sidebar.markdown(f"Logged in as **{user['email']}**")
+if is_admin(user["email"]):
+    with st.sidebar.expander("📈 Performance (this process)"):
+        st.dataframe(REGISTRY.summary(), hide_index=True)
+        st.caption(f"User state cache: {get_state_cache().stats()}")
+        if get_llm() is not None and get_llm().admission is not None:
+            st.caption(f"Model admission: {get_llm().admission.stats()}")
+        st.code(REGISTRY.render_prometheus(), language="text")
+with st.sidebar.expander("🏆 Leaderboard"):
+    for entry in top_savers():
+        st.markdown(f"{entry['rank']}. {entry['name']} — {entry['points']} pts")
+    my_rank = leaderboard_rank(user["id"], st.session_state.tokens)
+    st.caption(f"Your rank: #{my_rank}" if my_rank else "Earn points to join the leaderboard.")
 if st.sidebar.button("Logout"):
-    for key in ["user", "profile", "challenges", "accepted_ids", "completed_ids", "tokens", "state_loaded"]:
+    persist_session_state(user["id"], flush=True)
+    for key in ["user", "profile", "challenges", "accepted_ids", "completed_ids", "tokens",
+                "state_loaded", "state_tracker", "generation_job", "wheel_draw", "wheel_error",
+                "wheel_request_id", "points_earned", "summary_stale"]:
         if key in st.session_state:
             del st.session_state[key]
     st.rerun()
@@ -525,109 +718,46 @@ with left:
 
         st.session_state.profile = profile
 
-        with st.spinner("Talking to AI to craft your personal challenges…"):
-            challenges = generate_challenges_with_gemini(profile)
-        if not challenges:
-            challenges = simple_fallback_challenges(profile)
+        # Show something right away: a cached AI result if this profile was seen before,
+        # then the segment's pre-generated pool, otherwise the local starter set while
+        # the AI works in the background.
+        challenges = cached_challenges(profile)
+        if challenges is None:
+            challenges = pooled_challenges(profile)
+        st.session_state.generation_job = None
+        if challenges is None:
+            challenges = recommend_challenges(profile)
+            llm = get_llm()
+            if llm is not None and llm.breaker.state != "open":
+                st.session_state.generation_job = get_llm_pool().submit(
+                    generate_challenges, profile, user["id"], stream=True
+                )
+        challenges = tag_companies(challenges)
 
         st.session_state.challenges = challenges
         st.session_state.accepted_ids = set()
         st.session_state.completed_ids = set()
-        st.session_state.tokens = st.session_state.tokens  # keep existing rewards
 
-        save_state(user["id"], st.session_state.profile,
-                   st.session_state.challenges,
-                   st.session_state.accepted_ids,
-                   st.session_state.completed_ids,
-                   st.session_state.tokens)
+        # a fresh set of challenges is worth writing straight away
+        persist_session_state(user["id"], flush=True)
 
-        st.success("Your challenges have been updated on the right ✅")
-
-    st.markdown("---")
-    st.markdown("#### 🌍 Monthly potential")
-    potential = total_potential_co2()
-    st.metric("CO₂ you could save / month", f"{potential} kg")
-    if potential == 0:
-        st.caption("Accept at least one challenge to see your potential impact.")
-    else:
-        st.progress(min(1.0, potential / 100.0))
+        if st.session_state.generation_job is None:
+            st.success("Your challenges have been updated on the right ✅")
 
 
 with right:
     st.markdown("### 🔮 Your personalised challenges")
+    if st.session_state.generation_job is not None:
+        generation_status(user["id"])
 
     if not st.session_state.challenges:
         st.info("Fill out or update your profile on the left and click **Generate / refresh my challenges**.")
     else:
         for ch in st.session_state.challenges:
-            cid = ch["id"]
-            accepted = cid in st.session_state.accepted_ids
-            completed = cid in st.session_state.completed_ids
-
-            with st.container(border=True):
-                header_cols = st.columns([3, 1])
-                with header_cols[0]:
-                    st.markdown(f"**{ch['title']}**")
-                with header_cols[1]:
-                    st.caption(ch.get("difficulty", ""))
-                    st.caption(f"≈ {ch.get('estimated_monthly_co2_saving_kg', 0)} kg CO₂ / month")
-
-                st.write(ch["description"])
-                st.caption(f"Why this fits you: {ch['why_it_fits']}")
-
-                btn_cols = st.columns(3)
-                with btn_cols[0]:
-                    if not accepted:
-                        if st.button("Accept", key=f"accept_{cid}"):
-                            st.session_state.accepted_ids.add(cid)
-                            # small instant reward for accepting a challenge
-                            st.session_state.tokens += 3
-                    else:
-                        st.success("Accepted")
-
-                with btn_cols[1]:
-                    if accepted and not completed:
-                        if st.button("Mark completed", key=f"done_{cid}"):
-                            st.session_state.completed_ids.add(cid)
-                            # bigger reward on completion: based on CO2 impact
-                            gain = max(5, ch.get("estimated_monthly_co2_saving_kg", 0) // 5)
-                            st.session_state.tokens += gain
-                    elif completed:
-                        st.success("Completed ✔️")
-
-                with btn_cols[2]:
-                    with st.expander("Upload proof (optional)", expanded=False):
-                        proof = st.file_uploader(
-                            "Upload image",
-                            key=f"proof_{cid}",
-                            type=["png", "jpg", "jpeg"],
-                            label_visibility="collapsed",
-                        )
-                        if st.button("Ask AI to check", key=f"check_{cid}"):
-                            if proof is None:
-                                st.warning("Please upload a photo first.")
-                            else:
-                                img = Image.open(proof)
-                                with st.spinner("Checking with AI…"):
-                                    result = analyze_image_with_gemini(img, ch)
-                                st.markdown("**AI feedback:**")
-                                st.write(result)
-
-        st.markdown("---")
-        accepted_count = len(st.session_state.accepted_ids)
-        completed_count = len(st.session_state.completed_ids)
-        st.caption(
-            f"Accepted: {accepted_count} • Completed: {completed_count} • "
-            f"Potential monthly CO₂ saving: {total_potential_co2()} kg • "
-            f"Reward points: {st.session_state.tokens} ({level_from_tokens(st.session_state.tokens)})"
-        )
+            challenge_card(user["id"], ch, summary)
+
+# Persist whatever changed during this run; unchanged reruns do not touch the DB
+with span("persist"):
+    persist_session_state(user["id"])
+observe("rerun", time.perf_counter() - _rerun_started)
 
-# Persist state at the end of the run
-save_state(
-    user["id"],
-    st.session_state.profile,
-    st.session_state.challenges,
-    st.session_state.accepted_ids,
-    st.session_state.completed_ids,
-    st.session_state.tokens,
-)
@@ -0,0 +1,48 @@
+import streamlit as st
+
+from greenmatch.analytics import daily_impact, impact_by, impact_totals, is_admin, leaderboard
+from greenmatch.db import init_db
+from greenmatch.metrics import REGISTRY
+from greenmatch.prompts import prompt_sizes
+
+st.set_page_config(page_title="GreenMatch – Admin dashboard", layout="wide")
+
+user = st.session_state.get("user")
+if not user or not is_admin(user["email"]):
+    st.warning("This page is only available to administrators. Log in on the main page first.")
+    st.stop()
+
+init_db()
+
+st.title("📊 Impact & engagement")
+st.caption("Read from incrementally maintained aggregates; refreshes on every visit.")
+
+totals = impact_totals()
+cols = st.columns(4)
+cols[0].metric("Challenges accepted", totals["accepted"])
+cols[1].metric("Challenges completed", totals["completed"])
+cols[2].metric("Potential CO₂ / month", f"{totals['co2_accepted']:.0f} kg")
+cols[3].metric("Realised CO₂ / month", f"{totals['co2_completed']:.0f} kg")
+
+days = daily_impact(30)
+if days:
+    st.markdown("#### Last 30 active days")
+    st.line_chart({"accepted": [d["accepted"] for d in days], "completed": [d["completed"] for d in days]})
+    st.caption(f"{days[0]['day']} – {days[-1]['day']}")
+
+tabs = st.tabs(["By company", "By difficulty", "By housing"])
+for tab, dimension in zip(tabs, ("company", "difficulty", "housing")):
+    with tab:
+        rows = impact_by(dimension)
+        if rows:
+            st.dataframe(rows, hide_index=True)
+        else:
+            st.info("No accepted challenges yet.")
+
+st.markdown("#### 🏆 Leaderboard")
+st.dataframe(leaderboard(20), hide_index=True)
+
+sizes = prompt_sizes(REGISTRY.counter_values())
+if sizes:
+    st.markdown("#### 📏 Prompt sizes (this process)")
+    st.dataframe(sizes, hide_index=True)
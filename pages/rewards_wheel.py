@@ -0,0 +1,86 @@
+import time
+import uuid
+
+import streamlit as st
+
+from components.spinning_wheel import spinning_wheel
+from greenmatch.db import init_db
+from greenmatch.rewards import balance
+from greenmatch.wheel import DEFAULT_CAMPAIGN, DEFAULT_REWARDS, Wheel, WheelError
+
+st.set_page_config(page_title="GreenMatch – Rewards wheel", page_icon="🎁")
+
+user = st.session_state.get("user")
+if not user:
+    st.warning("Log in on the main page first to spin the rewards wheel.")
+    st.stop()
+
+init_db()
+
+
+@st.cache_resource
+def get_wheel() -> Wheel:
+    return Wheel(DEFAULT_CAMPAIGN, DEFAULT_REWARDS)
+
+
+def spin(user_id: int):
+    # The request id lives in the session until its draw has been shown, so a
+    # double or late click replays that draw instead of paying for a new one.
+    request_id = st.session_state.wheel_request_id
+    try:
+        st.session_state.wheel_draw = dict(get_wheel().spin(user_id, request_id), request_id=request_id)
+        st.session_state.wheel_error = None
+    except WheelError as e:
+        st.session_state.wheel_error = str(e)
+    st.session_state.tokens = balance(user_id)
+
+
+if "wheel_request_id" not in st.session_state:
+    st.session_state.wheel_request_id = uuid.uuid4().hex
+
+wheel = get_wheel()
+points = balance(user["id"])
+st.session_state.tokens = points
+
+st.title("🎁 Rewards wheel")
+st.write(f"Spend **{wheel.cost}** reward points per spin. Prizes are drawn on our side while stock lasts.")
+st.metric("Reward points", points)
+
+st.button(
+    "Spin",
+    type="primary",
+    on_click=spin,
+    args=(user["id"],),
+    disabled=points < wheel.cost,
+)
+if st.session_state.get("wheel_error"):
+    st.error(st.session_state.wheel_error)
+
+rewards = wheel.rewards()
+draw = st.session_state.get("wheel_draw")
+spinning_wheel(
+    [r["label"] for r in rewards],
+    target_index=draw["index"] if draw else None,
+    spin_id=draw["id"] if draw else None,
+    idle_text="Press Spin to try your luck!",
+)
+if draw and draw.get("request_id") == st.session_state.wheel_request_id:
+    # shown: the next click is a new spin
+    st.session_state.wheel_request_id = uuid.uuid4().hex
+
+limited = [r for r in rewards if r["stock"] is not None]
+if limited:
+    st.caption(" · ".join(f"{r['label']}: {r['stock']} left" for r in limited))
+
+history = wheel.history(user["id"])
+if history:
+    st.markdown("#### Your spins")
+    rows = [
+        {
+            "Prize": d["label"],
+            "Points": -d["cost"],
+            "When": time.strftime("%Y-%m-%d %H:%M", time.localtime(d["created_at"])),
+        }
+        for d in history
+    ]
+    st.dataframe(rows, hide_index=True)